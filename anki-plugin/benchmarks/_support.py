@@ -0,0 +1,78 @@
+"""
+_support.py - helpers shared by the benchmark scripts
+
+The add-on's source directory is a package with relative imports whose
+name is chosen by Anki at install time, so the benchmarks load it under a
+fixed name instead of relying on the directory name.
+"""
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict
+
+ROOT = Path(__file__).resolve().parents[2]
+ADDON_SOURCE = ROOT / 'anki-plugin' / 'src'
+TW_PLUGIN_SOURCE = ROOT / 'tw-plugin'
+PACKAGE_NAME = 'tiddlyremember'
+
+
+#: Modules of the add-on the benchmarks use, which the package doesn't import
+#: itself until a sync is started.
+SUBMODULES = ('timing', 'twnote', 'twimport', 'ankisync')
+
+
+def load_addon() -> ModuleType:
+    """
+    Import the add-on package as 'tiddlyremember', along with SUBMODULES,
+    and return it.
+    """
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, ADDON_SOURCE / '__init__.py',
+        submodule_search_locations=[str(ADDON_SOURCE)])
+    assert spec is not None and spec.loader is not None
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)  # type: ignore
+    for name in SUBMODULES:
+        importlib.import_module(f'{PACKAGE_NAME}.{name}')
+    return package
+
+
+def tiddlywiki_binary() -> str:
+    "The TiddlyWiki command to benchmark against; override with $TIDDLYWIKI."
+    return os.environ.get('TIDDLYWIKI', 'tiddlywiki')
+
+
+def environment(tw_binary: str) -> Dict[str, Any]:
+    "Describe the machine and tool versions a set of results was taken with."
+    def version(cmd):
+        try:
+            return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  check=True).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'node': version(['node', '--version']),
+        'tiddlywiki': version([tw_binary, '--version']),
+    }
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    "Dump a result document as pretty-printed JSON, or to stdout for '-'."
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
@@ -0,0 +1,137 @@
+"""
+bench_clozeparse.py - micro-benchmark for clozeparse.ankify_clozes()
+
+Times the current cloze transformer against the original
+Occlusion/str.format implementation (kept below as a reference) over a corpus
+of real cloze strings, taken from the remembercz calls in the documentation
+wiki, and synthetic ones. Outputs of the two implementations are compared
+for every string the reference can handle.
+
+Usage: python bench_clozeparse.py [--synthetic N] [--repeat N] [--seed N]
+"""
+import argparse
+from collections import Counter
+import itertools
+from pathlib import Path
+import random
+import re
+import sys
+import timeit
+from typing import Iterable, List, Optional, Sequence
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'anki-plugin' / 'src'))
+
+import clozeparse  # pylint: disable=wrong-import-position
+
+
+### Reference implementation (TiddlyRemember 1.1.1) ###
+class _Occlusion:
+    def __init__(self, placeholder_index: int, raw_text: str) -> None:
+        self.placeholder_index = placeholder_index
+        self.anki_index: Optional[int] = None
+        m = re.match(r'^c(?P<index>[1-9][0-9]*)::(?P<text>.*)', raw_text)
+        if m:
+            self.anki_index = int(m.group('index'))
+            self.text = m.group('text')
+        else:
+            self.text = raw_text
+
+    @property
+    def placeholder(self) -> str:
+        return "{%i}" % self.placeholder_index
+
+    @property
+    def anki_occlusion(self) -> str:
+        return "{{c%i::%s}}" % (self.anki_index, self.text)
+
+
+def reference_ankify_clozes(text: str) -> str:
+    "The original ankify_clozes(), unchanged apart from names."
+    def next_occlusion_number(seq: Sequence[int]) -> Iterable[int]:
+        if not seq:
+            return itertools.count(1, 1)
+        c = Counter(seq)
+        return itertools.chain(
+            (i for i in range(1, max(seq)) if c[i] == 0),
+            itertools.count(max(seq)+1, 1))
+
+    occlusions: List[_Occlusion] = []
+    def mark_occlusion(match):
+        o = _Occlusion(len(occlusions), match.group(1))
+        occlusions.append(o)
+        return o.placeholder
+    placeholder_text = re.sub(r'{([^}]*)}', mark_occlusion, text)
+
+    deferred = [o for o in occlusions if o.anki_index is None]
+    used = [o.anki_index for o in occlusions if o.anki_index is not None]
+    for index, occlusion in zip(next_occlusion_number(used), deferred):
+        occlusion.anki_index = index
+    return placeholder_text.format(*(i.anki_occlusion for i in occlusions))
+
+
+### Corpus ###
+def real_corpus() -> List[str]:
+    "Cloze texts used in remembercz calls in the documentation wiki."
+    call_re = re.compile(r'<<remembercz\s+"[^"]*"\s+"([^"]*)"')
+    texts = []
+    for tid in (ROOT / 'docs' / 'tiddlers').glob('*.tid'):
+        texts.extend(call_re.findall(tid.read_text(encoding='utf-8')))
+    return texts
+
+
+def synthetic_corpus(count: int, rng: random.Random) -> List[str]:
+    "Random sentences with a mix of implicit and explicit occlusions."
+    words = ("the mitochondria is powerhouse of cell spaced repetition "
+             "improves long term retention TiddlyWiki stores notes in tiddlers "
+             "Anki schedules reviews using intervals").split()
+    texts = []
+    for _ in range(count):
+        pieces = []
+        for _ in range(rng.randint(5, 60)):
+            word = rng.choice(words)
+            roll = rng.random()
+            if roll < 0.08:
+                word = "{%s}" % word
+            elif roll < 0.12:
+                word = "{c%i::%s}" % (rng.randint(1, 6), word)
+            pieces.append(word)
+        texts.append(' '.join(pieces) + '.')
+    return texts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--synthetic', type=int, default=5000,
+                        help="number of synthetic cloze strings to generate")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="timing repetitions; the best is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = real_corpus() + synthetic_corpus(args.synthetic, random.Random(args.seed))
+
+    mismatches = [t for t in corpus
+                  if reference_ankify_clozes(t) != clozeparse.ankify_clozes(t)]
+    if mismatches:
+        sys.exit(f"Output differs from the reference for {len(mismatches)} "
+                 f"strings, e.g. {mismatches[0]!r}.")
+
+    def run(func):
+        return lambda: [func(t) for t in corpus]
+
+    timings = {
+        'reference': min(timeit.repeat(run(reference_ankify_clozes),
+                                       number=1, repeat=args.repeat)),
+        'current': min(timeit.repeat(run(clozeparse.ankify_clozes),
+                                     number=1, repeat=args.repeat)),
+    }
+
+    print(f"{len(corpus)} cloze strings, best of {args.repeat}.")
+    base = timings['reference']
+    for name, seconds in timings.items():
+        print(f"  {name:<15} {seconds*1000:9.2f} ms  {base/seconds:6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
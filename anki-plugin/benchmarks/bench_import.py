@@ -0,0 +1,127 @@
+"""
+bench_import.py - measure how much the add-on adds to Anki's startup time
+
+Imports the add-on in a fresh interpreter under 'python -X importtime', the
+way Anki does at startup (with aqt already imported), then imports the
+modules a sync needs, and reports the cumulative import time of each phase.
+With --baseline, the same is measured for the add-on as of another git
+revision, showing how much work was moved off startup.
+
+Usage: python bench_import.py [--baseline REV] [--runs N] [--output FILE]
+"""
+import argparse
+import io
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List
+
+from _support import ADDON_SOURCE, PACKAGE_NAME, ROOT, write_results
+
+#: Modules a sync needs, which should not be imported at startup.
+SYNC_MODULES = ('syncdialog', 'settings', 'ankisync', 'twimport', 'twnote')
+
+CHILD = """
+import sys
+sys.path.insert(0, {path!r})
+try:
+    import aqt  # as in Anki, which imports aqt before loading add-ons
+    from PyQt5 import QtGui, QtWidgets
+except ImportError:
+    pass
+sys.stderr.write("@@ startup\\n")
+import {package}
+sys.stderr.write("@@ sync\\n")
+for name in {modules!r}:
+    try:
+        __import__({package!r} + "." + name)
+    except ImportError:
+        pass
+sys.stderr.write("@@ end\\n")
+"""
+
+
+def _phase_times(importtime_output: str) -> Dict[str, float]:
+    """
+    Sum the cumulative times (in ms) of the top-level imports logged by
+    -X importtime in each phase delimited by '@@' markers.
+    """
+    phases: Dict[str, float] = {}
+    phase = None
+    for line in importtime_output.splitlines():
+        if line.startswith('@@ '):
+            phase = line[3:]
+            phases.setdefault(phase, 0.0)
+        elif line.startswith('import time:') and phase is not None:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Nested imports are indented below the module importing them;
+            # only count each top-level import once.
+            if cumulative.strip().isdigit() and not name.startswith('   '):
+                phases[phase] += int(cumulative) / 1000
+    phases.pop('end', None)
+    return phases
+
+
+def measure(addon_source: Path, runs: int) -> Dict[str, Any]:
+    "Import a copy of the add-on /runs/ times and report median phase times."
+    with TemporaryDirectory() as tmpdir:
+        shutil.copytree(addon_source, Path(tmpdir) / PACKAGE_NAME,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        code = CHILD.format(path=tmpdir, package=PACKAGE_NAME,
+                            modules=SYNC_MODULES)
+        samples: List[Dict[str, float]] = []
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  cwd=tmpdir)
+            if proc.returncode:
+                # Revisions before the lazy imports need Anki installed.
+                error = proc.stderr.decode().strip().splitlines()[-1]
+                sys.exit(f"Importing the add-on from {addon_source} failed: {error}")
+            samples.append(_phase_times(proc.stderr.decode()))
+    return {phase: statistics.median(s[phase] for s in samples)
+            for phase in samples[0]}
+
+
+def _export_revision(rev: str, target: Path) -> Path:
+    "Write the add-on source as of git revision /rev/ under /target/."
+    relative = ADDON_SOURCE.relative_to(ROOT).as_posix()
+    archive = subprocess.run(['git', 'archive', '--format=tar', rev, relative],
+                             stdout=subprocess.PIPE, check=True, cwd=ROOT).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return target / relative
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--baseline', metavar='REV',
+                        help="also measure the add-on as of this git revision")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="interpreter launches per measurement; the median is used")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {'current': measure(ADDON_SOURCE, args.runs)}
+    if args.baseline:
+        with TemporaryDirectory() as tmpdir:
+            results[args.baseline] = measure(
+                _export_revision(args.baseline, Path(tmpdir)), args.runs)
+
+    for label, phases in results.items():
+        print(f"{label:>12}: startup {phases['startup']:8.1f} ms, "
+              f"first sync {phases['sync']:8.1f} ms")
+    if args.baseline:
+        saved = results[args.baseline]['startup'] - results['current']['startup']
+        print(f"Startup import time saved: {saved:.1f} ms")
+    if args.output:
+        write_results(args.output, {'benchmark': 'import', 'runs': args.runs,
+                                    'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+bench_memory.py - peak memory of extracting notes from a large wiki
+
+Writes rendered tiddlers in the format the TiddlyRememberParseable template
+produces, as if TiddlyWiki had just rendered a wiki with many notes, then
+parses them in fresh interpreters in two ways:
+
+* set: collect every note with twimport's parser before using any, as
+  find_notes() does;
+* stream: handle the notes one at a time as iter_notes() yields them,
+  keeping only their IDs, as the command-line extractor does.
+
+and reports the peak resident memory of each. Node and TiddlyWiki are not
+needed, so this scales to hundreds of thousands of notes quickly.
+
+Usage: python bench_memory.py [--notes 100000] [--notes-per-tiddler 5]
+"""
+import argparse
+import html
+from pathlib import Path
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import urllib.parse
+from typing import Any, Dict
+
+from _support import load_addon, write_results
+
+CHILD = """
+import sys
+from pathlib import Path
+sys.path.insert(0, {here!r})
+from _support import load_addon
+addon = load_addon()
+from tiddlyremember import util
+from tiddlyremember.twimport import RENDERED_FILE_EXTENSION, _iter_paths
+
+util.reset_peak_rss()
+before = util.peak_rss()
+paths = sorted(Path({render!r}).glob('*.' + RENDERED_FILE_EXTENSION))
+if {mode!r} == 'set':
+    notes = set()
+    for _, found in _iter_paths(paths, 'bench', None):
+        notes.update(found)
+    count = len(notes)
+else:
+    seen = set()
+    for _, found in _iter_paths(paths, 'bench', None):
+        for note in found:
+            seen.add(note.id_)
+    count = len(seen)
+print(count, before, util.peak_rss())
+"""
+
+
+def _question(i: int) -> str:
+    return (f'<div class="rememberq"><div class="rquestion"><div>Q:</div>'
+            f'<p>What is the {i}th fact about {html.escape("<things>")}?</p></div>'
+            f'<div class="ranswer"><div>A:</div><p>It is fact number {i}, '
+            f'which is remembered for the benchmark.</p></div>'
+            f'<div class="rid">[{20200101000000000 + i}]</div>'
+            f'<div class="tr-reference"></div></div>')
+
+
+def _cloze(i: int) -> str:
+    return (f'<div class="remembercz"><span class="cloze-text">The {{{i}th}} '
+            f'cloze of the {{benchmark}} wiki.</span>'
+            f'<div class="rid">[{20200101000000000 + i}]</div>'
+            f'<div class="tr-reference"></div></div>')
+
+
+def write_rendered(target: Path, notes: int, notes_per_tiddler: int) -> int:
+    """
+    Write rendered tiddlers containing /notes/ notes in total to /target/.
+    Return the number of tiddlers written.
+    """
+    target.mkdir(parents=True, exist_ok=True)
+    tiddlers = 0
+    for start in range(0, notes, notes_per_tiddler):
+        body = ''.join((_cloze if i % 3 == 0 else _question)(i)
+                       for i in range(start, min(start + notes_per_tiddler, notes)))
+        title = urllib.parse.quote(f"Rendered Tiddler {tiddlers:07d}", safe='')
+        (target / f"{title}.html").write_text(
+            '<ul id="anki-decks"><li>Benchmark</li></ul>'
+            '<ul id="anki-tags"><li>bench</li></ul>'
+            f'<p>Some prose around the notes.</p>{body}', encoding='utf-8')
+        tiddlers += 1
+    return tiddlers
+
+
+def measure(render: Path, mode: str) -> Dict[str, Any]:
+    "Parse the tiddlers in /render/ in a fresh interpreter and report its memory."
+    code = CHILD.format(here=str(Path(__file__).resolve().parent),
+                        render=str(render), mode=mode)
+    proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                          check=True)
+    count, before, peak = proc.stdout.decode().split()
+    if peak == 'None':
+        sys.exit("Peak memory usage can't be measured on this platform.")
+    return {'notes': int(count), 'baseline_bytes': int(before),
+            'peak_bytes': int(peak), 'growth_bytes': int(peak) - int(before)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--notes-per-tiddler', type=int, default=5)
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+    load_addon()  # fail early if the add-on's dependencies are missing
+
+    with TemporaryDirectory() as tmpdir:
+        render = Path(tmpdir) / 'render'
+        tiddlers = write_rendered(render, args.notes, args.notes_per_tiddler)
+        print(f"Wrote {tiddlers} rendered tiddlers with {args.notes} notes.")
+        results = {mode: measure(render, mode) for mode in ('set', 'stream')}
+
+    for mode, result in results.items():
+        print(f"{mode:>8}: {result['notes']} notes, peak "
+              f"{result['peak_bytes'] / 2**20:.1f} MB "
+              f"(+{result['growth_bytes'] / 2**20:.1f} MB while parsing)")
+    if args.output:
+        write_results(args.output, {'benchmark': 'memory', 'notes': args.notes,
+                                    'notes_per_tiddler': args.notes_per_tiddler,
+                                    'tiddlers': tiddlers, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
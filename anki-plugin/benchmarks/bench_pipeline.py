@@ -0,0 +1,125 @@
+"""
+bench_pipeline.py - time the note extraction pipeline on synthetic wikis
+
+For each wiki size, a folder wiki and a single-file wiki are generated with
+wikigen.py, then run through the stages of twimport.find_notes() one at a
+time -- folderify (file wikis only), render and parse -- and finally end to
+end. Results are written as JSON so they can be compared across revisions.
+
+Only node and TiddlyWiki are required; nothing is downloaded.
+
+Usage: python bench_pipeline.py [--sizes 100,1000,10000] [--output results.json]
+"""
+import argparse
+from datetime import datetime, timezone
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from typing import Any, Dict, List
+
+from _support import environment, load_addon, tiddlywiki_binary, write_results
+from wikigen import WikiSpec, expected_note_count, write_file_wiki, write_folder_wiki
+
+DEFAULT_FILTER = "[type[text/vnd.tiddlywiki]] [type[]] +[!is[system]]"
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_stages(addon: Any, tw_binary: str, spec: WikiSpec, wiki_type: str,
+                 wiki_path: Path, scratch: Path, filter_: str) -> Dict[str, Any]:
+    "Run one wiki through each stage of find_notes() and time them."
+    twimport = addon.twimport
+    stages: Dict[str, float] = {}
+    wiki_folder = str(wiki_path)
+    if wiki_type == 'file':
+        wiki_folder = str(scratch / 'folderified')
+        _, stages['folderify'] = _timed(twimport._folderify_wiki,
+                                        tw_binary, str(wiki_path), wiki_folder)
+
+    render_location = scratch / 'render'
+    _, stages['render'] = _timed(twimport._render_wiki,
+                                 tw_binary, wiki_folder, str(render_location), filter_)
+    paths = list(render_location.glob(f"*.{twimport.RENDERED_FILE_EXTENSION}"))
+    notes, stages['parse'] = _timed(twimport._notes_from_paths,
+                                    paths, 'bench', None)
+
+    trace = addon.timing.SyncTrace()
+    end_to_end_notes, end_to_end = _timed(
+        twimport.find_notes, tw_binary=tw_binary, wiki_path=str(wiki_path),
+        wiki_type=wiki_type, wiki_name='bench', filter_=filter_, trace=trace)
+
+    return {
+        'spec': spec._asdict(),
+        'wiki_type': wiki_type,
+        'wiki_bytes': (os.path.getsize(wiki_path) if wiki_type == 'file'
+                       else sum(f.stat().st_size for f in wiki_path.rglob('*') if f.is_file())),
+        'stages': stages,
+        'stage_total': sum(stages.values()),
+        'end_to_end': end_to_end,
+        'end_to_end_trace': [t.to_dict() for t in trace.stages],
+        'rendered_tiddlers': len(paths),
+        'rendered_bytes': sum(p.stat().st_size for p in paths),
+        'notes': len(notes),
+        'expected_notes': expected_note_count(spec),
+        'notes_match': len(notes) == len(end_to_end_notes) == expected_note_count(spec),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,5000',
+                        help="comma-separated tiddler counts")
+    parser.add_argument('--types', default='folder,file',
+                        help="comma-separated wiki types to benchmark")
+    parser.add_argument('--note-density', type=float, default=0.2)
+    parser.add_argument('--cloze-ratio', type=float, default=0.5)
+    parser.add_argument('--transclusion-depth', type=int, default=1)
+    parser.add_argument('--deck-mappings', type=int, default=5)
+    parser.add_argument('--tag-mappings', type=int, default=5)
+    parser.add_argument('--filter', default=DEFAULT_FILTER,
+                        help="contentFilter to render with")
+    parser.add_argument('--output', default='-',
+                        help="file to write JSON results to (default: stdout)")
+    args = parser.parse_args()
+
+    addon = load_addon()
+    tw_binary = tiddlywiki_binary()
+    results: List[Dict[str, Any]] = []
+    for size in (int(i) for i in args.sizes.split(',')):
+        spec = WikiSpec(tiddlers=size, note_density=args.note_density,
+                        cloze_ratio=args.cloze_ratio,
+                        transclusion_depth=args.transclusion_depth,
+                        deck_mappings=args.deck_mappings,
+                        tag_mappings=args.tag_mappings)
+        for wiki_type in args.types.split(','):
+            with TemporaryDirectory() as tmpdir:
+                scratch = Path(tmpdir)
+                if wiki_type == 'file':
+                    wiki = write_file_wiki(spec, scratch / 'wiki.html', tw_binary)
+                else:
+                    wiki = write_folder_wiki(spec, scratch / 'wiki')
+                result = bench_stages(addon, tw_binary, spec, wiki_type, wiki,
+                                      scratch, args.filter)
+            results.append(result)
+            print(f"{spec.slug} {wiki_type:>6}: "
+                  + ', '.join(f"{k} {v:.2f}s" for k, v in result['stages'].items())
+                  + f"; end to end {result['end_to_end']:.2f}s, {result['notes']} notes",
+                  file=sys.stderr)
+
+    write_results(args.output, {
+        'benchmark': 'pipeline',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(tw_binary),
+        'filter': args.filter,
+        'results': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
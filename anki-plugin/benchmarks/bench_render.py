@@ -0,0 +1,109 @@
+"""
+bench_render.py - render time of one pass over the wiki against one per tiddler
+
+Generates a synthetic folder wiki with wikigen.py and renders it with
+twimport._render_wiki() in the two ways iter_notes() can:
+
+* per-tiddler: each tiddler rendered to its own file with the parseable
+  template, which imports the global macros again for every tiddler;
+* bundle: all tiddlers rendered to one file with the bundle template,
+  which imports them once ('renderBundle' option).
+
+Each is timed over several runs (the fastest is reported), for both HTML
+and record output, and the notes extracted both ways are compared.
+Needs node and TiddlyWiki.
+
+Usage: python bench_render.py [--tiddlers 10000] [--macros 50] [--repeat 3]
+"""
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+import sys
+from tempfile import TemporaryDirectory
+import time
+from typing import Any, Dict, List
+
+from _support import environment, load_addon, tiddlywiki_binary, write_results
+from wikigen import WikiSpec, write_folder_wiki
+
+DEFAULT_FILTER = "[type[text/vnd.tiddlywiki]] [type[]] +[!is[system]]"
+
+
+def add_global_macros(wiki: Path, count: int) -> None:
+    "Give the wiki /count/ global macro tiddlers, as a well-used wiki has."
+    for i in range(count):
+        (wiki / 'tiddlers' / f"bench-macro-{i}.tid").write_text(
+            f"title: $:/bench/macros/{i}\ntags: $:/tags/Macro\n\n"
+            f"\\define bench-macro-{i}(x) <span class=\"m{i}\">$x$</span>\n",
+            encoding='utf-8')
+
+
+def time_render(twimport: Any, tw_binary: str, wiki: Path, scratch: Path,
+                records: bool, bundle: bool, repeat: int) -> float:
+    "Return the fastest of /repeat/ renders of /wiki/."
+    template = twimport.RECORDS_TEMPLATE if records else twimport.TEMPLATE
+    best = float('inf')
+    for run in range(repeat):
+        output = scratch / f"render-{records}-{bundle}-{run}"
+        start = time.perf_counter()
+        twimport._render_wiki(tw_binary, str(wiki), str(output), DEFAULT_FILTER,
+                              template=template, bundle=bundle)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def extract(twimport: Any, tw_binary: str, wiki: Path, records: bool,
+            bundle: bool) -> List[Dict[str, Any]]:
+    "Return the records of the notes found in /wiki/, sorted by ID."
+    notes = twimport.find_notes(tw_binary, str(wiki), 'folder', 'bench', DEFAULT_FILTER,
+                                records=records, bundle=bundle)
+    return sorted((n.to_record() for n in notes), key=lambda r: r['id'])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tiddlers', type=int, default=10000)
+    parser.add_argument('--macros', type=int, default=50,
+                        help="global macro tiddlers to add to the wiki")
+    parser.add_argument('--deck-mappings', type=int, default=5)
+    parser.add_argument('--tag-mappings', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    addon = load_addon()
+    twimport = addon.twimport
+    tw_binary = tiddlywiki_binary()
+    spec = WikiSpec(tiddlers=args.tiddlers, transclusion_depth=1,
+                    deck_mappings=args.deck_mappings, tag_mappings=args.tag_mappings)
+    results: Dict[str, Any] = {}
+    with TemporaryDirectory() as tmpdir:
+        scratch = Path(tmpdir)
+        wiki = write_folder_wiki(spec, scratch / 'wiki')
+        add_global_macros(wiki, args.macros)
+        for records in (False, True):
+            output = 'records' if records else 'html'
+            times = {mode: time_render(twimport, tw_binary, wiki, scratch, records,
+                                       mode == 'bundle', args.repeat)
+                     for mode in ('per-tiddler', 'bundle')}
+            same = (extract(twimport, tw_binary, wiki, records, False)
+                    == extract(twimport, tw_binary, wiki, records, True))
+            results[output] = {'seconds': times, 'notes_match': same}
+            print(f"{output:>8}: per-tiddler {times['per-tiddler']:.2f}s, "
+                  f"bundle {times['bundle']:.2f}s "
+                  f"({times['per-tiddler'] / times['bundle']:.1f}x); "
+                  f"notes {'match' if same else 'DIFFER'}", file=sys.stderr)
+
+    if args.output:
+        write_results(args.output, {
+            'benchmark': 'render',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'environment': environment(tw_binary),
+            'spec': spec._asdict(),
+            'macros': args.macros,
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+bench_sync.py - load test of ankisync.sync() against a stand-in collection
+
+Runs syncs against fakeanki.py's in-memory collection, so neither Anki nor
+a display is needed. For each collection size:
+
+* initial: every note is added to an empty collection;
+* mixed: a realistic batch of changes is synced -- some notes edited,
+  some moved to another deck, some changed from question to cloze or
+  back, some removed, and some new ones added (see --edit and friends);
+* unchanged: the same notes are synced again, changing nothing.
+
+Each sync is timed and reported as notes per second, and afterwards the
+collection is checked against the notes synced: the script exits with
+an error if any note is missing, left over, or has the wrong fields,
+type or deck, so it can also be run as a check.
+
+New notes are added all at once when there are enough of them (the
+'bulkAddThreshold' option) and Anki has add_notes(), as the stand-in
+collection does; --bulk-add-threshold 0 adds them one at a time instead,
+as older versions of Anki always do, for comparison.
+
+Usage: python bench_sync.py [--notes 1000 10000 100000] [--output results.json]
+"""
+import argparse
+from datetime import datetime, timezone
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+from _support import environment, load_addon, tiddlywiki_binary, write_results
+import fakeanki
+
+DECKS = 10
+
+
+def make_note(twnote: Any, index: int, cloze: bool, version: int = 0) -> Any:
+    "Return note number /index/ of the synthetic collection, in its /version/th form."
+    id_ = f"{20200101000000000 + index}"
+    tidref = f"Tiddler {index // 5}"
+    tags = {'bench', f'group-{index % 7}'}
+    deck = f"Bench::Deck {(index + version) % DECKS}"
+    if cloze:
+        return twnote.ClozeNote(id_, 'bench', tidref,
+                                f"Fact {{{{c1::{index}}}}} is in version {version}.",
+                                tags, deck)
+    return twnote.QuestionNote(id_, 'bench', tidref, f"What is fact {index}?",
+                               f"It is {index}, in version {version}.", tags, deck)
+
+
+def mixed_changes(twnote: Any, notes: Dict[int, Any], rng: random.Random,
+                  args: argparse.Namespace) -> Dict[int, Any]:
+    "Return /notes/ with a mix of edits, moves, type changes, removals and adds."
+    count = len(notes)
+    indices = list(notes)
+    rng.shuffle(indices)
+    changed = dict(notes)
+    position = 0
+
+    def take(share: float) -> List[int]:
+        nonlocal position
+        chosen = indices[position:position + int(count * share)]
+        position += len(chosen)
+        return chosen
+
+    for i in take(args.edit):
+        old = notes[i]
+        new = make_note(twnote, i, isinstance(old, twnote.ClozeNote), 1)
+        new.target_deck = old.target_deck
+        changed[i] = new
+    for i in take(args.move):
+        changed[i].target_deck = f"Bench::Moved {i % DECKS}"
+    for i in take(args.type_change):
+        changed[i] = make_note(twnote, i, not isinstance(notes[i], twnote.ClozeNote))
+    for i in take(args.remove):
+        del changed[i]
+    for i in range(count, count + int(count * args.add)):
+        changed[i] = make_note(twnote, i, rng.random() < args.cloze)
+    return changed
+
+
+def timed_sync(addon: Any, mw: Any, conf: Dict[str, Any],
+               notes: Dict[int, Any]) -> Dict[str, Any]:
+    "Sync /notes/ to the collection and return how long it took and what changed."
+    trace = addon.timing.SyncTrace()
+    start = time.perf_counter()
+    result = addon.ankisync.sync(notes.values(), mw, conf, trace)
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': seconds,
+        'notes_per_second': len(notes) / seconds if seconds else None,
+        'added': result.added,
+        'updated': result.updated,
+        'removed': result.removed,
+        'fields_written': result.fields_written,
+        'fields_kept': result.fields_kept,
+        'stages': {s.stage: round(s.seconds, 4) for s in trace.stages},
+    }
+
+
+def check_collection(mw: Any, notes: Dict[int, Any]) -> List[str]:
+    "Return a description of each way the collection differs from /notes/."
+    col = mw.col
+    nids = dict(col.db.execute("select twid, id from notes"))
+    problems = []
+    expected = set(n.id_ for n in notes.values())
+    for twid in sorted(set(nids) - expected):
+        problems.append(f"note {twid} should have been removed")
+    for note in notes.values():
+        if note.id_ not in nids:
+            problems.append(f"note {note.id_} is missing")
+            continue
+        anki_note = col.getNote(nids[note.id_])
+        if not note.model_equal(anki_note):
+            problems.append(f"note {note.id_} has the wrong note type")
+        elif not note.fields_equal(anki_note):
+            problems.append(f"note {note.id_} has the wrong fields")
+        elif any(c.did != col.decks.id(note.target_deck) for c in anki_note.cards()):
+            problems.append(f"note {note.id_} is in the wrong deck")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--notes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--cloze', type=float, default=0.3,
+                        help="share of notes that are clozes")
+    parser.add_argument('--edit', type=float, default=0.1)
+    parser.add_argument('--move', type=float, default=0.05)
+    parser.add_argument('--type-change', type=float, default=0.02)
+    parser.add_argument('--remove', type=float, default=0.05)
+    parser.add_argument('--add', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bulk-add-threshold', type=int, default=None,
+                        help="the 'bulkAddThreshold' option (0 to never add in bulk)")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # The add-on must be loaded before the fake aqt module is in place, or
+    # it would try to register itself with the fake main window.
+    addon = load_addon()
+    twnote = addon.twnote
+    conf: Dict[str, Any] = {'defaultDeck': 'Default'}
+    if args.bulk_add_threshold is not None:
+        conf['bulkAddThreshold'] = args.bulk_add_threshold
+    results: Dict[str, Any] = {}
+    failed = False
+    for count in args.notes:
+        mw = fakeanki.install(fakeanki.FakeMainWindow())
+        rng = random.Random(args.seed)
+        notes = {i: make_note(twnote, i, rng.random() < args.cloze) for i in range(count)}
+        changed = mixed_changes(twnote, notes, rng, args)
+
+        runs = {
+            'initial': timed_sync(addon, mw, conf, notes),
+            'mixed': timed_sync(addon, mw, conf, changed),
+            'unchanged': timed_sync(addon, mw, conf, changed),
+        }
+        problems = check_collection(mw, changed)
+        results[str(count)] = {'syncs': runs, 'problems': problems[:20]}
+        print(f"{count:>7} notes: " + ', '.join(
+            f"{name} {run['seconds']:.2f}s ({run['notes_per_second']:,.0f}/s)"
+            for name, run in runs.items()), file=sys.stderr)
+        for problem in problems[:20]:
+            print(f"    {problem}", file=sys.stderr)
+        failed = failed or bool(problems)
+
+    if args.output:
+        write_results(args.output, {
+            'benchmark': 'sync',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'environment': environment(tiddlywiki_binary()),
+            'mix': {k: getattr(args, k) for k in ('cloze', 'edit', 'move', 'type_change',
+                                                   'remove', 'add', 'seed')},
+            'conf': conf,
+            'results': results,
+        })
+    if failed:
+        sys.exit("The collection did not match the notes synced.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""
+fakeanki.py - a stand-in for Anki's collection and main window
+
+ankisync.sync() and the note type functions in trmodels.py reach Anki
+only through aqt.mw.col:
+
+* find_notes(), getNote(), new_note(), addNote(), add_notes() and
+  remove_notes();
+* models: byName(), new(), newField(), addField(), newTemplate(),
+  addTemplate(), add() and change();
+* decks.id() and tags.canonify();
+* db.list(), for a query on the cards table.
+
+FakeCollection implements just those, keeping notes and cards in an
+in-memory SQLite database, so that syncs can be run, checked and timed
+without Anki or a display. Searches only understand the forms ankisync
+uses: note:"type", "ID:value", "Wiki:value" and nid:id, joined with 'or'
+and brackets.
+
+install() makes a FakeMainWindow aqt.mw. Anki needn't be installed: if it
+isn't, install() provides the little of the aqt, anki.consts and
+anki.collection modules the add-on imports.
+"""
+from dataclasses import dataclass
+import itertools
+import re
+import sqlite3
+import sys
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional
+
+MODEL_STD = 0
+MODEL_CLOZE = 1
+FIELD_SEPARATOR = '\x1f'
+
+_NOTE_TYPE_SEARCH_RE = re.compile(r'note:"([^"]*)"')
+_FIELD_SEARCH_RE = re.compile(r'"([^":]+):([^"]*)"')
+_NID_SEARCH_RE = re.compile(r'\bnid:(\d+)')
+#: The columns of the notes table holding the fields that can be searched.
+_FIELD_COLUMNS = {'ID': 'twid', 'Wiki': 'wiki'}
+
+
+class FakeCard:
+    "A card of a FakeNote; only its deck can be changed."
+    def __init__(self, col: 'FakeCollection', id_: int, nid: int, did: int) -> None:
+        self.col = col
+        self.id = id_
+        self.nid = nid
+        self.did = did
+
+    def flush(self) -> None:
+        self.col.db.execute("update cards set did = ? where id = ?", (self.did, self.id))
+
+
+class FakeNote:
+    "A note, with fields accessed by name as on Anki's Note."
+    def __init__(self, col: 'FakeCollection', model: Dict[str, Any],
+                 id_: int = 0, fields: Optional[List[str]] = None,
+                 tags: Optional[List[str]] = None) -> None:
+        self.col = col
+        self.id = id_
+        self.mid = model['id']
+        self.fields = fields if fields is not None else [''] * len(model['flds'])
+        self.tags = tags if tags is not None else []
+
+    def model(self) -> Dict[str, Any]:
+        return self.col.models.get(self.mid)
+
+    def _index(self, name: str) -> int:
+        return self.col.models.field_map(self.mid)[name]
+
+    def __getitem__(self, name: str) -> str:
+        return self.fields[self._index(name)]
+
+    def __setitem__(self, name: str, value: str) -> None:
+        self.fields[self._index(name)] = value
+
+    def keys(self) -> List[str]:
+        return list(self.col.models.field_map(self.mid))
+
+    def cards(self) -> List[FakeCard]:
+        rows = self.col.db.execute("select id, did from cards where nid = ? order by ord",
+                                   (self.id,))
+        return [FakeCard(self.col, cid, self.id, did) for cid, did in rows]
+
+    def flush(self) -> None:
+        self.col.db.execute(
+            "update notes set mid = ?, flds = ?, tags = ?, twid = ?, wiki = ? "
+            "where id = ?",
+            (self.mid, FIELD_SEPARATOR.join(self.fields), ' '.join(self.tags),
+             self._get('ID'), self._get('Wiki'), self.id))
+
+    def _get(self, name: str) -> Optional[str]:
+        "The value of a field kept in its own column for searching, if the note has it."
+        try:
+            return self[name]
+        except KeyError:
+            return None
+
+
+@dataclass
+class AddNoteRequest:
+    "A note to add with add_notes(), as in anki.collection."
+    note: FakeNote
+    deck_id: int
+
+
+class FakeModels:
+    "The note types of a FakeCollection, as dicts shaped like Anki's."
+    def __init__(self, col: 'FakeCollection') -> None:
+        self.col = col
+        self.models: Dict[int, Dict[str, Any]] = {}
+        self._field_maps: Dict[int, Dict[str, int]] = {}
+        self._ids = itertools.count(1)
+
+    def new(self, name: str) -> Dict[str, Any]:
+        return {'id': 0, 'name': name, 'flds': [], 'tmpls': [], 'css': '', 'sortf': 0,
+                'type': MODEL_STD, 'did': 1}
+
+    def newField(self, name: str) -> Dict[str, Any]:
+        return {'name': name, 'ord': None}
+
+    def addField(self, model: Dict[str, Any], field: Dict[str, Any]) -> None:
+        field['ord'] = len(model['flds'])
+        model['flds'].append(field)
+
+    def newTemplate(self, name: str) -> Dict[str, Any]:
+        return {'name': name, 'ord': None, 'qfmt': '', 'afmt': ''}
+
+    def addTemplate(self, model: Dict[str, Any], template: Dict[str, Any]) -> None:
+        template['ord'] = len(model['tmpls'])
+        model['tmpls'].append(template)
+
+    def add(self, model: Dict[str, Any]) -> None:
+        model['id'] = next(self._ids)
+        self.models[model['id']] = model
+
+    def get(self, mid: int) -> Dict[str, Any]:
+        return self.models[mid]
+
+    def field_map(self, mid: int) -> Dict[str, int]:
+        "The position of each field of a note type by name, as Anki keeps for notes."
+        if mid not in self._field_maps:
+            self._field_maps[mid] = {f['name']: f['ord'] for f in self.models[mid]['flds']}
+        return self._field_maps[mid]
+
+    def byName(self, name: str) -> Optional[Dict[str, Any]]:
+        return next((m for m in self.models.values() if m['name'] == name), None)
+
+    def change(self, old_model: Dict[str, Any], nids: Iterable[int],
+               new_model: Dict[str, Any], fmap: Dict[int, Optional[int]],
+               cmap: Dict[int, Optional[int]]) -> None:
+        for nid in nids:
+            note = self.col.getNote(nid)
+            fields = [''] * len(new_model['flds'])
+            for old, new in fmap.items():
+                if new is not None:
+                    fields[new] = note.fields[old]
+            note.mid = new_model['id']
+            note.fields = fields
+            note.flush()
+            for card_ord, new_ord in cmap.items():
+                if new_ord is None:
+                    self.col.db.execute("delete from cards where nid = ? and ord = ?",
+                                        (nid, card_ord))
+                else:
+                    self.col.db.execute("update cards set ord = ? where nid = ? and ord = ?",
+                                        (new_ord, nid, card_ord))
+
+
+class FakeDecks:
+    "Decks by name; there is always a Default deck with ID 1."
+    def __init__(self) -> None:
+        self.decks: Dict[str, int] = {'Default': 1}
+
+    def id(self, name: str) -> int:
+        return self.decks.setdefault(name, len(self.decks) + 1)
+
+    def name(self, did: int) -> str:
+        return next(n for n, i in self.decks.items() if i == did)
+
+    def active(self) -> List[int]:
+        return [1]
+
+
+class FakeTags:
+    "Tag normalization as Anki does it, without a tag registry."
+    def canonify(self, tags: Iterable[str]) -> List[str]:
+        canon: Dict[str, str] = {}
+        for tag in tags:
+            tag = tag.strip()
+            if tag:
+                canon.setdefault(tag.lower(), tag)
+        return sorted(canon.values(), key=str.lower)
+
+
+class FakeDB:
+    "The collection's database; list() returns the first column of a query."
+    def __init__(self) -> None:
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript("""
+            create table notes (id integer primary key, mid integer, flds text,
+                                tags text, twid text, wiki text);
+            create table cards (id integer primary key, nid integer, did integer,
+                                ord integer);
+            create index ix_notes_twid on notes (twid);
+            create index ix_cards_nid on cards (nid);
+        """)
+
+    def execute(self, sql: str, args: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, tuple(args))
+
+    def list(self, sql: str, *args: Any) -> List[Any]:
+        return [row[0] for row in self.conn.execute(sql, args)]
+
+    def scalar(self, sql: str, *args: Any) -> Any:
+        return self.conn.execute(sql, args).fetchone()[0]
+
+
+class FakeCollection:
+    "An Anki collection, reduced to what TiddlyRemember uses."
+    def __init__(self) -> None:
+        self.db = FakeDB()
+        self.models = FakeModels(self)
+        self.decks = FakeDecks()
+        self.tags = FakeTags()
+
+    def new_note(self, model: Dict[str, Any]) -> FakeNote:
+        return FakeNote(self, model)
+
+    def addNote(self, note: FakeNote) -> int:
+        return self._add(note, note.model()['did'])
+
+    def add_notes(self, requests: Iterable[AddNoteRequest]) -> None:
+        for request in requests:
+            self._add(request.note, request.deck_id)
+
+    def _add(self, note: FakeNote, did: int) -> int:
+        "Add a note, putting its cards in the deck /did/; return how many there are."
+        model = note.model()
+        cursor = self.db.execute(
+            "insert into notes (mid, flds, tags, twid, wiki) values (?, ?, ?, ?, ?)",
+            (note.mid, FIELD_SEPARATOR.join(note.fields), ' '.join(note.tags),
+             note._get('ID'), note._get('Wiki')))
+        note.id = cursor.lastrowid
+        # Like Anki, a cloze note type has a single template but may make
+        # several cards; one will do here.
+        for template in model['tmpls']:
+            self.db.execute("insert into cards (nid, did, ord) values (?, ?, ?)",
+                            (note.id, did, template['ord']))
+        return len(model['tmpls'])
+
+    def getNote(self, nid: int) -> FakeNote:
+        row = self.db.execute("select mid, flds, tags from notes where id = ?",
+                              (nid,)).fetchone()
+        if row is None:
+            raise KeyError(f"No note with ID {nid}")
+        mid, flds, tags = row
+        return FakeNote(self, self.models.get(mid), nid, flds.split(FIELD_SEPARATOR),
+                        tags.split())
+
+    def find_notes(self, query: str) -> List[int]:
+        """
+        Return the IDs of the notes matching an Anki search, which must be
+        made of the terms described in the module docstring.
+        """
+        nids = [int(i) for i in _NID_SEARCH_RE.findall(query)]
+        if nids:
+            return self.db.list("select id from notes where id in (%s)"
+                                % ','.join(str(i) for i in nids))
+
+        sql = "select id from notes where 1"
+        args: List[Any] = []
+        mids = [m['id'] for name in _NOTE_TYPE_SEARCH_RE.findall(query)
+                for m in [self.models.byName(name)] if m is not None]
+        if _NOTE_TYPE_SEARCH_RE.search(query):
+            sql += " and mid in (%s)" % ','.join('?' * len(mids)) if mids else " and 0"
+            args.extend(mids)
+        values: Dict[str, List[str]] = {}
+        for field, value in _FIELD_SEARCH_RE.findall(_NOTE_TYPE_SEARCH_RE.sub('', query)):
+            if field not in _FIELD_COLUMNS:
+                raise NotImplementedError(f"Can't search the field {field}")
+            values.setdefault(field, []).append(value)
+        for field, field_values in values.items():
+            placeholders = ','.join('?' * len(field_values))
+            sql += f" and {_FIELD_COLUMNS[field]} in ({placeholders})"
+            args.extend(field_values)
+        return self.db.list(sql, *args)
+
+    def remove_notes(self, nids: Iterable[int]) -> None:
+        ids = ','.join(str(int(i)) for i in nids)
+        self.db.execute(f"delete from cards where nid in ({ids})")
+        self.db.execute(f"delete from notes where id in ({ids})")
+
+    def note_count(self) -> int:
+        return self.db.scalar("select count() from notes")
+
+
+class FakeMainWindow:
+    "Anki's main window, which is only a holder for the collection here."
+    def __init__(self) -> None:
+        self.col = FakeCollection()
+        self.state = 'deckBrowser'
+        self.resets = 0
+
+    def reset(self) -> None:
+        self.resets += 1
+
+    def requireReset(self) -> None:
+        self.resets += 1
+
+
+def install(mw: Optional[FakeMainWindow] = None) -> FakeMainWindow:
+    """
+    Make /mw/ (or a new FakeMainWindow) Anki's main window, aqt.mw, and
+    return it. Minimal aqt and anki.consts modules are put in place if Anki
+    isn't installed.
+    """
+    mw = mw if mw is not None else FakeMainWindow()
+    try:
+        import aqt
+    except ImportError:
+        aqt = ModuleType('aqt')
+        sys.modules['aqt'] = aqt
+    try:
+        import anki.consts  # pylint: disable=unused-import
+    except ImportError:
+        anki = ModuleType('anki')
+        consts = ModuleType('anki.consts')
+        consts.MODEL_STD = MODEL_STD  # type: ignore
+        consts.MODEL_CLOZE = MODEL_CLOZE  # type: ignore
+        collection = ModuleType('anki.collection')
+        collection.AddNoteRequest = AddNoteRequest  # type: ignore
+        anki.consts = consts  # type: ignore
+        anki.collection = collection  # type: ignore
+        sys.modules['anki'] = anki
+        sys.modules['anki.consts'] = consts
+        sys.modules['anki.collection'] = collection
+    aqt.mw = mw  # type: ignore
+    return mw
@@ -0,0 +1,177 @@
+"""
+wikigen.py - generate synthetic TiddlyWikis for benchmarking
+
+A WikiSpec describes the shape of the wiki: how many tiddlers, how many of
+them carry notes, the cloze/Q&A mix, how deeply tiddlers transclude each
+other, and how many deck and tag mapping filters are configured. It can be
+written out as a Node folder wiki (with the TiddlyRemember plugin from this
+repository installed) and, with the help of TiddlyWiki, as a single-file wiki.
+
+Generation is deterministic for a given spec, so results taken on different
+revisions are comparable.
+
+Usage: python wikigen.py OUTPUT_DIR [--tiddlers N] [--single-file] [...]
+"""
+import argparse
+import random
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from _support import TW_PLUGIN_SOURCE, tiddlywiki_binary
+
+TOPIC_COUNT = 20
+WORDS = ("the of a spaced repetition memory tiddler note deck review card "
+         "interval forgetting curve retention knowledge graph link transclusion "
+         "filter macro widget recall question answer cloze deletion").split()
+
+
+class WikiSpec(NamedTuple):
+    "Parameters of a synthetic wiki."
+    tiddlers: int = 1000
+    note_density: float = 0.2        #: fraction of tiddlers containing notes
+    notes_per_tiddler: int = 3       #: notes in each note-bearing tiddler
+    cloze_ratio: float = 0.5         #: fraction of notes that are cloze notes
+    transclusion_depth: int = 0      #: length of {{transclusion}} chains
+    transclusion_ratio: float = 0.1  #: fraction of tiddlers starting a chain
+    deck_mappings: int = 0           #: lines in the DeckMapping tiddler
+    tag_mappings: int = 0            #: lines in the TagMapping tiddler
+    paragraphs: int = 3              #: paragraphs of filler prose per tiddler
+    seed: int = 0
+
+    @property
+    def slug(self) -> str:
+        "Short identifier for file names and result keys."
+        return (f"t{self.tiddlers}-d{self.note_density:g}-c{self.cloze_ratio:g}"
+                f"-x{self.transclusion_depth}-m{self.deck_mappings}.{self.tag_mappings}")
+
+
+def _title(index: int) -> str:
+    return f"Synthetic Tiddler {index:06d}"
+
+
+def _tid(fields: dict, text: str) -> str:
+    header = ''.join(f"{k}: {v}\n" for k, v in sorted(fields.items()))
+    return f"{header}\n{text}"
+
+
+def _prose(rng: random.Random, paragraphs: int) -> List[str]:
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))) + '.'
+            for _ in range(paragraphs)]
+
+
+def _note(rng: random.Random, spec: WikiSpec, note_id: int) -> str:
+    if rng.random() < spec.cloze_ratio:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 20))]
+        for i in rng.sample(range(len(words)), min(len(words), rng.randint(1, 3))):
+            words[i] = "{%s}" % words[i]
+        return f'<<remembercz "{note_id}" "{" ".join(words)}">>'
+    question = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + '?'
+    answer = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+    return f'<<rememberq "{note_id}" "{question}" "{answer}">>'
+
+
+def expected_note_count(spec: WikiSpec) -> int:
+    "Number of distinct notes a wiki generated from /spec/ contains."
+    rng = random.Random(spec.seed)
+    return sum(spec.notes_per_tiddler for _ in range(spec.tiddlers)
+               if rng.random() < spec.note_density)
+
+
+def write_folder_wiki(spec: WikiSpec, target: Path) -> Path:
+    """
+    Write a folder wiki described by /spec/ to /target/, which must not exist,
+    and return its path.
+    """
+    rng = random.Random(spec.seed)
+    note_flags = [rng.random() < spec.note_density for _ in range(spec.tiddlers)]
+
+    tiddlers_dir = target / 'tiddlers'
+    tiddlers_dir.mkdir(parents=True)
+    shutil.copytree(TW_PLUGIN_SOURCE, target / 'plugins' / 'tiddlyremember')
+    (target / 'tiddlywiki.info').write_text(
+        '{\n    "description": "TiddlyRemember benchmark wiki",\n'
+        '    "plugins": [],\n    "themes": ["tiddlywiki/vanilla"]\n}\n',
+        encoding='utf-8')
+
+    next_id = 20200101000000000
+    for index in range(spec.tiddlers):
+        body = _prose(rng, spec.paragraphs)
+        if note_flags[index]:
+            for _ in range(spec.notes_per_tiddler):
+                body.insert(rng.randint(0, len(body)), _note(rng, spec, next_id))
+                next_id += 1
+        # Chains of transclusions: tiddler i includes i+1, which includes
+        # i+2, and so on, transclusion_depth levels deep.
+        if spec.transclusion_depth and rng.random() < spec.transclusion_ratio:
+            for depth in range(1, spec.transclusion_depth + 1):
+                if index + depth < spec.tiddlers:
+                    body.append("{{%s}}" % _title(index + depth))
+        fields = {
+            'title': _title(index),
+            'created': '20200101000000000',
+            'modified': '20200101000000000',
+            'type': 'text/vnd.tiddlywiki',
+            'tags': f"topic-{rng.randrange(TOPIC_COUNT)} topic-{rng.randrange(TOPIC_COUNT)}",
+        }
+        (tiddlers_dir / f"{_title(index)}.tid").write_text(
+            _tid(fields, '\n\n'.join(body)), encoding='utf-8')
+
+    def mapping(title, lines):
+        fields = {'title': title, 'type': 'text/vnd.tiddlywiki'}
+        (tiddlers_dir / (title.replace('$:/', '$__').replace('/', '_') + '.tid')
+         ).write_text(_tid(fields, '\n'.join(lines)), encoding='utf-8')
+
+    if spec.deck_mappings:
+        mapping('$:/config/TiddlyRemember/DeckMapping',
+                [f"[tag[topic-{i % TOPIC_COUNT}]then[Synthetic::Deck {i}]]"
+                 for i in range(spec.deck_mappings)])
+    if spec.tag_mappings:
+        mapping('$:/config/TiddlyRemember/TagMapping',
+                [f"[tag[topic-{i % TOPIC_COUNT}]then[mapped-{i}]]"
+                 for i in range(spec.tag_mappings)])
+    return target
+
+
+def write_file_wiki(spec: WikiSpec, target: Path,
+                    tw_binary: Optional[str] = None) -> Path:
+    """
+    Write a single-file wiki described by /spec/ to the file /target/ and
+    return its path. A scratch folder wiki is built next to it and saved
+    as a single file using TiddlyWiki.
+    """
+    tw_binary = tw_binary or tiddlywiki_binary()
+    folder = target.with_name(target.stem + '-folder')
+    if folder.exists():
+        shutil.rmtree(folder)
+    write_folder_wiki(spec, folder)
+    subprocess.run(
+        [tw_binary, str(folder), "--output", str(target.parent),
+         "--render", "$:/core/save/all", target.name, "text/plain"],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    shutil.rmtree(folder)
+    return target
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', type=Path,
+                        help="folder wiki directory (or .html file with --single-file)")
+    parser.add_argument('--single-file', action='store_true')
+    for name, default in WikiSpec._field_defaults.items():  # pylint: disable=no-member
+        parser.add_argument('--' + name.replace('_', '-'), type=type(default),
+                            default=default)
+    args = parser.parse_args()
+    spec = WikiSpec(**{k: getattr(args, k) for k in WikiSpec._fields})
+
+    if args.single_file:
+        write_file_wiki(spec, args.output)
+    else:
+        write_folder_wiki(spec, args.output)
+    print(f"Wrote {spec.tiddlers} tiddlers with {expected_note_count(spec)} "
+          f"notes to {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
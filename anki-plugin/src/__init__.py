@@ -24,173 +24,91 @@
 # SOFTWARE.
 ###############################################################################
 
-from typing import Dict, List, Optional, Set
+import sys
+from typing import Optional
 
-# pylint: disable=import-error, no-name-in-module
-import aqt
-from aqt.utils import showWarning, tooltip
-from PyQt5.QtGui import QKeySequence
-from PyQt5.QtWidgets import QDialog, QAction
-from PyQt5.QtCore import pyqtSignal, QThread
 
-from . import ankisync
-from . import import_dialog
-from .settings import edit_settings
-from . import twimport
-from .twnote import TwNote
-
-
-class ImportThread(QThread):
+def open_dialog(wiki: Optional[str] = None) -> None:
     """
-    Background thread to export the wiki and parse questions out of it.
+    Launch the sync dialog, to sync all wikis or only the one called /wiki/.
+    The sync machinery (and requests, BeautifulSoup and the rest of what it
+    imports) is only loaded once a sync is requested.
     """
-    progress_update = pyqtSignal(int, int)
-
-    def __init__(self, conf: dict, wiki_name: str, wiki_conf: Dict[str, str]) -> None:
-        super().__init__()
-        self.conf = conf
-        self.wiki_name = wiki_name
-        self.wiki_conf = wiki_conf
-        self.notes: Optional[Set[TwNote]] = None
-        self.exception: Optional[Exception] = None
-
-    def run(self) -> None:
-        try:
-            self.notes = twimport.find_notes(
-                tw_binary=self.conf['tiddlywikiBinary'],
-                wiki_path=self.wiki_conf['path'],
-                wiki_type=self.wiki_conf['type'],
-                wiki_name=self.wiki_name,
-                filter_=self.wiki_conf['contentFilter'],
-                callback=self.progress_update.emit
-            )
-            for n in self.notes:
-                wiki_url = self.wiki_conf.get('permalink', '')
-                if wiki_url:
-                    n.set_permalink(wiki_url)
-        except Exception as e:
-            self.exception = e
-
-
-class ImportDialog(QDialog):
+    from . import syncdialog
+    syncdialog.open_dialog(wiki)
+
+
+def _fill_wiki_menu(menu) -> None:
+    "List the configured wikis in the menu for syncing one wiki."
+    import aqt
+    from PyQt5.QtWidgets import QAction  # pylint: disable=import-error, no-name-in-module
+
+    menu.clear()
+    conf = aqt.mw.addonManager.getConfig(__name__)
+    wikis = [name for name, wiki_conf in conf['wikis'].items()
+             if wiki_conf['path'].strip()]
+    for name in sorted(wikis, key=str.lower):
+        # An ampersand would be taken as a mnemonic.
+        action = QAction(name.replace('&', '&&'), menu)
+        action.triggered.connect(lambda _checked=False, name=name: open_dialog(name))
+        menu.addAction(action)
+    if not wikis:
+        action = QAction("(no wikis set up)", menu)
+        action.setEnabled(False)
+        menu.addAction(action)
+
+
+def edit_settings() -> None:
+    "Launch the settings dialog, loading it on first use."
+    from . import settings
+    settings.edit_settings()
+    _update_watching()
+
+
+def _update_watching() -> None:
     """
-    Dialog implementing the import from TiddlyWiki.
+    Start or stop watching wikis for changes to match the configuration.
+    The watcher is only loaded if it is turned on.
     """
-    def __init__(self, mw) -> None:
-        QDialog.__init__(self)
-        self.form = import_dialog.Ui_Dialog()
-        self.form.setupUi(self)
-        self.conf = mw.addonManager.getConfig(__name__)
-        self.mw = mw
-
-        self.extract_thread: Optional[ImportThread] = None
-        self.notes: Set[TwNote] = set()
-        self.wikis = [(k, v) for k, v in self.conf['wikis'].items()]
-        self.form.wikiProgressBar.setMaximum(len(self.wikis))
-
-    def start_import(self) -> bool:
-        """
-        Check to make sure import is configured correctly and begin
-        extracting data. Return True if started asynchronously, False if
-        unable to start.
-        """
-        # Catch scenario where user tries to sync without configuring and provide
-        # a helpful error message.
-        if len(self.wikis) == 1 and not self.wikis[0][1]['path'].strip():
-            showWarning("You don't appear to have set up any wikis to sync with. "
-                        "To do so, choose Tools > Add-ons, select TiddlyRemember, "
-                        "and click the Config button.")
-            return False
-
-        self.extract()
-        return True
-
-    def extract_progress(self, at: int, end: int) -> None:
-        "Progress callback function for export/parse triggered by progress signal."
-        self.form.progressBar.setMaximum(100)
-        self.form.text.setText(f"Extracting notes from tiddlers...{at}/{end}")
-        if end == 0:
-            # Obviously this will be done *real* soon...but don't want an exception!
-            self.form.progressBar.setValue(100)
-        else:
-            self.form.progressBar.setValue(at * 100 / end)
-
-    def extract(self) -> None:
-        """
-        Extract questions from a TiddlyWiki using Node. When done, proceed to
-        sync with Anki.
-        """
-        wiki_name, wiki_conf = self.wikis.pop()
-
-        self.form.text.setText(f"Exporting tiddlers from {wiki_name}...")
-        self.form.progressBar.setMaximum(0)
-
-        self.extract_thread = ImportThread(self.conf, wiki_name, wiki_conf)
-        self.extract_thread.finished.connect(self.join_thread)
-        self.extract_thread.progress_update.connect(self.extract_progress)
-        self.extract_thread.start()
-
-    def join_thread(self) -> None:
-        """
-        Gather up the results of a completed extract thread, and start the next one
-        if appropriate.
-        """
-        assert self.extract_thread is not None, "Tried to join a nonexistent thread!"
-        if self.extract_thread.exception:
-            self.reject()
-            raise self.extract_thread.exception
-
-        if not self.extract_thread.notes:
-            # This is probably a mistake or misconfiguration. To avoid deleting
-            # all the user's existing notes to "sync" the collection, abort now.
-            showWarning(
-                f"No notes were found in the wiki {self.extract_thread.wiki_name}. "
-                f"Please check your add-on configuration. "
-                f"Your collection has not been updated.")
-            self.reject()
-            return
-
-        # This is a set union, with object equality defined by the ID. Any
-        # notes with an ID matching one already used in a previous wiki will be
-        # discarded here.
-        self.notes.update(self.extract_thread.notes)
-
-        self.form.wikiProgressBar.setValue(self.form.wikiProgressBar.value() + 1)
-        if self.wikis:
-            # If there are any more wikis, handle the next one.
-            # Eventually, parallelizing this might be nice
-            # (might also not improve performance).
-            return self.extract()
-        else:
-            # When all are completed, start the sync with Anki.
-            return self.sync()
-
-    def sync(self) -> None:
-        """
-        Compare the notes gathered by the various wiki threads with the notes
-        currently in our Anki collection and add, edit, and remove notes as needed
-        to get Anki in sync with the TiddlyWiki notes.
-        """
-        self.form.progressBar.setMaximum(0)
-        self.form.text.setText(f"Applying note changes to your collection...")
-        userlog = ankisync.sync(self.notes, self.mw, self.conf)
-
-        self.accept()
-        self.mw.reset()
-        tooltip(userlog)
-
-
-def open_dialog() -> None:
-    "Launch the sync dialog."
-    dialog = ImportDialog(aqt.mw)
-    if dialog.start_import():
-        dialog.exec_()
-
-
-if aqt.mw is not None:
-    action = QAction(aqt.mw)
+    import aqt
+    conf = aqt.mw.addonManager.getConfig(__name__)
+    if conf.get('watchWikis') or f'{__name__}.watch' in sys.modules:
+        from . import watch
+        watch.update_watching(aqt.mw)
+
+
+def _stop_watching() -> None:
+    "Stop watching wikis before the collection is closed."
+    watch = sys.modules.get(f'{__name__}.watch')
+    if watch is not None:
+        watch.stop_watching()  # type: ignore
+
+
+def _register(mw) -> None:
+    "Add the menu action and configuration hook to Anki."
+    # pylint: disable=import-error, no-name-in-module
+    from aqt import gui_hooks
+    from PyQt5.QtGui import QKeySequence
+    from PyQt5.QtWidgets import QAction
+
+    action = QAction(mw)
     action.setText("Sync from &TiddlyWiki")
     action.setShortcut(QKeySequence("Shift+Y"))
-    aqt.mw.form.menuTools.addAction(action)
-    action.triggered.connect(open_dialog)
-    aqt.mw.addonManager.setConfigAction(__name__, edit_settings)
+    mw.form.menuTools.addAction(action)
+    action.triggered.connect(lambda: open_dialog())
+    # The wikis are listed each time the menu is shown, so that it keeps up
+    # with changes to the configuration.
+    wiki_menu = mw.form.menuTools.addMenu("Sync One &Wiki from TiddlyWiki")
+    wiki_menu.aboutToShow.connect(lambda: _fill_wiki_menu(wiki_menu))
+    mw.addonManager.setConfigAction(__name__, edit_settings)
+    gui_hooks.profile_did_open.append(_update_watching)
+    gui_hooks.profile_will_close.append(_stop_watching)
+
+
+# Anki imports aqt before it loads add-ons. If it hasn't been imported, this
+# package is being used without Anki (see cli.py), and nothing that needs
+# Anki or Qt may be loaded.
+if 'aqt' in sys.modules:
+    import aqt
+    if aqt.mw is not None:
+        _register(aqt.mw)
@@ -0,0 +1,8 @@
+"""
+__main__.py - run the headless note extractor with 'python -m'
+
+See cli.py.
+"""
+from .cli import main
+
+main()
@@ -9,18 +9,109 @@ set of TiddlyWiki notes, then deleting any notes in the Anki collection that
 use TiddlyRemember models and were not found in that set. Any changes made in
 Anki and not in TiddlyWiki will be lost at this point.
 
-The sync() method is the public interface to this module.
+The sync() method is the public interface to this module. It can also be
+limited to a few notes, when it is known that no others have changed (see
+watch.py), or to the notes of one wiki, leaving those of the others as
+they are (see syncdialog.py). It returns a SyncResult saying which notes
+and decks changed, so that only the parts of Anki's windows showing them
+need refreshing (see refresh.py).
 """
-from typing import Any, Dict, NewType, Set, cast
-
-from anki.notes import Note
+from typing import (Any, Dict, Iterable, List, NewType, Optional, Set, Tuple, cast,
+                    TYPE_CHECKING)
 
 from . import trmodels
+from .timing import SyncTrace
 from .twnote import TwNote
 from .util import pluralize, Twid
 
+# Everything is done through mw.col, so that syncs can also be run against
+# a stand-in collection (see benchmarks/fakeanki.py).
+if TYPE_CHECKING:
+    from anki.notes import Note
+
+#: How many IDs to look up in one Anki search when syncing only some notes.
+ID_SEARCH_CHUNK = 500
+#: Default for the 'bulkAddThreshold' option: add the new notes all at once
+#: when there are at least this many and Anki can (see _add_notes_in_bulk()).
+BULK_ADD_THRESHOLD = 1000
+
+
+class SyncResult:
+    "What a sync changed in the collection."
+    def __init__(self) -> None:
+        self.added = 0
+        self.updated = 0
+        self.removed = 0
+        #: Fields changed in the notes that were updated, and fields of those
+        #: notes that were left alone as they hadn't changed.
+        self.fields_written = 0
+        self.fields_kept = 0
+        #: Whether notes that weren't extracted were left in the collection;
+        #: see :func:`sync`.
+        self.removals_deferred = False
+        #: Notes that were added, changed, or removed, or had cards moved.
+        self.note_ids: Set[int] = set()
+        #: Decks that cards were added to, removed from, or moved in or out of.
+        self.deck_ids: Set[int] = set()
+
+    def __repr__(self):
+        return (f"SyncResult(added={self.added}, updated={self.updated}, "
+                f"removed={self.removed}, decks={len(self.deck_ids)})")
+
+    @property
+    def changed(self) -> bool:
+        "Whether the sync changed anything at all."
+        return bool(self.note_ids or self.deck_ids)
+
+    def log(self) -> str:
+        "Return a description of the changes to pass back to the user."
+        updated = f"Updated {self.updated} {pluralize('note', self.updated)}"
+        if self.updated:
+            # Only the fields that changed are written.
+            updated += (f" ({self.fields_written} "
+                        f"{pluralize('field', self.fields_written)} changed, "
+                        f"{self.fields_kept} left alone)")
+        userlog = [f"Added {self.added} {pluralize('note', self.added)}.",
+                   updated + "."]
+        if self.removals_deferred:
+            userlog.append("Removed notes will be removed on the next full sync.")
+        else:
+            userlog.append(f"Removed {self.removed} {pluralize('note', self.removed)}.")
+        return '\n'.join(userlog)
+
+
+def _new_note(mw: Any, model: Any) -> 'Note':
+    "Return a new, unsaved note of the note type /model/."
+    if hasattr(mw.col, 'new_note'):
+        return mw.col.new_note(model)
+    # Older versions of Anki.
+    from anki.notes import Note
+    return Note(mw.col, model)
+
+
+def _can_add_in_bulk(mw: Any) -> bool:
+    """
+    Whether this version of Anki can add many notes in one operation. Older
+    versions, such as 2.1.26, can't; they add notes one at a time as before.
+    They also keep all changes in one database transaction until the
+    collection is saved, so there is no commit per note for batching to
+    save.
+    """
+    return hasattr(mw.col, 'add_notes')
+
+
+def _add_notes_in_bulk(mw: Any, notes: List[Tuple['Note', int]]) -> None:
+    """
+    Add new notes, each with the ID of the deck its cards go in, in a single
+    operation. Adding notes one at a time makes a round trip to Anki's
+    backend for each; adding them together takes a fraction of the time
+    for a large wiki. The notes are given their IDs, as by addNote().
+    """
+    from anki.collection import AddNoteRequest
+    mw.col.add_notes([AddNoteRequest(note=n, deck_id=did) for n, did in notes])
+
 
-def _change_note_type(mw: Any, tw_note: TwNote, anki_note: Note) -> Note:
+def _change_note_type(mw: Any, tw_note: TwNote, anki_note: 'Note') -> 'Note':
     """
     If the ID is now a cloze note rather than a question note or vice versa,
     change the note type in Anki prior to trying to complete the sync.
@@ -44,7 +135,8 @@ def _change_note_type(mw: Any, tw_note: TwNote, anki_note: Note) -> Note:
     return mw.col.getNote(mw.col.find_notes(f"nid:{anki_note.id}")[0])
 
 
-def _update_deck(tw_note: TwNote, anki_note: Note, mw: Any, default_deck: str) -> None:
+def _update_deck(tw_note: TwNote, anki_note: 'Note', mw: Any,
+                 default_deck: str) -> Tuple[int, Set[int]]:
     """
     Given a note already in Anki's database, move its cards into an
     appropriate deck if they aren't already there. All cards must go to the
@@ -52,26 +144,89 @@ def _update_deck(tw_note: TwNote, anki_note: Note, mw: Any, default_deck: str) -
     since we don't support any note types with multiple cards!
 
     The note must be flushed to Anki's database for this to work correctly.
+    Return the number of cards that were moved, and the IDs of the decks
+    they were moved out of and into.
     """
     # Confusingly, mw.col.decks.id returns the ID of an existing deck, and
     # creates it if it doesn't exist. This happens to be exactly what we want.
     deck_name = tw_note.target_deck or default_deck
     new_did = mw.col.decks.id(deck_name)
+    moved = 0
+    decks: Set[int] = set()
     for card in anki_note.cards():
         if card.did != new_did:
+            decks.update((card.did, new_did))
             card.did = new_did
             card.flush()
+            moved += 1
+    return moved, decks
 
 
-def sync(tw_notes: Set[TwNote], mw: Any, conf: Any) -> str:
+def _find_note_ids(mw: Any, model_search: str, only: Optional[Set[Twid]]) -> List[int]:
+    """
+    Return the Anki note IDs of the TiddlyRemember notes matching
+    /model_search/, or only (at least) those with one of the TiddlyRemember
+    IDs in /only/, if given.
+    """
+    if only is None or any('"' in i or '\\' in i for i in only):
+        return mw.col.find_notes(model_search)
+
+    nids: List[int] = []
+    twids = sorted(only)
+    for start in range(0, len(twids), ID_SEARCH_CHUNK):
+        id_search = ' or '.join(f'"{trmodels.ID_FIELD_NAME}:{i}"'
+                                for i in twids[start:start+ID_SEARCH_CHUNK])
+        nids.extend(mw.col.find_notes(f"({model_search}) ({id_search})"))
+    return nids
+
+
+def _wiki_search(model_search: str, wiki: str) -> str:
+    """
+    Return a search for the notes matching /model_search/ whose Wiki field
+    is /wiki/. The search may match more notes than that: if the name has
+    characters with a special meaning in searches, it isn't searched for.
+
+    >>> print(_wiki_search('note:"A"', 'My Wiki'))
+    (note:"A") "Wiki:My Wiki"
+    >>> print(_wiki_search('note:"A"', 'my_wiki'))
+    note:"A"
+    """
+    if any(c in wiki for c in '"\\*_'):
+        return model_search
+    return f'({model_search}) "{trmodels.WIKI_FIELD_NAME}:{wiki}"'
+
+
+def sync(tw_notes: Iterable[TwNote], mw: Any, conf: Any,
+         trace: Optional[SyncTrace] = None, only: Optional[Set[Twid]] = None,
+         remove: bool = True, wiki: Optional[str] = None) -> SyncResult:
     """
     Compare TiddlyWiki notes with the notes currently in our Anki collection
     and add, edit, and remove notes as needed to get Anki in sync with the
     TiddlyWiki notes.
 
-    :param twnotes: Set of TwNotes extracted from a TiddlyWiki.
+    :param tw_notes: TwNotes extracted from TiddlyWiki. Any iterable will do,
+                     including a generator such as twimport.iter_notes(); it
+                     is consumed once, and if several notes share an ID, the
+                     first one is used.
     :param mw: The Anki main-window object.
-    :return: A log string to pass back to the user, describing the results.
+    :param conf: The add-on's configuration.
+    :param trace: Optional SyncTrace to record the duration of each stage in.
+    :param only: If given, sync only the notes with these IDs: extracted
+                 notes with other IDs are ignored, other Anki notes are left
+                 alone, and only notes with these IDs that were not
+                 extracted are removed.
+    :param remove: If False, notes that were not extracted are left in the
+                   collection rather than removed, for when some tiddlers
+                   may not have been rendered (see prefilter.py). A later
+                   sync with /remove/ True removes them.
+    :param wiki: If given, sync only the notes of the wiki with this name:
+                 extracted notes from other wikis are ignored, and Anki notes
+                 whose Wiki field names another wiki are left alone, unless
+                 this wiki now has a note with the same ID, in which case the
+                 note is moved to this wiki. A note moved from this wiki to
+                 another is removed, as it can't be told apart from a note
+                 that was deleted; syncing the other wiki first avoids that.
+    :return: A SyncResult describing what changed; its log() is for the user.
 
     .. warning::
         This is a unidirectional update. Any changes to notes made directly
@@ -88,55 +243,124 @@ def sync(tw_notes: Set[TwNote], mw: Any, conf: Any) -> str:
     Be aware that deleting a note from TiddlyWiki will permanently delete
     it from Anki.
     """
+    trace = trace if trace is not None else SyncTrace()
+
     # Make sure the note types exist and haven't been modified in a way
     # that could prevent the sync from working properly.
-    trmodels.ensure_note_types()
-    trmodels.verify_note_types()
+    with trace.stage("verify note types"):
+        trmodels.ensure_note_types()
+        trmodels.verify_note_types()
 
     # Retrieve Anki notes and TiddlyWiki notes and identify what adds, edits,
     # and removes are needed to update the Anki collection.
-    extracted_notes: Set[TwNote] = tw_notes
-    extracted_twids: Set[Twid] = set(n.id_ for n in extracted_notes)
-    extracted_notes_map: Dict[Twid, TwNote] = {n.id_: n for n in extracted_notes}
+    with trace.stage("collect notes") as timing:
+        extracted_notes_map: Dict[Twid, TwNote] = {}
+        for n in tw_notes:
+            if (only is None or n.id_ in only) and (wiki is None or n.wiki_name == wiki):
+                extracted_notes_map.setdefault(n.id_, n)
+        extracted_twids: Set[Twid] = set(extracted_notes_map)
+        timing.count = len(extracted_twids)
+
+    with trace.stage("load anki notes") as timing:
+        model_search = ' or '.join(f'note:"{i.name}"' for i in trmodels.all_note_types())
+        scope_search = model_search if wiki is None else _wiki_search(model_search, wiki)
+        anki_notes: Set['Note'] = set(mw.col.getNote(nid)
+                                    for nid in _find_note_ids(mw, scope_search, only))
+        # The searches may match more loosely than we want.
+        if only is not None:
+            anki_notes = set(n for n in anki_notes
+                             if n[trmodels.ID_FIELD_NAME] in only)
+        if wiki is not None:
+            anki_notes = set(n for n in anki_notes
+                             if n[trmodels.WIKI_FIELD_NAME] == wiki)
+            # Notes now in this wiki that were in another one before.
+            moved_in = extracted_twids.difference(n[trmodels.ID_FIELD_NAME]
+                                                  for n in anki_notes)
+            if moved_in:
+                anki_notes.update(
+                    n for n in (mw.col.getNote(nid)
+                                for nid in _find_note_ids(mw, model_search, moved_in))
+                    if n[trmodels.ID_FIELD_NAME] in moved_in)
+        timing.count = len(anki_notes)
 
-    model_search = ' or '.join(f'note:"{i.name}"' for i in trmodels.all_note_types())
-    anki_notes: Set[Note] = set(mw.col.getNote(nid)
-                                for nid in mw.col.find_notes(model_search))
-    id_field = trmodels.ID_FIELD_NAME
-    anki_twids: Set[Twid] = set(cast(Twid, n[id_field]) for n in anki_notes)
-    anki_notes_map: Dict[Twid, Note] = {cast(Twid, n[id_field]): n for n in anki_notes}
+    with trace.stage("diff"):
+        id_field = trmodels.ID_FIELD_NAME
+        anki_twids: Set[Twid] = set(cast(Twid, n[id_field]) for n in anki_notes)
+        anki_notes_map: Dict[Twid, 'Note'] = {cast(Twid, n[id_field]): n
+                                            for n in anki_notes}
 
-    adds = extracted_twids.difference(anki_twids)
-    edits = extracted_twids.intersection(anki_twids)
-    removes = anki_twids.difference(extracted_twids)
+        adds = extracted_twids.difference(anki_twids)
+        edits = extracted_twids.intersection(anki_twids)
+        removes = anki_twids.difference(extracted_twids) if remove else set()
 
-    userlog = []
+    result = SyncResult()
+    result.removals_deferred = not remove
 
     # Make the changes to the collection.
-    for note_id in adds:
-        tw_note = extracted_notes_map[note_id]
-        n = Note(mw.col, mw.col.models.byName(tw_note.model.name))
-        n.model()['did'] = mw.col.decks.id(tw_note.target_deck     # type: ignore
-                                           or conf['defaultDeck'])
-        tw_note.update_fields(n)
-        mw.col.addNote(n)
-    userlog.append(f"Added {len(adds)} {pluralize('note', len(adds))}.")
-
-    edit_count = 0
+    with trace.stage("add notes") as timing:
+        threshold = conf.get('bulkAddThreshold', BULK_ADD_THRESHOLD)
+        bulk = 0 < threshold <= len(adds) and _can_add_in_bulk(mw)
+        models: Dict[str, Any] = {}
+        dids: Dict[str, int] = {}
+        pending: List[Tuple['Note', int]] = []
+        for note_id in adds:
+            tw_note = extracted_notes_map[note_id]
+            model_name = tw_note.model.name
+            if model_name not in models:
+                models[model_name] = mw.col.models.byName(model_name)
+            deck_name = tw_note.target_deck or conf['defaultDeck']
+            if deck_name not in dids:
+                dids[deck_name] = mw.col.decks.id(deck_name)
+            did = dids[deck_name]
+            n = _new_note(mw, models[model_name])
+            tw_note.update_fields(n)
+            if bulk:
+                pending.append((n, did))
+            else:
+                n.model()['did'] = did  # type: ignore
+                mw.col.addNote(n)
+                result.note_ids.add(n.id)
+            result.deck_ids.add(did)
+        if pending:
+            _add_notes_in_bulk(mw, pending)
+            result.note_ids.update(n.id for n, _ in pending)
+        timing.count = len(adds)
+    result.added = len(adds)
+
     for note_id in edits:
         anki_note = anki_notes_map[note_id]
         tw_note = extracted_notes_map[note_id]
         if not tw_note.model_equal(anki_note):
-            new_note = _change_note_type(mw, tw_note, anki_note)
-            anki_note = anki_notes_map[note_id] = new_note
-        if not tw_note.fields_equal(anki_note):
-            tw_note.update_fields(anki_note)
-            anki_note.flush()
-            edit_count += 1
-        _update_deck(tw_note, anki_note, mw, conf['defaultDeck'])
-    userlog.append(f"Updated {edit_count} {pluralize('note', edit_count)}.")
-
-    mw.col.remove_notes([anki_notes_map[twid].id for twid in removes])
-    userlog.append(f"Removed {len(removes)} {pluralize('note', len(removes))}.")
-
-    return '\n'.join(userlog)
+            with trace.stage("change note types") as timing:
+                new_note = _change_note_type(mw, tw_note, anki_note)
+                anki_note = anki_notes_map[note_id] = new_note
+                result.note_ids.add(anki_note.id)
+                timing.count += 1
+        with trace.stage("edit notes") as timing:
+            changes = tw_note.update_fields(anki_note)
+            if changes.changed:
+                anki_note.flush()
+                result.note_ids.add(anki_note.id)
+                result.updated += 1
+                result.fields_written += len(changes.fields)
+                result.fields_kept += len(anki_note.keys()) - len(changes.fields)
+                timing.count += 1
+        with trace.stage("move cards") as timing:
+            moved, decks = _update_deck(tw_note, anki_note, mw, conf['defaultDeck'])
+            if moved:
+                result.note_ids.add(anki_note.id)
+                result.deck_ids.update(decks)
+            timing.count += moved
+
+    with trace.stage("remove notes") as timing:
+        nids = [anki_notes_map[twid].id for twid in removes]
+        if nids:
+            result.deck_ids.update(mw.col.db.list(
+                "select distinct did from cards where nid in (%s)"
+                % ','.join(str(i) for i in nids)))
+            result.note_ids.update(nids)
+        mw.col.remove_notes(nids)
+        timing.count = len(removes)
+    result.removed = len(removes)
+
+    return result
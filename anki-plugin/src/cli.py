@@ -0,0 +1,190 @@
+"""
+cli.py - extract notes from TiddlyWikis without Anki
+
+Runs the same extraction as the Anki add-on (twimport.iter_notes()) for the
+wikis in an add-on configuration file and writes the notes found to
+standard output as newline-delimited JSON, one note per line (see
+TwNote.to_record()). Nothing from Anki or Qt is imported, so this can be
+used for batch jobs and timing on machines without Anki installed.
+
+Run it as a module from the directory containing the add-on, for instance:
+
+    python -m tiddlyremember config.json --wiki MyWiki --trace trace.json
+
+The configuration file may be the add-on's config.json, Anki's meta.json
+for the add-on (which stores the user's configuration under "config"), or
+any JSON file in the same format.
+
+With --check-static, nothing is extracted; instead, each wiki is checked
+for differences between reading its notes without rendering (the
+'readStaticNotes' option) and rendering it in full.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Set, TextIO
+
+from . import twimport
+from .timing import SyncTrace
+from .util import Twid
+
+
+def _load_config(path: str) -> Dict[str, Any]:
+    "Read an add-on configuration from a config.json or meta.json file."
+    with open(path, encoding='utf-8') as f:
+        conf = json.load(f)
+    if 'wikis' not in conf and 'config' in conf:
+        conf = conf['config']
+    if 'wikis' not in conf:
+        raise Exception(f"The file '{path}' does not look like a TiddlyRemember "
+                        f"configuration: it has no 'wikis' section.")
+    return conf
+
+
+def _select_wikis(conf: Dict[str, Any], names: Sequence[str]) -> List[str]:
+    """
+    Return the names of the wikis to extract, in the order the add-on
+    processes them, so that duplicate IDs are resolved the same way.
+    """
+    wiki_names = list(reversed(list(conf['wikis'])))
+    for name in names:
+        if name not in conf['wikis']:
+            raise Exception(f"There is no wiki named '{name}' in the configuration. "
+                            f"Available wikis: {', '.join(conf['wikis'])}.")
+    return [i for i in wiki_names if not names or i in names]
+
+
+def extract(conf: Dict[str, Any], wiki_names: Sequence[str], out: TextIO,
+            tw_binary: Optional[str] = None,
+            trace: Optional[SyncTrace] = None,
+            read_static: Optional[bool] = None,
+            candidates: Optional[bool] = None) -> int:
+    """
+    Extract the notes from each of the named wikis and write them to /out/
+    as NDJSON. A note whose ID was already written for an earlier wiki is
+    skipped, as in the add-on. Return the number of notes written.
+
+    /read_static/ overrides the configuration's 'readStaticNotes' option,
+    and /candidates/ its 'candidateFilter' option. Unlike the add-on, the
+    command line never renders everything on its own to catch notes the
+    candidate filter misses; pass candidates=False for that.
+    """
+    tw_binary = tw_binary or conf.get('tiddlywikiBinary', '').strip() or 'tiddlywiki'
+    if read_static is None:
+        read_static = conf.get('readStaticNotes', False)
+    if candidates is None:
+        candidates = conf.get('candidateFilter', False)
+    seen: Set[Twid] = set()
+    for wiki_name in wiki_names:
+        wiki_conf = conf['wikis'][wiki_name]
+        # Notes are written as they are extracted, so only their IDs are
+        # ever held in memory.
+        found = False
+        for note in twimport.iter_notes(
+                tw_binary=tw_binary,
+                wiki_path=wiki_conf['path'],
+                wiki_type=wiki_conf['type'],
+                wiki_name=wiki_name,
+                filter_=wiki_conf['contentFilter'],
+                trace=trace,
+                read_static=read_static,
+                records=conf.get('renderRecords', False),
+                bundle=conf.get('renderBundle', False),
+                candidates=candidates,
+                node=twimport.NodeOptions.from_conf(wiki_conf)):
+            found = True
+            if note.id_ in seen:
+                continue
+            seen.add(note.id_)
+            if wiki_conf.get('permalink', ''):
+                note.set_permalink(wiki_conf['permalink'])
+            out.write(json.dumps(note.to_record(), ensure_ascii=False) + '\n')
+        if not found:
+            print(f"Warning: no notes were found in the wiki {wiki_name}.",
+                  file=sys.stderr)
+        out.flush()
+    return len(seen)
+
+
+def check_static(conf: Dict[str, Any], wiki_names: Sequence[str], out: TextIO,
+                 tw_binary: Optional[str] = None,
+                 trace: Optional[SyncTrace] = None) -> int:
+    """
+    Write the differences twimport.check_static() finds in each of the
+    named wikis to /out/, one per line. Return the number of differences.
+    """
+    tw_binary = tw_binary or conf.get('tiddlywikiBinary', '').strip() or 'tiddlywiki'
+    count = 0
+    for wiki_name in wiki_names:
+        wiki_conf = conf['wikis'][wiki_name]
+        differences = twimport.check_static(
+            tw_binary=tw_binary,
+            wiki_path=wiki_conf['path'],
+            wiki_type=wiki_conf['type'],
+            wiki_name=wiki_name,
+            filter_=wiki_conf['contentFilter'],
+            trace=trace,
+            node=twimport.NodeOptions.from_conf(wiki_conf))
+        for difference in differences:
+            out.write(f"{wiki_name}: {difference}\n")
+        count += len(differences)
+    return count
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    "Command-line entry point."
+    parser = argparse.ArgumentParser(
+        prog='python -m tiddlyremember',
+        description="Extract TiddlyRemember notes from TiddlyWikis as "
+                    "newline-delimited JSON, without Anki.")
+    parser.add_argument('config', help="add-on configuration file (config.json or "
+                                       "meta.json)")
+    parser.add_argument('--wiki', action='append', default=[], metavar='NAME',
+                        help="only extract this wiki (may be repeated; "
+                             "default: all configured wikis)")
+    parser.add_argument('--tiddlywiki', metavar='PATH',
+                        help="TiddlyWiki executable, overriding the configuration")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write per-stage timings of the extraction to FILE as JSON")
+    static = parser.add_mutually_exclusive_group()
+    static.add_argument('--static', action='store_true', default=None,
+                        help="read simple notes without rendering, overriding the "
+                             "configuration's readStaticNotes option")
+    static.add_argument('--no-static', action='store_false', dest='static',
+                        help="render every tiddler, overriding the configuration")
+    static.add_argument('--check-static', action='store_true',
+                        help="instead of extracting, report any notes that reading "
+                             "without rendering gets differently from rendering")
+    candidates = parser.add_mutually_exclusive_group()
+    candidates.add_argument('--candidates', action='store_true', default=None,
+                            help="only render tiddlers that could contain notes, "
+                                 "overriding the configuration's candidateFilter "
+                                 "option")
+    candidates.add_argument('--all-tiddlers', action='store_false', dest='candidates',
+                            help="render every tiddler matching the content filter, "
+                                 "overriding the configuration")
+    args = parser.parse_args(argv)
+
+    trace = SyncTrace()
+    trace.reset_peak_memory()
+    try:
+        conf = _load_config(args.config)
+        wiki_names = _select_wikis(conf, args.wiki)
+        if args.check_static:
+            differences = check_static(conf, wiki_names, sys.stdout, args.tiddlywiki,
+                                       trace)
+        else:
+            count = extract(conf, wiki_names, sys.stdout, args.tiddlywiki, trace,
+                            args.static, args.candidates)
+    except Exception as e:  # pylint: disable=broad-except
+        sys.exit(f"Error: {e}")
+
+    trace.finish()
+    if args.check_static:
+        print(f"Found {differences} differences. {trace.summary()}", file=sys.stderr)
+    else:
+        print(f"Extracted {count} notes. {trace.summary()}", file=sys.stderr)
+    if args.trace:
+        trace.write(args.trace)
+    if args.check_static and differences:
+        sys.exit(1)
@@ -6,55 +6,11 @@ To change the argument of the remembercz TiddlyWiki macro into suitable
 text for the Text field of an Anki cloze note, simply call this function
 on that argument.
 """
-from collections import Counter
-import itertools
 import re
-from typing import Iterable, List, Optional, Sequence
+from typing import List, Set, Tuple
 
-
-class Occlusion:
-    """
-    Representation of an occlusion -- a part within a remembercz TiddlyWiki note
-    that is in {single braces} and needs to become an Anki occlusion.
-
-    Constructed from a placeholder index (this will be used to substitute the
-    occlusion back into the text of the note once parsing is done) and raw_text
-    (the part that was between the {braces} in the original user-entered text).
-    """
-    def __init__(self, placeholder_index: int, raw_text: str) -> None:
-        self.placeholder_index = placeholder_index
-        self.raw_text = raw_text
-        self.text: Optional[str] = None
-        self.anki_index: Optional[int] = None
-        self._parse_text()
-
-    @property
-    def placeholder(self) -> str:
-        "A Python format-string placeholder for this occlusion."
-        return "{%i}" % self.placeholder_index
-
-    @property
-    def anki_occlusion(self) -> str:
-        """
-        This occlusion, in the form that Anki understands.
-
-        The caller must ensure that it has filled in self.anki_index if this
-        Occlusion was originally constructed from an implicitly numbered
-        occlusion (one that looks like {this}, rather than an {{c1::explicit
-        occlusion}}).
-        """
-        assert self.anki_index is not None, \
-            "Tried to render occlusion before filling in missing index!"
-        return "{{c%i::%s}}" % (self.anki_index, self.text)
-
-    def _parse_text(self) -> None:
-        "Fill text and maybe anki_index field from raw_text."
-        m = re.match(r'^c(?P<index>[1-9][0-9]*)::(?P<text>.*)', self.raw_text)
-        if m:
-            self.anki_index = int(m.group('index'))
-            self.text = m.group('text')
-        else:
-            self.text = self.raw_text
+_OCCLUSION_RE = re.compile(r'{([^}]*)}')
+_EXPLICIT_RE = re.compile(r'c(?P<index>[1-9][0-9]*)::(?P<text>.*)')
 
 
 def ankify_clozes(text: str) -> str:
@@ -63,69 +19,73 @@ def ankify_clozes(text: str) -> str:
     work in Anki. The following documents the simplified format.
 
     Implicit cloze identification:
-        >>> _ankify_clozes("This is a {test}.")
+        >>> ankify_clozes("This is a {test}.")
         'This is a {{c1::test}}.'
 
-        >>> _ankify_clozes("{This} is a {test}.")
+        >>> ankify_clozes("{This} is a {test}.")
         '{{c1::This}} is a {{c2::test}}.'
 
     Explicit cloze identification:
-        >>> _ankify_clozes("This is a {c1::test}.")
+        >>> ankify_clozes("This is a {c1::test}.")
         'This is a {{c1::test}}.'
 
-        >>> _ankify_clozes("{c1::This} is a {c1::test}.")
+        >>> ankify_clozes("{c1::This} is a {c1::test}.")
         '{{c1::This}} is a {{c1::test}}.'
 
-        >>> _ankify_clozes("{c1::This} is a {c2::test}.")
+        >>> ankify_clozes("{c1::This} is a {c2::test}.")
         '{{c1::This}} is a {{c2::test}}.'
 
-        >>> _ankify_clozes("{c1::This} is a {c2::second} {c3::test}.")
+        >>> ankify_clozes("{c1::This} is a {c2::second} {c3::test}.")
         '{{c1::This}} is a {{c2::second}} {{c3::test}}.'
 
     A mixture -- the first unused numbers are selected for the implicit matches:
-        >>> _ankify_clozes("{c1::This} is a {c2::third} {test}.")
+        >>> ankify_clozes("{c1::This} is a {c2::third} {test}.")
         '{{c1::This}} is a {{c2::third}} {{c3::test}}.'
 
-        >>> _ankify_clozes("{c1::This} is a {c3::fourth} {test}.")
+        >>> ankify_clozes("{c1::This} is a {c3::fourth} {test}.")
         '{{c1::This}} is a {{c3::fourth}} {{c2::test}}.'
 
-        >>> _ankify_clozes("{c1::This} is a {c3::fourth} {test} {cloze deletion}.")
+        >>> ankify_clozes("{c1::This} is a {c3::fourth} {test} {cloze deletion}.")
         '{{c1::This}} is a {{c3::fourth}} {{c2::test}} {{c4::cloze deletion}}.'
+
+    Braces that aren't part of an occlusion are passed through untouched:
+        >>> ankify_clozes("A set like } or {x} is fine.")
+        'A set like } or {{c1::x}} is fine.'
     """
-    def next_occlusion_number(seq: Sequence[int]) -> Iterable[int]:
-        """
-        Return natural numbers not yet present in the sequence,
-        starting from 1. First any gaps in the sequence are filled,
-        then we count upwards to infinity.
-        """
-        if not seq:
-            return itertools.count(1, 1)
+    # Walk the occlusions once, copying the text between them as we go.
+    # Explicitly numbered occlusions can be rendered immediately; implicit
+    # ones get a slot in /parts/ that is filled in once we know which
+    # numbers the explicit ones have used up.
+    parts: List[str] = []
+    implicit: List[Tuple[int, str]] = []
+    used_numbers: Set[int] = set()
+    position = 0
+    for match in _OCCLUSION_RE.finditer(text):
+        parts.append(text[position:match.start()])
+        position = match.end()
+
+        raw_text = match.group(1)
+        explicit = _EXPLICIT_RE.match(raw_text)
+        if explicit:
+            index = int(explicit.group('index'))
+            used_numbers.add(index)
+            parts.append("{{c%i::%s}}" % (index, explicit.group('text')))
         else:
-            c = Counter(seq)  # create dict of elements to number of occurrences
-            return itertools.chain(
-                (i for i in range(1, max(seq)) if c[i] == 0),
-                itertools.count(max(seq)+1, 1))
-
-    # Parse out the occlusions and put in clean Python-style placeholders.
-    occlusions: List[Occlusion] = []
-    def mark_occlusion(match):
-        "Save the contents of an occlusion section, then substitute in a placeholder."
-        o = Occlusion(len(occlusions), match.group(1))
-        occlusions.append(o)
-        return o.placeholder
-    placeholder_text = re.sub(r'{([^}]*)}', mark_occlusion, text)
-
-    # Fill in cloze numbers for occlusions that used the implicit syntax.
-    deferred_mappings = [o for o in occlusions
-                         if o.anki_index is None]
-    used_occlusion_numbers = [o.anki_index for o in occlusions
-                              if o.anki_index is not None]
-    for index, occlusion in zip(next_occlusion_number(used_occlusion_numbers),
-                                deferred_mappings):
-        occlusion.anki_index = index
-    
-    # Replace placeholders with the cleansed, explicified, Anki-format occlusions.
-    return placeholder_text.format(*(i.anki_occlusion for i in occlusions))
+            implicit.append((len(parts), raw_text))
+            parts.append("")
+    if not parts:
+        return text
+    parts.append(text[position:])
+
+    # Implicit occlusions take the lowest numbers not yet in use, in order.
+    number = 0
+    for slot, raw_text in implicit:
+        number += 1
+        while number in used_numbers:
+            number += 1
+        parts[slot] = "{{c%i::%s}}" % (number, raw_text)
+
+    return ''.join(parts)
 
 
 if __name__ == '__main__':
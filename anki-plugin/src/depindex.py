@@ -0,0 +1,215 @@
+"""
+depindex.py - work out which tiddlers to render again after some have changed
+
+Through transclusion, a note written in one tiddler also appears in the
+rendering of every tiddler that transcludes it, so after an edit it isn't
+enough to render again only the tiddlers that were edited. A WikiIndex
+records, for each tiddler of a wiki as of its last render:
+
+* a digest of the file holding it (or, in a single-file wiki, of its
+  fields and text), to tell which tiddlers have changed since;
+* the IDs of the notes found in its rendering;
+* the tiddlers it transcludes, found by scanning its text for {{...}},
+  <$transclude> and <$tiddler>;
+* whether it is dynamic: it contains constructs that may show other
+  tiddlers in ways we can't follow, like <$list>, {{{filters}}} or macro
+  calls, so that any change may change what it shows.
+
+From these, WikiIndex.affected() works out what needs rendering: the
+changed tiddlers, every tiddler that transcludes them (directly or not),
+every tiddler that showed one of the same notes, and every dynamic
+tiddler.
+Changes to system tiddlers, such as the deck and tag mappings or global
+macros, can affect any tiddler, so they call for rendering everything.
+
+Indexes are saved per wiki in the add-on's user_files folder, and are
+discarded (and so rebuilt from a full render) when they were written by a
+different version of this module, or for a different wiki path, type or
+content filter.
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+from .util import Twid, user_files_path
+
+#: Bump when the saved format or the meaning of its contents changes.
+INDEX_VERSION = 3
+
+#: Tiddlers that TiddlyWiki saves as you browse or type, and that never
+#: hold finished notes, so changes to them are ignored.
+VOLATILE_TITLE_PREFIXES = ("Draft of '", "$:/StoryList", "$:/HistoryList",
+                           "$:/state/", "$:/temp/")
+
+_TRANSCLUSION_RE = re.compile(r'(?<!{){{(?!{)([^{}|]*)(?:\|\|([^{}|]*))?}}')
+_WIDGET_RE = re.compile(
+    r'''<\$(?:transclude|tiddler)\b[^>]*?\btiddler\s*=\s*'''
+    r'''(?:"([^"]*)"|'([^']*)'|\[\[(.*?)\]\]|([^\s>"'{<]+)|(\S))''')
+_DYNAMIC_RE = re.compile(r'{{{|<\$(?:list|macrocall|importvariables)\b|<<(?!remember)')
+
+
+class TiddlerEntry(NamedTuple):
+    "What the index knows about one rendered tiddler."
+    notes: Set[Twid]
+    includes: Set[str]
+    dynamic: bool
+
+
+def scan_text(text: str) -> Tuple[Set[str], bool]:
+    """
+    Return the titles of the tiddlers a tiddler's wikitext transcludes,
+    and whether it contains constructs that may show other tiddlers in
+    ways we can't follow.
+
+    >>> sorted(scan_text("{{A}} {{B!!caption}} {{C||Tpl}} {{||Tpl2}} {{{ [tag[x]] }}}")[0])
+    ['A', 'B', 'C', 'Tpl', 'Tpl2']
+    >>> includes, dynamic = scan_text('<$transclude tiddler="D E"/> <$tiddler tiddler=[[F]]>')
+    >>> sorted(includes), dynamic
+    (['D E', 'F'], False)
+    >>> scan_text('<$transclude tiddler=<<currentTiddler>>/> <<rememberq "1" "a" "b">>')
+    (set(), True)
+    """
+    includes: Set[str] = set()
+    dynamic = bool(_DYNAMIC_RE.search(text))
+    for match in _TRANSCLUSION_RE.finditer(text):
+        target, template = match.groups()
+        target = target.split('!!')[0].split('##')[0].strip()
+        for title in (target, (template or '').strip()):
+            if title:
+                includes.add(title)
+    for match in _WIDGET_RE.finditer(text):
+        *literal, other = match.groups()
+        title = next((i for i in literal if i is not None), None)
+        if title is not None:
+            includes.add(title)
+        elif other is not None:
+            # A variable, text reference or macro call.
+            dynamic = True
+    return includes, dynamic
+
+
+def describe(notes: Iterable[Twid], text: str) -> TiddlerEntry:
+    """
+    Return the index entry for a tiddler with wikitext /text/ whose
+    rendering contained /notes/.
+    """
+    includes, dynamic = scan_text(text)
+    # A dynamic tiddler is rendered again after any change, even if it
+    # shows no notes now: the change may be what makes it show one.
+    return TiddlerEntry(set(notes), includes, dynamic)
+
+
+class WikiIndex:
+    """
+    The digests, notes, and transclusions of the tiddlers in one wiki, as
+    of the last time it was rendered.
+    """
+    def __init__(self, wiki_name: str, wiki_conf: Dict[str, Any]) -> None:
+        self.wiki_name = wiki_name
+        self.source = _source(wiki_conf)
+        self.digests: Dict[str, str] = {}
+        self.entries: Dict[str, TiddlerEntry] = {}
+
+    def __repr__(self):
+        return f"WikiIndex(wiki_name={self.wiki_name!r}, entries={len(self.entries)})"
+
+    def changes(self, digests: Dict[str, str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Compare the current digests of a wiki's tiddlers with those in the
+        index, returning the titles of the tiddlers that were added or
+        changed, and of those that were removed. Volatile tiddlers are left
+        out.
+        """
+        changed = set(t for t, d in digests.items() if self.digests.get(t) != d)
+        removed = set(self.digests) - set(digests)
+        return (set(t for t in changed if not t.startswith(VOLATILE_TITLE_PREFIXES)),
+                set(t for t in removed if not t.startswith(VOLATILE_TITLE_PREFIXES)))
+
+    def affected(self, changed: Set[str], removed: Set[str]) -> Optional[Set[str]]:
+        """
+        Return the titles of the tiddlers that must be rendered again after
+        the tiddlers /changed/ were added or changed and /removed/ were
+        removed, or None if the whole wiki must be rendered.
+        """
+        if any(t.startswith('$:/') for t in changed | removed):
+            return None
+
+        included_by: Dict[str, Set[str]] = {}
+        shown_in: Dict[Twid, Set[str]] = {}
+        for title, entry in self.entries.items():
+            for include in entry.includes:
+                included_by.setdefault(include, set()).add(title)
+            for twid in entry.notes:
+                shown_in.setdefault(twid, set()).add(title)
+
+        result = set(changed)
+        pending = list(changed | removed)
+        while pending:
+            title = pending.pop()
+            dependents = set(included_by.get(title, ()))
+            found = self.entries.get(title)
+            for twid in (found.notes if found is not None else ()):
+                dependents.update(shown_in[twid])
+            for dependent in dependents - result - removed:
+                result.add(dependent)
+                pending.append(dependent)
+        if result or removed:
+            result.update(t for t, e in self.entries.items()
+                          if e.dynamic and t not in removed)
+        return result
+
+    def forget(self, title: str) -> Set[Twid]:
+        "Remove a tiddler from the index, returning the IDs of its notes."
+        entry = self.entries.pop(title, None)
+        return entry.notes if entry is not None else set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return a JSON-serializable representation of the index."
+        return {
+            'version': INDEX_VERSION,
+            'source': self.source,
+            'digests': self.digests,
+            'tiddlers': {t: {'notes': sorted(e.notes), 'includes': sorted(e.includes),
+                             'dynamic': e.dynamic}
+                         for t, e in self.entries.items()},
+        }
+
+    def save(self) -> None:
+        "Write the index to the add-on's user_files folder."
+        with open(_index_path(self.wiki_name), 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, wiki_name: str, wiki_conf: Dict[str, Any]) -> Optional['WikiIndex']:
+        """
+        Return the saved index for a wiki, or None if there is none or it
+        is out of date.
+        """
+        try:
+            with open(_index_path(wiki_name), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (data.get('version') != INDEX_VERSION
+                or data.get('source') != _source(wiki_conf)):
+            return None
+
+        index = cls(wiki_name, wiki_conf)
+        index.digests = data['digests']
+        index.entries = {t: TiddlerEntry(set(e['notes']), set(e['includes']),
+                                         e['dynamic'])
+                         for t, e in data['tiddlers'].items()}
+        return index
+
+
+def _source(wiki_conf: Dict[str, Any]) -> Dict[str, str]:
+    "The parts of a wiki's configuration that an index is only valid for."
+    return {k: wiki_conf[k] for k in ('type', 'path', 'contentFilter')}
+
+
+def _index_path(wiki_name: str) -> str:
+    "Path of the saved index for a wiki; wiki names may not be valid filenames."
+    slug = re.sub(r'[^\w-]+', '_', wiki_name)[:40]
+    digest = hashlib.sha1(wiki_name.encode('utf-8')).hexdigest()[:8]
+    return user_files_path(f"index-{slug}-{digest}.json")
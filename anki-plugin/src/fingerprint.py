@@ -0,0 +1,215 @@
+"""
+fingerprint.py - tell cheaply whether a sync would change anything
+
+Most syncs find the wikis just as they were last time, and the collection
+just as the last sync left it. Rather than rendering everything to find
+that out, a sync first takes a fingerprint of what it depends on:
+
+* the add-on's configuration and code (the size and modification time
+  of its files, which change when it is updated), and the TiddlyWiki
+  executable;
+* each wiki's source: the path, size and modification time of every file
+  in a folder wiki, the size and modification time of a single-file wiki,
+  and the ETag and Last-Modified headers of a URL wiki;
+* the TiddlyRemember note types in the collection, and the number and
+  latest modification time of the notes using them, so that notes edited,
+  added or removed in Anki are still put right by the next sync.
+
+If the fingerprint matches the one saved after the last successful sync,
+there is nothing to do. A URL wiki whose server sends no validators can't
+be fingerprinted, and is synced every time. Asking the server takes a
+while, so source_fingerprint() should be called from a background thread
+when needs_network() says so; the rest only looks at file metadata.
+
+Saving a single-file wiki rewrites it even when nothing changed, which
+counts as a change; hashing the file instead would tell, but would mean
+reading all of it before every sync.
+
+Moving cards to another deck in Anki doesn't change the fingerprint (card
+modification times change with every review, so they can't be used), and
+neither does a new version of the TiddlyRemember plugin installed outside a
+folder wiki. Such syncs would be skipped, so the 'skipUnchangedSyncs'
+option is off unless the user turns it on.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from . import trmodels
+from .util import user_files_path
+
+#: File in user_files holding the fingerprint of the last successful sync.
+FINGERPRINT_FILENAME = 'last-sync-fingerprint.json'
+#: Change this when what goes into a fingerprint changes, so that old ones
+#: no longer match.
+FINGERPRINT_VERSION = 3
+#: Seconds to wait for a URL wiki's server to answer a HEAD request.
+URL_TIMEOUT = 10
+#: The folder holding the add-on's code.
+ADDON_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def _digest(value: Any) -> str:
+    """
+    Return a hash of a JSON-serializable value, which doesn't depend on
+    the order of dictionary keys.
+
+    >>> _digest({'a': 1, 'b': [2]}) == _digest({'b': [2], 'a': 1})
+    True
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _walk_stats(folder: str) -> Iterator[Tuple[str, int, int]]:
+    "Yield the path, size and modification time of every file under /folder/."
+    for entry in os.scandir(folder):
+        if entry.is_dir():
+            yield from _walk_stats(entry.path)
+        elif entry.is_file():
+            stat = entry.stat()
+            yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def _folder_fingerprint(path: str) -> Optional[str]:
+    if not os.path.isdir(path):
+        return None
+    return _digest(sorted(_walk_stats(path)))
+
+
+def _file_fingerprint(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _digest([path, stat.st_size, stat.st_mtime_ns])
+
+
+def _url_fingerprint(url: str) -> Optional[str]:
+    try:
+        r = requests.head(url, allow_redirects=True, timeout=URL_TIMEOUT)
+        r.raise_for_status()
+    except requests.RequestException:
+        return None
+    validators = [r.headers.get('ETag'), r.headers.get('Last-Modified')]
+    if not any(validators):
+        return None
+    return _digest([r.url, *validators, r.headers.get('Content-Length')])
+
+
+def _addon_fingerprint() -> str:
+    "Return a fingerprint of the add-on's code, which changes when it is updated."
+    stats = []
+    for entry in os.scandir(ADDON_FOLDER):
+        if entry.name.endswith('.py') and entry.is_file():
+            stat = entry.stat()
+            stats.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return _digest(sorted(stats))
+
+
+def wiki_fingerprint(wiki_conf: Dict[str, str]) -> Optional[str]:
+    """
+    Return a fingerprint of the source of a wiki, as described in the module
+    docstring, or None if the wiki can't be fingerprinted (including if it
+    can't be read at all, so that the sync reports the problem).
+    """
+    path, wiki_type = wiki_conf['path'], wiki_conf['type']
+    if wiki_type == 'folder':
+        return _folder_fingerprint(path)
+    elif wiki_type == 'file':
+        return _file_fingerprint(path)
+    elif wiki_type == 'url':
+        return _url_fingerprint(path)
+    else:
+        return None
+
+
+def needs_network(conf: Dict[str, Any]) -> bool:
+    "Whether source_fingerprint() has to ask a server about a URL wiki."
+    return any(w['type'] == 'url' for w in conf['wikis'].values())
+
+
+def source_fingerprint(conf: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Return a fingerprint of the configuration and of every configured wiki,
+    or None if one of the wikis can't be fingerprinted. It should be taken
+    before the wikis are read, so that changes made during a sync are
+    noticed by the next one.
+
+    Like the rest of the fingerprint, it is made of JSON types only (lists,
+    not tuples), so that it compares equal to itself once saved and loaded.
+    """
+    wikis: Dict[str, str] = {}
+    for name, wiki_conf in conf['wikis'].items():
+        fingerprint = wiki_fingerprint(wiki_conf)
+        if fingerprint is None:
+            return None
+        wikis[name] = fingerprint
+
+    try:
+        stat = os.stat(conf['tiddlywikiBinary'])
+        binary: Optional[List[int]] = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        binary = None  # found on the PATH
+    return {
+        'version': FINGERPRINT_VERSION,
+        'addon': _addon_fingerprint(),
+        'config': _digest(conf),
+        'binary': binary,
+        'wikis': wikis,
+    }
+
+
+def collection_fingerprint(mw: Any) -> Dict[str, Any]:
+    """
+    Return a fingerprint of the TiddlyRemember note types in the collection
+    and the notes using them.
+    """
+    fingerprint: Dict[str, Any] = {}
+    for model_data in trmodels.all_note_types():
+        model = mw.col.models.byName(model_data.name)
+        if model is None:
+            fingerprint[model_data.name] = None
+            continue
+        count, latest = mw.col.db.first(
+            "select count(), max(mod) from notes where mid = ?", model['id'])
+        fingerprint[model_data.name] = [model['id'], model['mod'], count, latest]
+    return fingerprint
+
+
+def _load() -> Optional[Dict[str, Any]]:
+    try:
+        with open(user_files_path(FINGERPRINT_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def unchanged(source: Dict[str, Any], mw: Any) -> bool:
+    """
+    Return whether /source/ (from source_fingerprint()) and the collection
+    are the same as after the last successful sync.
+    """
+    last = _load()
+    if last is None or last.get('source') != source:
+        return False
+    return last.get('collection') == collection_fingerprint(mw)
+
+
+def save(source: Dict[str, Any], mw: Any) -> None:
+    """
+    Remember /source/, and the state of the collection now, as those of the
+    last successful sync. Call once the sync's changes have been made.
+    """
+    with open(user_files_path(FINGERPRINT_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'source': source, 'collection': collection_fingerprint(mw)}, f)
+
+
+def forget() -> None:
+    "Make sure the next sync runs in full, whatever its fingerprint."
+    try:
+        os.remove(user_files_path(FINGERPRINT_FILENAME))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,319 @@
+"""
+media.py - copy the images in notes into Anki's media folder
+
+When a tiddler is parsed, the images in a note's fields are kept as <img>
+tags with the source TiddlyWiki rendered for them (see
+twnote._text_with_images()). Before the note is synced, MediaImporter
+copies each image into Anki's media folder and points the tag at the copy.
+The source can be:
+
+* an image embedded in the wiki, rendered as a data: URI;
+* an image stored outside the wiki with _canonical_uri, or linked with
+  [img[...]], given as a path relative to the wiki (for a single-file wiki,
+  to the folder it is in) or as a URL.
+
+Local images are only copied from inside the wiki's folder (the folder a
+single-file wiki is in), so a note can't copy any other file readable by
+Anki into the collection, where it would be synced to AnkiWeb.
+
+Each image is stored under a name made from a hash of its contents, so an
+image used by many notes, or by several wikis, is only stored once, and an
+image that is already in the media folder is never written again.
+
+Hashing a large image takes a while, so a MediaCache remembers the size
+and modification time each file had when it was hashed, and the name it
+got; as long as those are the same, the file is neither read nor copied
+again. Images fetched from a URL are assumed not to change.
+
+Embedded images can be large too, and any exact check of one means reading
+all of its data: URI, at much the same cost as hashing it. So they are
+remembered by where they are -- the wiki and note, and which image of the
+note it is -- along with the length of the URI and its first and last
+DATA_URI_SAMPLE characters (see _data_uri_key()). A URI no longer than
+twice that is covered in full, so only an edit to the middle of a large
+image that leaves its length and both ends as they were goes unnoticed.
+
+Images are found and copied while notes are extracted, in a background
+thread, but a sync that is cancelled or fails must leave the collection as
+it was. So the copies are first written to a staging folder beside the
+media folder, and only moved into it by MediaImporter.commit() once the
+sync has made its changes; Anki then picks them up as it does files added
+by hand. MediaImporter.discard() throws them away instead.
+"""
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from tempfile import mkdtemp
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, unquote_to_bytes, urljoin, urlparse
+from urllib.request import url2pathname
+
+import requests
+
+from .twnote import TwNote
+from .util import user_files_path
+
+#: File in user_files holding the MediaCache.
+CACHE_FILENAME = 'media-cache.json'
+#: Prefix of the names of the files added to the media folder.
+NAME_PREFIX = 'tr-'
+#: Seconds to wait for an image to download.
+DOWNLOAD_TIMEOUT = 30
+#: Characters from each end of a data: URI that identify it, with its
+#: length and position (see _data_uri_key()).
+DATA_URI_SAMPLE = 64 * 1024
+#: Extensions for types mimetypes.guess_extension() is unreliable about.
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/svg+xml': '.svg'}
+
+
+class MediaCache:
+    """
+    What is known about the images already copied: for each local file, its
+    size and modification time when it was hashed and the name it was given;
+    for each URL, the name its image was given; and for each embedded image,
+    by the key from _data_uri_key(), the name it was given.
+    """
+    def __init__(self) -> None:
+        self.files: Dict[str, Tuple[int, int, str]] = {}
+        self.urls: Dict[str, str] = {}
+        self.data: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls) -> 'MediaCache':
+        "Read the cache from user_files, or return an empty one if there is none."
+        cache = cls()
+        try:
+            with open(user_files_path(CACHE_FILENAME), encoding='utf-8') as f:
+                data = json.load(f)
+            cache.files = {k: tuple(v) for k, v in data['files'].items()}  # type: ignore
+            cache.urls = data['urls']
+            cache.data = data.get('data', {})
+        except (OSError, ValueError, KeyError):
+            pass
+        return cache
+
+    def save(self) -> None:
+        "Write the cache to user_files."
+        with open(user_files_path(CACHE_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'urls': self.urls, 'data': self.data}, f)
+
+
+def media_name(content: bytes, extension: str) -> str:
+    """
+    Return the name an image with /content/ is stored under.
+
+    >>> media_name(b'abc', '.PNG')
+    'tr-ba7816bf8f01cfea414140de5dae2223.png'
+    """
+    return NAME_PREFIX + hashlib.sha256(content).hexdigest()[:32] + extension.lower()
+
+
+def _extension(mime_type: str) -> str:
+    "Return the file extension for /mime_type/, or an empty string if unknown."
+    mime_type = mime_type.lower()
+    return _EXTENSIONS.get(mime_type) or mimetypes.guess_extension(mime_type) or ''
+
+
+def _decode_data_uri(uri: str) -> Optional[Tuple[bytes, str]]:
+    """
+    Return the contents and extension of the file in a data: URI, or None if
+    it can't be decoded.
+
+    >>> _decode_data_uri('data:image/png;base64,YWJj')
+    (b'abc', '.png')
+    >>> _decode_data_uri('data:image/svg+xml,%3Csvg%3E')
+    (b'<svg>', '.svg')
+    """
+    header, comma, data = uri[len('data:'):].partition(',')
+    if not comma:
+        return None
+    params = header.split(';')
+    try:
+        if 'base64' in params[1:]:
+            content = base64.b64decode(data)
+        else:
+            content = unquote_to_bytes(data)
+    except ValueError:
+        return None
+    return content, _extension(params[0] or 'text/plain')
+
+
+def _data_uri_key(uri: str, note: TwNote, position: int) -> str:
+    """
+    Return the key the image at /position/ among those in /note/, with the
+    data: URI /uri/, is remembered by, as described in the module docstring.
+
+    >>> from types import SimpleNamespace
+    >>> note = SimpleNamespace(wiki_name='w', id_='1')
+    >>> short = 'data:image/png;base64,' + 'A' * 100
+    >>> _data_uri_key(short, note, 0) == _data_uri_key(short + 'A', note, 0)
+    False
+    >>> _data_uri_key(short, note, 0) == _data_uri_key(short, note, 1)
+    False
+    """
+    if len(uri) <= 2 * DATA_URI_SAMPLE:
+        sample = uri
+    else:
+        sample = uri[:DATA_URI_SAMPLE] + uri[-DATA_URI_SAMPLE:]
+    where = json.dumps([note.wiki_name, note.id_, position, len(uri)])
+    return hashlib.sha1((where + sample).encode('utf-8')).hexdigest()
+
+
+def _is_within(path: str, folder: str) -> bool:
+    """
+    Whether /path/ is inside /folder/. Both should be resolved with
+    os.path.realpath(), so that neither '..' nor links lead outside.
+
+    >>> _is_within(os.path.join('w', 'img', 'a.png'), 'w')
+    True
+    >>> _is_within(os.path.join('w', '..', 'a.png'), 'w'), _is_within('wx', 'w')
+    (False, False)
+    """
+    path, folder = os.path.normpath(path), os.path.normpath(folder)
+    try:
+        return os.path.commonpath([path, folder]) == folder
+    except ValueError:  # on different drives
+        return False
+
+
+class MediaImporter:
+    """
+    Copies the images in notes to the media folder /media_dir/, as described
+    in the module docstring. Once the sync has made its changes, call
+    commit() to put the images in the media folder and keep what was learned
+    about them for next time; if it doesn't, call discard().
+    """
+    def __init__(self, media_dir: str, cache: Optional[MediaCache] = None) -> None:
+        self.media_dir = media_dir
+        self.cache = cache if cache is not None else MediaCache.load()
+        #: Folder holding the images until commit(), made when first needed.
+        self.staging_dir: Optional[str] = None
+        #: How many images were new to the media folder.
+        self.copied = 0
+
+    def commit(self) -> None:
+        "Move the images copied so far into the media folder, and save the cache."
+        if self.staging_dir is not None:
+            for name in os.listdir(self.staging_dir):
+                target = os.path.join(self.media_dir, name)
+                if not os.path.exists(target):
+                    shutil.move(os.path.join(self.staging_dir, name), target)
+            self.discard()
+        self.cache.save()
+
+    def discard(self) -> None:
+        "Throw away the images copied since the last commit()."
+        if self.staging_dir is not None:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            self.staging_dir = None
+
+    def import_images(self, note: TwNote, wiki_conf: Dict[str, str]) -> None:
+        """
+        Copy the images in /note/, which comes from the wiki configured by
+        /wiki_conf/, to the media folder and point the note at the copies.
+        Images that can't be found are left as they are.
+        """
+        names: Dict[str, str] = {}
+        for position, src in enumerate(note.image_sources()):
+            if src.startswith('data:'):
+                name = self._import_data_uri(src, _data_uri_key(src, note, position))
+            else:
+                name = self._import(src, wiki_conf)
+            if name is not None:
+                names[src] = name
+        if names:
+            note.replace_images(names)
+
+    def _import(self, src: str, wiki_conf: Dict[str, str]) -> Optional[str]:
+        "Copy the image /src/ to the media folder, and return its name there."
+        if wiki_conf['type'] == 'url':
+            return self._import_url(urljoin(wiki_conf['path'], src))
+        url = urlparse(src)
+        if url.scheme in ('http', 'https'):
+            return self._import_url(src)
+        elif url.scheme == 'file':
+            path = url2pathname(url.path)
+        elif url.scheme and len(url.scheme) > 1:  # not a Windows drive letter
+            return None
+        else:
+            path = os.path.join(self._wiki_folder(wiki_conf), unquote(src))
+        path = os.path.realpath(path)
+        if not _is_within(path, self._wiki_folder(wiki_conf)):
+            return None
+        return self._import_file(path)
+
+    @staticmethod
+    def _wiki_folder(wiki_conf: Dict[str, str]) -> str:
+        "The folder the local images of a folder or file wiki must be in."
+        wiki_path = wiki_conf['path']
+        folder = wiki_path if wiki_conf['type'] == 'folder' else os.path.dirname(wiki_path)
+        return os.path.realpath(folder)
+
+    def _import_data_uri(self, uri: str, key: str) -> Optional[str]:
+        cached = self.cache.data.get(key)
+        if cached is not None and self._exists(cached):
+            return cached
+        decoded = _decode_data_uri(uri)
+        if decoded is None:
+            return None
+        name = self._store(*decoded)
+        self.cache.data[key] = name
+        return name
+
+    def _import_file(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self.cache.files.get(path)
+        if (cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns)
+                and self._exists(cached[2])):
+            return cached[2]
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        extension = os.path.splitext(path)[1] or _extension(
+            mimetypes.guess_type(path)[0] or '')
+        name = self._store(content, extension)
+        self.cache.files[path] = (stat.st_size, stat.st_mtime_ns, name)
+        return name
+
+    def _import_url(self, url: str) -> Optional[str]:
+        cached = self.cache.urls.get(url)
+        if cached is not None and self._exists(cached):
+            return cached
+        try:
+            r = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+            r.raise_for_status()
+        except requests.RequestException:
+            return None
+        mime_type = r.headers.get('Content-Type', '').split(';')[0].strip()
+        extension = (_extension(mime_type) if mime_type
+                     else os.path.splitext(urlparse(url).path)[1])
+        name = self._store(r.content, extension)
+        self.cache.urls[url] = name
+        return name
+
+    def _exists(self, name: str) -> bool:
+        "Whether an image is in the media folder, or will be after commit()."
+        return (os.path.exists(os.path.join(self.media_dir, name))
+                or (self.staging_dir is not None
+                    and os.path.exists(os.path.join(self.staging_dir, name))))
+
+    def _store(self, content: bytes, extension: str) -> str:
+        "Stage an image for the media folder, unless it is already there; return its name."
+        name = media_name(content, extension)
+        if not self._exists(name):
+            if self.staging_dir is None:
+                # Beside the media folder, so that commit() only renames files.
+                self.staging_dir = mkdtemp(prefix='tiddlyremember-media-',
+                                           dir=os.path.dirname(self.media_dir))
+            with open(os.path.join(self.staging_dir, name), 'wb') as f:
+                f.write(content)
+            self.copied += 1
+        return name
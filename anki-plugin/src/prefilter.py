@@ -0,0 +1,120 @@
+"""
+prefilter.py - work out which tiddlers of a wiki can contain notes
+
+The default content filter renders every wikitext tiddler in a wiki, yet
+in most wikis only a small share of them hold any notes. Before rendering,
+find_candidates() reads the wiki's files and picks out the
+tiddlers that could render a note:
+
+* tiddlers whose text names one of the TiddlyRemember macros, or a macro
+  (\\define, \\procedure...) defined in a tiddler that names one of them;
+* tiddlers with constructs that may show other tiddlers in ways we can't
+  follow, like <$list> or other macros (see depindex.scan_text());
+* tiddlers stored in files of a folder wiki other than .tid files, whose
+  text isn't read;
+* and every tiddler transcluding any of these, directly or not.
+
+Only these need rendering (see the 'candidateFilter' option). Notes can
+still be produced in ways this misses, for instance by JavaScript macros,
+so a sync that renders everything is run every so often to catch them
+(the 'fullRenderEvery' option).
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Set
+
+from .depindex import scan_text
+from . import staticnotes
+
+#: Macros that render notes.
+NOTE_MACROS = tuple(staticnotes.MACRO_PARAMS)
+
+_DEFINITION_RE = re.compile(r'^\s*\\(?:define|procedure|function|widget)\s+([^(\s]+)',
+                            re.MULTILINE)
+
+
+def _words_re(words: Iterable[str]) -> Pattern:
+    """
+    Return a regex finding any of the macro names /words/ in wikitext: a
+    crude test for a call, but one that errs on the safe side.
+
+    >>> bool(_words_re(['card']).search('<<card "1">>')), bool(_words_re(['card']).search('cards'))
+    (True, False)
+    """
+    alternatives = '|'.join(re.escape(w) for w in sorted(words))
+    return re.compile(rf'(?<![\w-])(?:{alternatives})(?![\w-])')
+
+
+def candidate_titles(texts: Dict[str, str], unread: Iterable[str] = ()) -> Set[str]:
+    """
+    Given the wikitext of every tiddler in a wiki, keyed by title, return
+    the titles of those that could render a note. The tiddlers /unread/,
+    whose text we don't know, are taken to render notes.
+
+    >>> sorted(candidate_titles({
+    ...     'Notes': '<<rememberq "1" "Q" "A">>',
+    ...     'Summary': 'See {{Notes}}.',
+    ...     'Index': '{{Summary}}',
+    ...     'Plain': 'Nothing to see.',
+    ...     '$:/my/macros': '\\\\define card(id) <<remembercz "$id$" "{x}">>',
+    ...     'Cards': '<<card "2">>',
+    ...     'Lists': '<$list filter="[tag[x]]"/>',
+    ... }))
+    ['$:/my/macros', 'Cards', 'Index', 'Lists', 'Notes', 'Summary']
+    """
+    definitions = []
+    for text in texts.values():
+        names = set(_DEFINITION_RE.findall(text))
+        if names:
+            definitions.append((names, text))
+    # Macros wrapping a note macro render notes too, as do macros wrapping
+    # those, and so on.
+    words = set(NOTE_MACROS)
+    changed = True
+    while changed:
+        changed = False
+        mentions = _words_re(words)
+        for names, text in definitions:
+            if not names <= words and mentions.search(text):
+                words |= names
+                changed = True
+
+    found = set(unread)
+    included_by: Dict[str, Set[str]] = {}
+    for title, text in texts.items():
+        includes, dynamic = scan_text(text)
+        for include in includes:
+            included_by.setdefault(include, set()).add(title)
+        if dynamic or mentions.search(text):
+            found.add(title)
+
+    pending = list(found)
+    while pending:
+        for title in included_by.get(pending.pop(), ()):
+            if title not in found:
+                found.add(title)
+                pending.append(title)
+    return found
+
+
+def find_candidates(wiki_path: str) -> Optional[Set[str]]:
+    """
+    Return the titles of the tiddlers in a wiki (a folder wiki, or the file
+    of a single-file wiki) that could render a note, or None if the wiki's
+    files can't tell us (it includes other wikis or has tiddler files we
+    can't read), so that all of them must be rendered.
+    """
+    texts: Dict[str, str] = {}
+    others: List[str] = []
+    try:
+        for fields, text in staticnotes.wiki_tiddlers(wiki_path):
+            title = fields.get('title')
+            if not title:
+                continue
+            if text is None:
+                others.append(title)
+            else:
+                texts[title] = text
+    except staticnotes.NotStatic:
+        return None
+
+    return candidate_titles(texts, others)
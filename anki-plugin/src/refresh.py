@@ -0,0 +1,70 @@
+"""
+refresh.py - bring Anki's windows up to date after a sync
+
+mw.reset() rebuilds the scheduler's queues and redraws whatever the main
+window is showing, which takes a while on a large collection. After a sync
+we know which notes and decks changed (see ankisync.SyncResult), so only
+what shows them needs updating:
+
+* the deck browser, if the card counts of any deck may have changed;
+* the overview, if the current deck (or one of its subdecks) changed;
+* the reviewer, if it is studying a deck that changed or showing a note
+  that changed -- only this needs a full reset, as its queue is stale;
+* open browsers and editors, which listen for state_did_reset, if any
+  notes changed.
+
+Nothing at all is done if the sync changed nothing.
+"""
+from typing import Any, Set
+
+from .ankisync import SyncResult
+
+
+def _active_decks(mw: Any) -> Set[int]:
+    "IDs of the decks the main window is showing: the current one and its subdecks."
+    return set(mw.col.decks.active())
+
+
+def _reset(mw: Any, defer: bool) -> None:
+    "Reset the main window, now or once the user is done (see refresh_after_sync())."
+    if defer:
+        mw.requireReset()
+    else:
+        mw.reset()
+
+
+def refresh_after_sync(mw: Any, result: SyncResult, defer: bool = False) -> None:
+    """
+    Update the parts of Anki's windows that show anything /result/ says
+    the sync changed.
+
+    :param defer: Instead of resetting the main window right away when it
+                  is needed, have Anki do so once the user is done with what
+                  they are doing (mw.requireReset()), as for a sync the user
+                  didn't start.
+    """
+    # pylint: disable=import-error, no-name-in-module
+    from aqt import gui_hooks
+
+    if not result.changed:
+        return
+
+    state = mw.state
+    if state == 'deckBrowser':
+        if result.deck_ids:
+            mw.deckBrowser.refresh()
+    elif state == 'overview':
+        if result.deck_ids & _active_decks(mw):
+            mw.overview.refresh()
+    elif state == 'review':
+        card = mw.reviewer.card
+        if (result.deck_ids & _active_decks(mw)
+                or (card is not None and card.nid in result.note_ids)):
+            _reset(mw, defer)
+            return
+    elif state != 'resetRequired':
+        _reset(mw, defer)
+        return
+
+    if result.note_ids:
+        gui_hooks.state_did_reset()
@@ -14,14 +14,19 @@ from typing import Any, Dict, List, Sequence, Tuple
 # pylint: disable=no-name-in-module
 import aqt
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QDialog, QComboBox, QApplication, QFileDialog, QAction
-from PyQt5.QtGui import QCursor, QDesktopServices
+from PyQt5.QtWidgets import (QDialog, QCheckBox, QComboBox, QApplication, QFileDialog,
+                             QAction, QSpinBox)
+from PyQt5.QtGui import QCursor, QDesktopServices, QIntValidator
 from PyQt5.QtCore import pyqtSignal, Qt, QUrl
 from aqt.utils import getFile, showWarning, showInfo, showCritical, askUser
 
 from . import settings_dialog
 from .util import nowin_startupinfo
 
+#: Wiki settings added after the first release, which wikis configured
+#: before then don't have yet.
+NEW_WIKI_KEYS = ('nodeFlags', 'nodeMemoryMB')
+
 
 class SettingsDialog(QDialog):
     """
@@ -51,6 +56,7 @@ class SettingsDialog(QDialog):
         self.form.wikiList.currentRowChanged.connect(self.wiki_changed)
         self.form.wikiName.textEdited.connect(self.wiki_name_changed)
         self.form.wikiName.editingFinished.connect(self.prevent_duplicate_name)
+        self.form.nodeMemoryMB_.setValidator(QIntValidator(0, 1 << 20, self))
 
         self.current_wiki_index = 0
         # Unfortunately you cannot specify a list with elements of fixed type, like
@@ -82,10 +88,17 @@ class SettingsDialog(QDialog):
 
         for name, value in self.conf.items():
             control = getattr(self.form, name + '_', None)
-            if control is not None:
+            if isinstance(control, QCheckBox):
+                control.setChecked(bool(value))
+            elif isinstance(control, QSpinBox):
+                control.setValue(int(value))
+            elif control is not None:
                 control.setText(value)
                 control.setCursorPosition(0)
         self.deckChooser.setDeckName(self.conf['defaultDeck'])
+        for wiki_conf in self.conf['wikis'].values():
+            for key in NEW_WIKI_KEYS:
+                wiki_conf.setdefault(key, '')
         self.wikis = [[name, config] for name, config in self.conf['wikis'].items()]
         self._populate_wiki_list()
 
@@ -93,7 +106,11 @@ class SettingsDialog(QDialog):
         "Dump the values in the dialog to the add-on's config as stored by Anki."
         for name in list(self.conf.keys()):
             control = getattr(self.form, name + '_', None)
-            if control is not None:
+            if isinstance(control, QCheckBox):
+                self.conf[name] = control.isChecked()
+            elif isinstance(control, QSpinBox):
+                self.conf[name] = control.value()
+            elif control is not None:
                 self.conf[name] = control.text()
         self.conf['defaultDeck'] = self.deckChooser.deckName()
 
@@ -0,0 +1,347 @@
+"""
+staticnotes.py - read notes straight from the files of a wiki
+
+Most notes are written as plain <<rememberq>> or <<remembercz>> calls whose
+arguments are ordinary text, in tiddlers that do nothing else TiddlyWiki
+would have to work out. Rendering such a tiddler only copies the arguments
+into the template, so the notes in it can be read from its .tid file, or
+from the tiddler store of a single-file wiki (see wikifile.py), without
+starting TiddlyWiki at all.
+
+scan_wiki() does this for every tiddler it can, and returns the titles of
+the rest -- tiddlers that transclude, use widgets, variables, or other
+macros, or whose note arguments contain wikitext markup -- so that only
+those need rendering. The result must be exactly what rendering would
+have given, so anything we aren't sure about is left to TiddlyWiki, and
+a whole wiki is left to it (NotStatic is raised) when we can't tell which
+tiddlers match its content filter or what they contain:
+
+* the content filter must be DEFAULT_CONTENT_FILTER;
+* every tiddler file must be one we know how to read.
+
+The deck and tag mappings are lists of filters, which only TiddlyWiki can
+evaluate. The notes are read without them; if a wiki has any, the scan
+says so, and twimport renders just the mappings to apply them.
+
+twimport.check_static() renders the whole wiki as well and reports any
+differences between the two, to check that this holds for a given wiki.
+"""
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .clozeparse import ankify_clozes
+from . import tiddlers
+from .twnote import ClozeNote, QuestionNote, TwNote
+from .util import check_cancelled, Twid
+from . import wikifile
+
+#: The only content filter whose meaning we know without TiddlyWiki: wikitext
+#: tiddlers that aren't system tiddlers.
+DEFAULT_CONTENT_FILTER = "[type[text/vnd.tiddlywiki]] [type[]] +[!is[system]]"
+WIKITEXT_TYPES = ('text/vnd.tiddlywiki', '')
+MAPPING_TIDDLERS = ('$:/config/TiddlyRemember/DeckMapping',
+                    '$:/config/TiddlyRemember/TagMapping')
+
+PLUGIN_PREFIX = '$:/plugins/sobjornstad/TiddlyRemember/'
+
+#: Files in a tiddlers folder that TiddlyWiki loads as tiddlers of types
+#: other than wikitext when they don't have a .meta file.
+NON_WIKITEXT_EXTENSIONS = frozenset((
+    '.txt', '.css', '.js', '.md', '.svg', '.png', '.jpg', '.jpeg', '.gif',
+    '.ico', '.webp', '.pdf', '.woff', '.woff2', '.mp3', '.mp4', '.ogg'))
+#: Files describing tiddlers stored elsewhere, which we don't follow.
+SPECIFICATION_FILES = ('tiddlywiki.files',)
+
+#: Parameters of the TiddlyRemember macros, in order.
+MACRO_PARAMS = {
+    'rememberq': ('id', 'question', 'answer', 'reference'),
+    'remembercz': ('id', 'text', 'mode', 'reference'),
+}
+
+# These follow TiddlyWiki's own macro call and parameter rules.
+_MACRO_CALL_RE = re.compile(r'<<([^>\s]+)\s*((?:[^>]|>(?!>))*?)>>')
+_REDEFINE_RE = re.compile(r'^\s*\\define\s+remember', re.MULTILINE)
+_MACRO_PARAM_RE = re.compile(
+    r'''\s*(?:([A-Za-z0-9\-_]+)\s*:)?'''
+    r'''(?:\s*(?:"""([\s\S]*?)"""|"([^"]*)"|'([^']*)'|\[\[([^\]]*)\]\]|([^"'\s]+)))''')
+
+#: Anything in the rest of a tiddler that could render notes or change
+#: how the macros render: transclusions, other macros, widgets, pragmas
+#: like \define, code or comments that would hide a macro call, and HTML
+#: written to look like a rendered note or mapping.
+_DYNAMIC_RE = re.compile(r'{{|<<|<\$|^\s*\\|<!--|```|<(?:pre|code|script|style|textarea)\b'
+                         r'|remember(?:q|cz)|anki-(?:decks|tags)',
+                         re.MULTILINE | re.IGNORECASE)
+
+#: Characters and sequences that make an argument more than plain text once
+#: it is substituted into the macro: links, transclusions, HTML, entities,
+#: variables, formatting, dashes (which TiddlyWiki typesets), and quotes,
+#: which would end the attributes some arguments are copied into.
+_MARKUP_RE = re.compile(r"""[\[\]<>$&\\`~"\r\n]|''|//|__|\^\^|,,|--|@@|{{|}}""")
+#: What an argument starts with that TiddlyWiki may take for block wikitext:
+#: a heading, list, definition, blockquote or table.
+_BLOCK_START_RE = re.compile(r'\s*[!*#;:>|]')
+
+
+class NotStatic(Exception):
+    "A wiki whose notes can't be read without rendering it."
+
+
+class StaticScan(NamedTuple):
+    "The result of scan_wiki()."
+    #: The notes read without rendering, with the titles of their tiddlers.
+    notes: List[Tuple[str, Set[TwNote]]]
+    #: Tiddlers that may contain notes but must be rendered to find them.
+    dynamic: List[str]
+    #: Whether the wiki has deck or tag mappings, which have yet to be
+    #: applied to /notes/.
+    mapped: bool
+
+
+def parse_macro_params(params: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Split the parameters of a macro call into (name, value) pairs, with a
+    name of None for positional parameters.
+
+    >>> parse_macro_params('''"1" 'q a' [[b]] reference:R''')
+    [(None, '1'), (None, 'q a'), (None, 'b'), ('reference', 'R')]
+    """
+    result: List[Tuple[Optional[str], str]] = []
+    for match in _MACRO_PARAM_RE.finditer(params):
+        name, *values = match.groups()
+        result.append((name, next(v for v in values if v is not None)))
+    return result
+
+
+def bind_params(macro: str, args: List[Tuple[Optional[str], str]]) -> Dict[str, str]:
+    """
+    Assign arguments to the parameters of a TiddlyRemember macro the way
+    TiddlyWiki does: by name if one is named after it, otherwise the next
+    positional argument, otherwise an empty string.
+
+    >>> bind_params('rememberq', [(None, '1'), ('answer', 'A'), (None, 'Q')])
+    {'id': '1', 'question': 'Q', 'answer': 'A', 'reference': ''}
+    """
+    positional = iter(value for name, value in args if name is None)
+    bound: Dict[str, str] = {}
+    for param in MACRO_PARAMS[macro]:
+        named = [value for name, value in args if name == param]
+        bound[param] = named[-1] if named else next(positional, '')
+    return bound
+
+
+def _is_plain(value: str) -> bool:
+    """
+    Return True if /value/ renders as exactly its own text once substituted
+    into a TiddlyRemember macro.
+
+    >>> _is_plain("What's 2 + 2?"), _is_plain("The ''bold'' one"), _is_plain('A [[link]]')
+    (True, False, False)
+    >>> _is_plain('{c1::Paris} is in {France}'), _is_plain('{{Paris}}')
+    (True, False)
+    >>> [_is_plain(v) for v in ('! Heading', ' * item', '# one', '; term', ': def',
+    ...                          '> quote', '|a|b|', '---', 'A: B | C')]
+    [False, False, False, False, False, False, False, False, True]
+    """
+    return not (_MARKUP_RE.search(value) or _BLOCK_START_RE.match(value))
+
+
+def notes_from_text(text: str, wiki_name: str,
+                    tiddler_name: str) -> Optional[Set[TwNote]]:
+    """
+    Return the notes a tiddler with wikitext /text/ would render to, or
+    None if it can't be known without rendering it. Deck and tags are
+    those of a wiki with empty mappings.
+
+    >>> notes = notes_from_text('Intro.\\n\\n<<rememberq "1" "Q?" "A.">>', 'w', 'T')
+    >>> [(n.id_, n.tidref, n.question, n.answer) for n in notes]
+    [('1', 'T', 'Q?', 'A.')]
+    >>> [n.text for n in notes_from_text('<<remembercz "2" "{Paris}" reference:R>>', 'w', 'T')]
+    ['{{c1::Paris}}']
+    >>> notes_from_text('<<rememberq "3" "Q?" "An //italic// answer">>', 'w', 'T') is None
+    True
+    >>> notes_from_text('{{Other}} <<rememberq "4" "Q?" "A.">>', 'w', 'T') is None
+    True
+
+    An argument starting like block wikitext can render as more than its
+    text -- here, a list -- so such notes are left for TiddlyWiki:
+
+    >>> from bs4 import BeautifulSoup
+    >>> rendered = BeautifulSoup(
+    ...     '<div class="rememberq"><div class="rquestion"><p>Q?</p></div>'
+    ...     '<div class="ranswer"><p><ul><li>one</li></ul></p></div>'
+    ...     '<div class="rid">[5]</div><div class="tr-reference"></div></div>',
+    ...     'html.parser')
+    >>> [n.answer for n in QuestionNote.parse_html(rendered, 'w', 'T')]
+    ['one']
+    >>> notes_from_text('<<rememberq "5" "Q?" "* one">>', 'w', 'T') is None
+    True
+    """
+    notes: Set[TwNote] = set()
+    rest: List[str] = []
+    position = 0
+    for match in _MACRO_CALL_RE.finditer(text):
+        macro, params = match.groups()
+        if macro not in MACRO_PARAMS:
+            return None
+        rest.append(text[position:match.start()])
+        position = match.end()
+
+        args = parse_macro_params(params)
+        bound = bind_params(macro, args)
+        if (not bound['id'] or bound['id'].strip() != bound['id']
+                or not all(_is_plain(bound[i]) for i in ('id', 'reference'))):
+            return None
+        id_ = Twid(bound['id'])
+        tidref = bound['reference'].strip() or tiddler_name
+        if macro == 'rememberq':
+            if not (_is_plain(bound['question']) and _is_plain(bound['answer'])):
+                return None
+            notes.add(QuestionNote(id_, wiki_name, tidref, bound['question'],
+                                   bound['answer'], set(), None))
+        else:
+            if not (_is_plain(bound['text']) and _is_plain(bound['mode'])):
+                return None
+            notes.add(ClozeNote(id_, wiki_name, tidref, ankify_clozes(bound['text']),
+                                set(), None))
+    rest.append(text[position:])
+    if _DYNAMIC_RE.search(''.join(rest)):
+        return None
+    return notes
+
+
+def _matches_default_filter(fields: Dict[str, str]) -> bool:
+    "Whether a tiddler with /fields/ matches DEFAULT_CONTENT_FILTER."
+    return (fields.get('type', '') in WIKITEXT_TYPES
+            and not fields.get('title', '').startswith('$:/'))
+
+
+def check_wiki_info(wiki_folder: str) -> None:
+    "Raise NotStatic if the wiki includes tiddlers from other wikis."
+    try:
+        with open(os.path.join(wiki_folder, 'tiddlywiki.info'), encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return
+    if info.get('includeWikis'):
+        raise NotStatic("it includes other wikis")
+
+
+def other_tiddler_fields(wiki_folder: str,
+                          tid_paths: Set[str]) -> Iterable[Dict[str, str]]:
+    """
+    Yield the fields of the tiddlers of a folder wiki stored in files
+    other than the .tid files /tid_paths/, raising NotStatic if there are
+    files we can't tell the contents of.
+    """
+    pending = [os.path.join(wiki_folder, tiddlers.TIDDLERS_FOLDER)]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        names = set(e.name for e in entries)
+        for entry in entries:
+            if entry.is_dir():
+                pending.append(entry.path)
+            elif entry.path in tid_paths or entry.name.startswith('.'):
+                continue
+            elif entry.name in SPECIFICATION_FILES:
+                raise NotStatic(f"it loads tiddlers listed in {entry.name}")
+            elif entry.name.endswith('.meta'):
+                yield tiddlers.read_tid(entry.path)[0]
+            elif entry.name + '.meta' in names:
+                continue
+            elif entry.name.endswith('.json'):
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    raise NotStatic(f"the tiddler file {entry.name} can't be read")
+                for tiddler in (data if isinstance(data, list) else [data]):
+                    if isinstance(tiddler, dict):
+                        yield {k: str(v) for k, v in tiddler.items()}
+            elif os.path.splitext(entry.name)[1].lower() not in NON_WIKITEXT_EXTENSIONS:
+                raise NotStatic(f"it has tiddlers in a format we can't read "
+                                f"({entry.name})")
+
+
+def wiki_tiddlers(wiki_path: str) -> Iterator[Tuple[Dict[str, str], Optional[str]]]:
+    """
+    Yield the fields and text of each tiddler of a folder wiki or a
+    single-file wiki, leaving out plugins, which TiddlyWiki keeps apart from
+    the other tiddlers. The text is None for tiddlers stored in files we
+    only read the fields of. Raise NotStatic if there are tiddlers we can't
+    tell the contents of.
+    """
+    if os.path.isdir(wiki_path):
+        check_wiki_info(wiki_path)
+        tid_paths: Set[str] = set()
+        for entry in tiddlers.tid_files(wiki_path):
+            tid_paths.add(entry.path)
+            yield tiddlers.read_tid(entry.path)
+        for fields in other_tiddler_fields(wiki_path, tid_paths):
+            yield fields, None
+    else:
+        try:
+            for fields, text in wikifile.read_tiddlers(wiki_path):
+                if not wikifile.is_plugin(fields):
+                    yield fields, text
+        except wikifile.StoreError:
+            raise NotStatic("its tiddlers can't be read from the file")
+
+
+def scan_wiki(wiki_path: str, wiki_name: str, filter_: str,
+              seen: Optional[Set[Twid]] = None,
+              cancel: Optional[threading.Event] = None) -> StaticScan:
+    """
+    Read the notes of a wiki -- a folder wiki, or the file of a single-file
+    wiki -- that can be read without rendering it, and list the tiddlers
+    that must be rendered for the rest. Raise NotStatic, saying why, if the
+    wiki has to be rendered in full. The notes have no decks or tags yet if
+    the scan is /mapped/.
+
+    :param seen: If given, notes with IDs in this set are skipped, and the
+                 IDs of the notes returned are added to it, as for
+                 :func:`twimport.iter_tiddler_notes`.
+    :param cancel: Optional event; once it is set, SyncCancelled is raised
+                   before the next tiddler is read.
+    """
+    if filter_.strip() != DEFAULT_CONTENT_FILTER:
+        raise NotStatic("it uses a custom content filter")
+
+    contents: List[Tuple[str, str]] = []
+    dynamic: List[str] = []
+    mapped = False
+    for fields, text in wiki_tiddlers(wiki_path):
+        check_cancelled(cancel)
+        title = fields.get('title', '')
+        if text is None:
+            # A mapping tiddler whose text we can't read may still map notes.
+            mapped = mapped or title in MAPPING_TIDDLERS
+            if title and _matches_default_filter(fields):
+                dynamic.append(title)
+            continue
+        if title in MAPPING_TIDDLERS and text.strip():
+            mapped = True
+        if title.startswith(PLUGIN_PREFIX) or (
+                '$:/tags/Macro' in fields.get('tags', '') and _REDEFINE_RE.search(text)):
+            raise NotStatic("it changes the TiddlyRemember macros")
+        if title and _matches_default_filter(fields):
+            contents.append((title, text))
+
+    notes: List[Tuple[str, Set[TwNote]]] = []
+    for title, text in contents:
+        check_cancelled(cancel)
+        found = notes_from_text(text, wiki_name, title)
+        if found is None:
+            dynamic.append(title)
+            continue
+        if seen is not None:
+            found = set(n for n in found if n.id_ not in seen)
+            seen.update(n.id_ for n in found)
+        notes.append((title, found))
+    return StaticScan(notes, dynamic, mapped)
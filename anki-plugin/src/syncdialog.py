@@ -0,0 +1,379 @@
+"""
+syncdialog.py - the dialog and background threads that run a sync from inside Anki
+"""
+import json
+import threading
+from typing import Any, Dict, Optional
+
+# pylint: disable=import-error, no-name-in-module
+import aqt
+from aqt.utils import showWarning, tooltip
+from PyQt5.QtWidgets import QDialog
+from PyQt5.QtCore import pyqtSignal, QThread
+
+from . import ankisync
+from . import fingerprint
+from . import import_dialog
+from .media import MediaImporter
+from .refresh import refresh_after_sync
+from .timing import SyncProfiler, SyncTrace
+from . import twimport
+from .twnote import TwNote
+from .util import Twid, user_files_path
+
+#: Files in user_files describing the most recent sync.
+TRACE_FILENAME = 'last-sync-trace.json'
+PROFILE_FILENAME = 'last-sync.prof'
+#: File in user_files counting, for each wiki, the syncs since it was last
+#: rendered in full; see ImportDialog.use_candidates().
+FULL_RENDER_FILENAME = 'syncs-since-full-render.json'
+
+
+class ImportThread(QThread):
+    """
+    Background thread to export the wiki and parse questions out of it.
+    """
+    progress_update = pyqtSignal(int, int)
+
+    def __init__(self, conf: dict, wiki_name: str, wiki_conf: Dict[str, str],
+                 notes: Dict[Twid, TwNote], trace: SyncTrace,
+                 profiler: SyncProfiler, candidates: bool = False,
+                 cancel: Optional[threading.Event] = None,
+                 media: Optional[MediaImporter] = None) -> None:
+        super().__init__()
+        self.conf = conf
+        self.wiki_name = wiki_name
+        self.wiki_conf = wiki_conf
+        self.notes = notes
+        self.trace = trace
+        self.profiler = profiler
+        self.candidates = candidates
+        self.cancel = cancel
+        self.media = media
+        self.found_count = 0
+        self.exception: Optional[Exception] = None
+
+    def run(self) -> None:
+        """
+        Add the notes found in the wiki to the shared /notes/ dictionary as
+        they are extracted. Notes with an ID already used in a previous wiki
+        are discarded.
+
+        If /cancel/ is set, extraction stops early with a SyncCancelled
+        exception, leaving the notes incomplete.
+        """
+        wiki_url = self.wiki_conf.get('permalink', '')
+        try:
+            with self.profiler.profile():
+                for n in twimport.iter_notes(
+                        tw_binary=self.conf['tiddlywikiBinary'],
+                        wiki_path=self.wiki_conf['path'],
+                        wiki_type=self.wiki_conf['type'],
+                        wiki_name=self.wiki_name,
+                        filter_=self.wiki_conf['contentFilter'],
+                        callback=self.progress_update.emit,
+                        trace=self.trace,
+                        read_static=self.conf.get('readStaticNotes', False),
+                        records=self.conf.get('renderRecords', False),
+                        bundle=self.conf.get('renderBundle', False),
+                        candidates=self.candidates,
+                        cancel=self.cancel,
+                        node=twimport.NodeOptions.from_conf(self.wiki_conf)):
+                    self.found_count += 1
+                    if wiki_url:
+                        n.set_permalink(wiki_url)
+                    if self.media is not None and n.id_ not in self.notes:
+                        self.media.import_images(n, self.wiki_conf)
+                    self.notes.setdefault(n.id_, n)
+        except Exception as e:
+            self.exception = e
+
+
+class FingerprintThread(QThread):
+    """
+    Background thread to take the fingerprint of the wikis, which means
+    asking the server of each URL wiki about it; see fingerprint.py.
+    """
+    def __init__(self, conf: dict, trace: SyncTrace) -> None:
+        super().__init__()
+        self.conf = conf
+        self.trace = trace
+        self.result: Optional[Dict[str, Any]] = None
+        self.exception: Optional[Exception] = None
+
+    def run(self) -> None:
+        try:
+            with self.trace.stage("fingerprint"):
+                self.result = fingerprint.source_fingerprint(self.conf)
+        except Exception as e:
+            self.exception = e
+
+
+class ImportDialog(QDialog):
+    """
+    Dialog implementing the import from TiddlyWiki.
+
+    If /wiki/ is given, only that wiki is extracted, and only its notes are
+    synced (see ankisync.sync()); the notes of the other wikis are left as
+    they are.
+    """
+    def __init__(self, mw, wiki: Optional[str] = None) -> None:
+        QDialog.__init__(self)
+        self.form = import_dialog.Ui_Dialog()
+        self.form.setupUi(self)
+        self.conf = mw.addonManager.getConfig(__name__)
+        self.mw = mw
+
+        self.fingerprint_thread: Optional[FingerprintThread] = None
+        self.extract_thread: Optional[ImportThread] = None
+        #: Set to stop the extract thread; see reject().
+        self.cancel = threading.Event()
+        self.form.cancelButton.clicked.connect(self.reject)
+        self.notes: Dict[Twid, TwNote] = {}
+        self.trace = SyncTrace()
+        self.trace.reset_peak_memory()
+        self.profiler = SyncProfiler(self.conf['profileSync'])
+        #: Copies the images in the notes to the collection; see media.py.
+        self.media = MediaImporter(mw.col.media.dir())
+        # Unless sync() committed them, the images must not reach the media
+        # folder, however the dialog closes.
+        self.finished.connect(self.media.discard)
+        self.wiki = wiki
+        if wiki is not None:
+            self.setWindowTitle(f"Sync {wiki} from TiddlyWiki")
+        self.wikis = [(k, v) for k, v in self.conf['wikis'].items()
+                      if wiki is None or k == wiki]
+        self.form.wikiProgressBar.setMaximum(len(self.wikis))
+        self.full_render_counts: Dict[str, int] = _load_full_render_counts()
+        #: Whether every wiki synced so far was rendered in full, so notes
+        #: that weren't found can be removed.
+        self.rendered_all = True
+        #: The wikis and configuration as they were when the sync started;
+        #: see fingerprint.py.
+        self.source_fingerprint: Optional[Dict[str, Any]] = None
+
+    def start_import(self) -> bool:
+        """
+        Check to make sure import is configured correctly and begin
+        extracting data. Return True if started asynchronously, False if
+        unable to start or if there is nothing to do (the wikis, the
+        configuration and the collection are as the last sync left them).
+        """
+        if not self.wikis:
+            showWarning(f"There is no wiki called '{self.wiki}' to sync with. "
+                        f"It may have been renamed or removed from the "
+                        f"TiddlyRemember configuration.")
+            return False
+
+        # Catch scenario where user tries to sync without configuring and provide
+        # a helpful error message.
+        if len(self.wikis) == 1 and not self.wikis[0][1]['path'].strip():
+            showWarning("You don't appear to have set up any wikis to sync with. "
+                        "To do so, choose Tools > Add-ons, select TiddlyRemember, "
+                        "and click the Config button.")
+            return False
+
+        # The fingerprint covers all the wikis, so a sync of one wiki can't
+        # use it.
+        if self.wiki is None and self.conf.get('skipUnchangedSyncs', False):
+            if fingerprint.needs_network(self.conf):
+                # Servers can be slow to answer, so ask them with the dialog
+                # up and the Cancel button working.
+                self.form.text.setText("Checking your wikis for changes...")
+                self.form.progressBar.setMaximum(0)
+                self.fingerprint_thread = FingerprintThread(self.conf, self.trace)
+                self.fingerprint_thread.finished.connect(self.fingerprint_done)
+                self.fingerprint_thread.start()
+                return True
+            with self.trace.stage("fingerprint"):
+                self.source_fingerprint = fingerprint.source_fingerprint(self.conf)
+            if self.unchanged():
+                return False
+
+        self.extract()
+        return True
+
+    def unchanged(self) -> bool:
+        """
+        Return whether the fingerprint taken shows there is nothing to do,
+        telling the user so if it does.
+        """
+        if (self.source_fingerprint is None
+                or not fingerprint.unchanged(self.source_fingerprint, self.mw)):
+            return False
+        tooltip("Nothing to do: your wikis haven't changed since the last sync.")
+        return True
+
+    def fingerprint_done(self) -> None:
+        "Sync, or close the dialog if there is nothing to do, once the fingerprint is taken."
+        assert self.fingerprint_thread is not None, "Fingerprint finished without a thread!"
+        if self.cancel.is_set():
+            self.reject()
+            tooltip("Sync cancelled. Your collection has not been changed.")
+            return
+        if self.fingerprint_thread.exception:
+            self.reject()
+            raise self.fingerprint_thread.exception
+        self.source_fingerprint = self.fingerprint_thread.result
+        if self.unchanged():
+            self.reject()
+            return
+        self.extract()
+
+    def extract_progress(self, at: int, end: int) -> None:
+        "Progress callback function for export/parse triggered by progress signal."
+        self.form.progressBar.setMaximum(100)
+        self.form.text.setText(f"Extracting notes from tiddlers...{at}/{end}")
+        if end == 0:
+            # Obviously this will be done *real* soon...but don't want an exception!
+            self.form.progressBar.setValue(100)
+        else:
+            self.form.progressBar.setValue(at * 100 / end)
+
+    def extract(self) -> None:
+        """
+        Extract questions from a TiddlyWiki using Node. When done, proceed to
+        sync with Anki.
+        """
+        wiki_name, wiki_conf = self.wikis.pop()
+
+        self.form.text.setText(f"Exporting tiddlers from {wiki_name}...")
+        self.form.progressBar.setMaximum(0)
+
+        self.extract_thread = ImportThread(self.conf, wiki_name, wiki_conf,
+                                           self.notes, self.trace, self.profiler,
+                                           self.use_candidates(wiki_name), self.cancel,
+                                           self.media)
+        self.extract_thread.finished.connect(self.join_thread)
+        self.extract_thread.progress_update.connect(self.extract_progress)
+        self.extract_thread.start()
+
+    def use_candidates(self, wiki_name: str) -> bool:
+        """
+        Return whether to render only the tiddlers of a wiki that could
+        contain notes ('candidateFilter' option) in this sync. Every
+        'fullRenderEvery'th sync renders them all instead, to catch notes
+        made in ways the filter can't follow.
+        """
+        if not self.conf.get('candidateFilter', False):
+            return False
+        every = self.conf.get('fullRenderEvery', 10)
+        count = self.full_render_counts.get(wiki_name, 0)
+        full = every > 0 and count + 1 >= every
+        self.full_render_counts[wiki_name] = 0 if full else count + 1
+        self.rendered_all = self.rendered_all and full
+        return not full
+
+    def reject(self) -> None:
+        """
+        Cancel the sync, whether by the Cancel button, Escape, or closing the
+        dialog. While notes are being extracted, the extract thread is told
+        to stop, and the dialog closes once it has (see join_thread()); while
+        the fingerprint is being taken, once it has been.
+        Nothing is changed in the collection until every wiki has been
+        extracted, and sync() makes all the changes at once, so a cancelled
+        sync changes nothing.
+        """
+        if any(t is not None and not t.isFinished()
+               for t in (self.fingerprint_thread, self.extract_thread)):
+            self.cancel.set()
+            self.form.cancelButton.setEnabled(False)
+            self.form.text.setText("Cancelling...")
+            return
+        super().reject()
+
+    def join_thread(self) -> None:
+        """
+        Gather up the results of a completed extract thread, and start the next one
+        if appropriate.
+        """
+        assert self.extract_thread is not None, "Tried to join a nonexistent thread!"
+        if self.cancel.is_set():
+            self.reject()
+            tooltip("Sync cancelled. Your collection has not been changed.")
+            return
+        if self.extract_thread.exception:
+            self.reject()
+            raise self.extract_thread.exception
+
+        if not self.extract_thread.found_count:
+            # This is probably a mistake or misconfiguration. To avoid deleting
+            # all the user's existing notes to "sync" the collection, abort now.
+            showWarning(
+                f"No notes were found in the wiki {self.extract_thread.wiki_name}. "
+                f"Please check your add-on configuration. "
+                f"Your collection has not been updated.")
+            self.reject()
+            return
+
+        self.form.wikiProgressBar.setValue(self.form.wikiProgressBar.value() + 1)
+        if self.wikis:
+            # If there are any more wikis, handle the next one.
+            # Eventually, parallelizing this might be nice
+            # (might also not improve performance).
+            return self.extract()
+        else:
+            # When all are completed, start the sync with Anki.
+            return self.sync()
+
+    def sync(self) -> None:
+        """
+        Compare the notes gathered by the various wiki threads with the notes
+        currently in our Anki collection and add, edit, and remove notes as needed
+        to get Anki in sync with the TiddlyWiki notes.
+        """
+        # The changes are applied in one go, so there is no stopping halfway.
+        self.form.cancelButton.setEnabled(False)
+        self.form.progressBar.setMaximum(0)
+        self.form.text.setText(f"Applying note changes to your collection...")
+        with self.profiler.profile():
+            result = ankisync.sync(self.notes.values(), self.mw, self.conf, self.trace,
+                                   remove=self.rendered_all, wiki=self.wiki)
+            self.media.commit()
+            if self.conf.get('candidateFilter', False):
+                _save_full_render_counts(self.full_render_counts)
+            if self.source_fingerprint is not None and not result.removals_deferred:
+                fingerprint.save(self.source_fingerprint, self.mw)
+            elif self.wiki is None:
+                # Notes left behind must still be removed by a later sync.
+                fingerprint.forget()
+
+            self.accept()
+            with self.trace.stage("refresh main window"):
+                refresh_after_sync(self.mw, result)
+
+        tooltip(result.log() + "\n" + self.save_trace())
+
+    def save_trace(self) -> str:
+        """
+        Finish timing the sync, write the trace (and profile, if enabled) to the
+        add-on's user_files folder, and return a summary for the user.
+        """
+        self.trace.finish()
+        summary = self.trace.summary()
+        self.trace.write(user_files_path(TRACE_FILENAME))
+        if self.profiler.dump(user_files_path(PROFILE_FILENAME)):
+            summary += f"\nProfile saved to {PROFILE_FILENAME}."
+        return summary
+
+
+def _load_full_render_counts() -> Dict[str, int]:
+    "Read the counts of syncs since each wiki was rendered in full."
+    try:
+        with open(user_files_path(FULL_RENDER_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_full_render_counts(counts: Dict[str, int]) -> None:
+    "Write the counts of syncs since each wiki was rendered in full."
+    with open(user_files_path(FULL_RENDER_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(counts, f)
+
+
+def open_dialog(wiki: Optional[str] = None) -> None:
+    "Launch the sync dialog, to sync all wikis or only the one called /wiki/."
+    dialog = ImportDialog(aqt.mw, wiki)
+    if dialog.start_import():
+        dialog.exec_()
@@ -0,0 +1,228 @@
+"""
+tiddlers.py - read tiddlers straight from the files of a folder wiki
+
+A folder wiki keeps each tiddler in a file under its tiddlers/ folder,
+usually a .tid file: lines of 'field: value', a blank line, and the text.
+Reading these files ourselves is far cheaper than starting TiddlyWiki, so
+it is used to work out which tiddlers have changed before rendering any.
+
+TiddlyWiki also loads tiddlers from other files, which are read too:
+
+* a file with a .meta file beside it: the fields are in the .meta file
+  and the text is the file itself (images and other binary files, but
+  also text of types other than wikitext);
+* a .json file, holding one tiddler or a list of them;
+* a .multids file: lines of 'field: value' shared by all its tiddlers, a
+  blank line, and then a line of 'title: text' for each tiddler, the title
+  being added to the one in the shared fields;
+* any other file, as a tiddler titled with the file's name.
+
+Files listed in a tiddlywiki.files file are loaded from wherever it says,
+and are not followed.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .util import check_cancelled
+
+#: The subfolder of a folder wiki holding its tiddlers.
+TIDDLERS_FOLDER = 'tiddlers'
+TID_EXTENSION = '.tid'
+
+META_EXTENSION = '.meta'
+#: Files in the tiddlers folder that aren't tiddlers themselves.
+SPECIFICATION_FILES = ('tiddlywiki.files',)
+
+#: Cache for tiddler_digests(): path -> (the modification time and size of
+#: each file read, the titles of the tiddlers in them, digest).
+DigestCache = Dict[str, Tuple[Tuple[Tuple[int, int], ...], Tuple[str, ...], str]]
+#: The fields and text of a tiddler; the text is None if it isn't text.
+Tiddler = Tuple[Dict[str, str], Optional[str]]
+
+
+def parse_tid(text: str) -> Tuple[Dict[str, str], str]:
+    """
+    Split the contents of a .tid file into its fields and its text.
+
+    >>> parse_tid("title: Hello\\ntags: [[A B]] C\\n\\nSome text:\\n\\nmore")
+    ({'title': 'Hello', 'tags': '[[A B]] C'}, 'Some text:\\n\\nmore')
+    >>> parse_tid("title: Empty")
+    ({'title': 'Empty'}, '')
+    """
+    header, _, body = text.replace('\r\n', '\n').partition('\n\n')
+    fields: Dict[str, str] = {}
+    for line in header.split('\n'):
+        name, sep, value = line.partition(':')
+        if sep:
+            fields[name.strip()] = value.strip()
+    return fields, body
+
+
+def read_tid(path: str) -> Tuple[Dict[str, str], str]:
+    "Read a .tid file and return its fields and text, as for parse_tid()."
+    with open(path, encoding='utf-8') as f:
+        return parse_tid(f.read())
+
+
+def tid_files(wiki_folder: str) -> Iterator[os.DirEntry]:
+    "Yield a DirEntry for each .tid file in a folder wiki, in any order."
+    for entry, _ in tiddler_files(wiki_folder):
+        if entry.name.endswith(TID_EXTENSION):
+            yield entry
+
+
+def tiddler_files(wiki_folder: str) -> Iterator[Tuple[os.DirEntry, Optional[str]]]:
+    """
+    Yield a DirEntry for each file in a folder wiki that TiddlyWiki loads
+    tiddlers from, in any order, with the path of the file holding the text
+    of the tiddler if it is a .meta file, and None otherwise.
+    """
+    pending = [os.path.join(wiki_folder, TIDDLERS_FOLDER)]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        names = set(e.name for e in entries)
+        for entry in entries:
+            if entry.is_dir():
+                pending.append(entry.path)
+            elif entry.name.startswith('.') or entry.name in SPECIFICATION_FILES:
+                continue
+            elif entry.name.endswith(META_EXTENSION):
+                content = entry.path[:-len(META_EXTENSION)]
+                yield entry, content if os.path.exists(content) else None
+            elif entry.name + META_EXTENSION not in names:
+                yield entry, None
+
+
+def _parse_multids(text: str) -> List[Tiddler]:
+    """
+    Split the contents of a .multids file into its tiddlers.
+
+    >>> _parse_multids("title: $:/lang/\\ntype: text/plain\\n\\nA: One\\nB: Two: 2\\n")
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [({'title': '$:/lang/A', 'type': 'text/plain'}, 'One'),
+     ({'title': '$:/lang/B', 'type': 'text/plain'}, 'Two: 2')]
+    """
+    fields, body = parse_tid(text)
+    prefix = fields.get('title', '')
+    result: List[Tiddler] = []
+    for line in body.split('\n'):
+        title, sep, value = line.partition(':')
+        if sep and title.strip():
+            result.append(({**fields, 'title': prefix + title.strip()}, value.strip()))
+    return result
+
+
+def parse_tiddler_file(name: str, contents: bytes,
+                       meta_contents: Optional[bytes] = None) -> List[Tiddler]:
+    """
+    Return the tiddlers in a file called /name/, holding /contents/, as
+    TiddlyWiki loads them. For a file with a .meta file beside it, pass
+    the contents of the .meta file as /meta_contents/.
+
+    >>> parse_tiddler_file('a.json', b'[{"title": "A", "text": "{{B}}"}, {"title": "C"}]')
+    [({'title': 'A'}, '{{B}}'), ({'title': 'C'}, '')]
+    >>> parse_tiddler_file('b.png', b'\\x89PNG', b'title: B\\ntype: image/png')
+    [({'title': 'B', 'type': 'image/png'}, None)]
+    """
+    def text() -> str:
+        return contents.decode('utf-8', 'replace')
+
+    if meta_contents is not None:
+        fields = parse_tid(meta_contents.decode('utf-8', 'replace'))[0]
+        type_ = fields.get('type', '')
+        return [(fields, text() if not type_ or type_.startswith('text/') else None)]
+    elif name.endswith(TID_EXTENSION):
+        return [parse_tid(text())]
+    elif name.endswith('.json'):
+        try:
+            data = json.loads(text())
+        except ValueError:
+            return []
+        result: List[Tiddler] = []
+        for tiddler in (data if isinstance(data, list) else [data]):
+            if isinstance(tiddler, dict):
+                fields = {k: str(v) for k, v in tiddler.items()}
+                result.append((fields, fields.pop('text', '')))
+        return result
+    elif name.endswith('.multids'):
+        return _parse_multids(text())
+    return [({'title': name}, None)]
+
+
+def read_tiddler_file(path: str) -> List[Tiddler]:
+    """
+    Read a file yielded by tiddler_files() -- for a tiddler with a .meta
+    file, the .meta file -- and return its tiddlers, as for
+    parse_tiddler_file().
+    """
+    if path.endswith(META_EXTENSION):
+        with open(path, 'rb') as f:
+            meta_contents = f.read()
+        with open(path[:-len(META_EXTENSION)], 'rb') as f:
+            return parse_tiddler_file(os.path.basename(path), f.read(), meta_contents)
+    with open(path, 'rb') as f:
+        return parse_tiddler_file(os.path.basename(path), f.read())
+
+
+def tiddler_text(path: str, title: str) -> str:
+    """
+    Return the text of the tiddler /title/ in a file read by
+    read_tiddler_file(), or an empty string if it isn't text.
+    """
+    for fields, text in read_tiddler_file(path):
+        if fields.get('title') == title:
+            return text or ''
+    return ''
+
+
+def tiddler_digests(wiki_folder: str, cache: Optional[DigestCache] = None,
+                    cancel: Optional[threading.Event] = None) -> Dict[str, str]:
+    """
+    Return a digest of the file (or files) holding each tiddler in a folder
+    wiki, keyed by title. Comparing the results of two calls tells which
+    tiddlers were added, changed, or removed in between; a change to a file
+    holding several tiddlers counts as a change to all of them.
+
+    If a /cache/ is passed, files whose modification time and size are
+    unchanged since the last call with the same cache are not read again.
+    SyncCancelled is raised once /cancel/ is set.
+    """
+    cache = cache if cache is not None else {}
+    digests: Dict[str, str] = {}
+    seen = set()
+    for entry, content_path in tiddler_files(wiki_folder):
+        check_cancelled(cancel)
+        paths = [entry.path] + ([content_path] if content_path is not None else [])
+        try:
+            stats = tuple((st.st_mtime_ns, st.st_size) for st in map(os.stat, paths))
+        except OSError:
+            continue
+        seen.add(entry.path)
+        cached = cache.get(entry.path)
+        if cached is not None and cached[0] == stats:
+            titles, digest = cached[1:]
+        else:
+            sha = hashlib.sha1()
+            contents = []
+            for path in paths:
+                with open(path, 'rb') as f:
+                    contents.append(f.read())
+                sha.update(contents[-1])
+            # For a .meta file, the file it describes holds the text.
+            found = (parse_tiddler_file(entry.name, contents[-1], contents[0])
+                     if content_path is not None
+                     else parse_tiddler_file(entry.name, contents[0]))
+            titles = tuple(t for t in (f.get('title', '') for f, _ in found) if t)
+            digest = sha.hexdigest()
+            cache[entry.path] = (stats, titles, digest)
+        for title in titles:
+            digests[title] = digest
+    for path in set(cache) - seen:
+        del cache[path]
+    return digests
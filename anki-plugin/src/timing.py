@@ -0,0 +1,190 @@
+"""
+timing.py - measure where the time goes during a sync
+
+A SyncTrace is created for each sync and handed down through twimport,
+twnote and ankisync, each of which wraps its stages (download, render,
+parse, note loading, writes...) in SyncTrace.stage(). The result can be
+summarized for the user or written out as JSON for closer inspection.
+
+A SyncProfiler optionally collects a cProfile dump of the same work; see the
+'profileSync' configuration option.
+"""
+from contextlib import contextmanager
+import cProfile
+import json
+import pstats
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .util import peak_rss, reset_peak_rss
+
+
+class StageTiming:
+    """
+    Accumulated duration and item count of one stage of a sync, for one
+    wiki (or for the sync as a whole, if /wiki/ is None).
+
+    A stage that is entered many times, such as parsing each tiddler,
+    keeps a single StageTiming whose values are summed.
+    """
+    def __init__(self, stage: str, wiki: Optional[str]) -> None:
+        self.stage = stage
+        self.wiki = wiki
+        self.seconds = 0.0
+        self.count = 0
+        self.calls = 0
+
+    def __repr__(self):
+        return (f"StageTiming(stage={self.stage!r}, wiki={self.wiki!r}, "
+                f"seconds={self.seconds!r}, count={self.count!r})")
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return a JSON-serializable representation of this timing."
+        return {'stage': self.stage, 'wiki': self.wiki, 'seconds': self.seconds,
+                'count': self.count, 'calls': self.calls}
+
+
+class SyncTrace:
+    """
+    Per-stage timings for one sync.
+
+    Stages are recorded in the order they are first entered. Each
+    piece of code should only record the time it spends itself, so that
+    the stages of a wiki add up to (roughly) the time the wiki took.
+    """
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self._stages: Dict[Tuple[Optional[str], str], StageTiming] = {}
+        #: The external commands run, such as TiddlyWiki; see record_process().
+        self.processes: List[Dict[str, Any]] = []
+        self.extra: Dict[str, Any] = {}
+
+    @property
+    def stages(self) -> List[StageTiming]:
+        "All stages recorded so far, in the order first entered."
+        return list(self._stages.values())
+
+    def timing(self, stage: str, wiki: Optional[str] = None) -> StageTiming:
+        "Return the (possibly new) StageTiming for a stage."
+        key = (wiki, stage)
+        if key not in self._stages:
+            self._stages[key] = StageTiming(stage, wiki)
+        return self._stages[key]
+
+    @contextmanager
+    def stage(self, stage: str, wiki: Optional[str] = None) -> Iterator[StageTiming]:
+        """
+        Context manager timing the enclosed block as /stage/. The caller
+        may set or increment the yielded StageTiming's /count/ to record
+        how many items the stage handled.
+        """
+        timing = self.timing(stage, wiki)
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds += time.perf_counter() - start
+            timing.calls += 1
+
+    def record_process(self, description: str, wiki: Optional[str], seconds: float,
+                       peak_rss_bytes: Optional[int], **details: Any) -> None:
+        """
+        Record a run of an external command, with its wall time and peak
+        memory (None if the platform can't tell), and any /details/ worth
+        keeping, such as the memory it was allowed.
+        """
+        self.processes.append({'description': description, 'wiki': wiki,
+                               'seconds': seconds, 'peak_rss_bytes': peak_rss_bytes,
+                               **details})
+
+    def reset_peak_memory(self) -> None:
+        """
+        Measure peak memory usage from now on, rather than over the lifetime
+        of the process, where the platform allows it.
+        """
+        self.extra['peak_rss_reset'] = reset_peak_rss()
+
+    def finish(self) -> None:
+        "Mark the sync as complete, fixing the total duration and peak memory."
+        self.finished = time.time()
+        self.extra['peak_rss_bytes'] = peak_rss()
+
+    @property
+    def total_seconds(self) -> float:
+        "Wall time from creation until finish() (or now, if not yet finished)."
+        return (self.finished or time.time()) - self.started
+
+    def summary(self, max_stages: int = 4) -> str:
+        """
+        One-line, human-readable summary of the sync duration and the
+        stages (summed across wikis) that took longest.
+        """
+        totals: Dict[str, float] = {}
+        for timing in self._stages.values():
+            totals[timing.stage] = totals.get(timing.stage, 0.0) + timing.seconds
+        slowest = sorted(totals.items(), key=lambda i: i[1], reverse=True)[:max_stages]
+        details = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in slowest)
+        summary = f"Finished in {self.total_seconds:.1f}s ({details})."
+        if self.extra.get('peak_rss_bytes'):
+            summary += f" Peak memory {self.extra['peak_rss_bytes'] / 2**20:.0f} MB"
+            process_peak = max((p['peak_rss_bytes'] or 0 for p in self.processes), default=0)
+            if process_peak:
+                summary += f" (TiddlyWiki {process_peak / 2**20:.0f} MB)"
+            summary += "."
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return a JSON-serializable representation of the whole trace."
+        return {
+            'started': self.started,
+            'total_seconds': self.total_seconds,
+            'stages': [t.to_dict() for t in self._stages.values()],
+            'processes': self.processes,
+            **self.extra,
+        }
+
+    def write(self, path: str) -> None:
+        "Write the trace to /path/ as JSON."
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class SyncProfiler:
+    """
+    Collect cProfile data for a sync that runs across several threads.
+
+    cProfile only sees the thread that enabled it, so each piece of work
+    is profiled separately with profile() and the results are merged when
+    dumped. When /enabled/ is False, profile() does nothing.
+    """
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self._profiles: List[cProfile.Profile] = []
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        "Context manager profiling the enclosed block, if enabled."
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._profiles.append(profile)
+
+    def dump(self, path: str) -> bool:
+        """
+        Write the merged profile to /path/ in pstats format. Return False if
+        nothing was profiled.
+        """
+        if not self._profiles:
+            return False
+        stats = pstats.Stats(self._profiles[0])
+        for profile in self._profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
@@ -24,19 +24,29 @@ defined by the TwNote subclasses' /model/ class variable.
 from abc import ABC
 import inspect
 from textwrap import dedent
-from typing import Dict, Iterable, List, Optional, Tuple, Type
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, TYPE_CHECKING
 import sys
 
-import aqt
-from anki.consts import MODEL_CLOZE
-from anki.models import Template as AnkiTemplate
-from anki.models import NoteType as AnkiModel
+# The note type definitions are also used outside Anki (see cli.py), so
+# Anki's modules are only imported by the functions that talk to Anki.
+if TYPE_CHECKING:
+    from anki.models import Template as AnkiTemplate
+    from anki.models import NoteType as AnkiModel
 
 
 # Field to hold the unique ID used to maintain synchronization integrity.
 # This must (currently) be the same on all note types used by TiddlyRemember
 # and is defined here to prevent them from getting out of sync.
 ID_FIELD_NAME = 'ID'
+# Field holding the name of the wiki a note comes from, on all note types.
+WIKI_FIELD_NAME = 'Wiki'
+
+
+def _mw() -> Any:
+    "Return Anki's main window, which must be initialized."
+    import aqt
+    assert aqt.mw is not None, "Tried to use models before Anki is initialized!"
+    return aqt.mw
 
 
 class TemplateData(ABC):
@@ -48,10 +58,9 @@ class TemplateData(ABC):
     back: str
 
     @classmethod
-    def to_template(cls) -> AnkiTemplate:
+    def to_template(cls) -> 'AnkiTemplate':
         "Create and return an Anki template object for this model definition."
-        assert aqt.mw is not None, "Tried to use models before Anki is initialized!"
-        mm = aqt.mw.col.models
+        mm = _mw().col.models
         t = mm.newTemplate(cls.name)
         t['qfmt'] = dedent(cls.front).strip()
         t['afmt'] = dedent(cls.back).strip()
@@ -70,10 +79,10 @@ class ModelData(ABC):
     is_cloze: bool
 
     @classmethod
-    def to_model(cls) -> AnkiModel:
+    def to_model(cls) -> 'AnkiModel':
         "Create and return an Anki model object for this model definition."
-        assert aqt.mw is not None, "Tried to use models before Anki is initialized!"
-        mm = aqt.mw.col.models
+        from anki.consts import MODEL_CLOZE
+        mm = _mw().col.models
         model = mm.new(cls.name)
         for i in cls.fields:
             field = mm.newField(i)
@@ -93,8 +102,7 @@ class ModelData(ABC):
         Determine if a model by this name exists already in the current
         Anki collection.
         """
-        assert aqt.mw is not None, "Tried to use models before Anki is initialized!"
-        mm = aqt.mw.col.models
+        mm = _mw().col.models
         model = mm.byName(cls.name)
         return model is not None
 
@@ -133,7 +141,7 @@ class ModelData(ABC):
         return None
 
     @classmethod
-    def verify_integrity(cls, anki_model: AnkiModel) -> None:
+    def verify_integrity(cls, anki_model: 'AnkiModel') -> None:
         """
         Raise an exception if the user has changed the model in a way that will
         interfere with syncing.
@@ -141,6 +149,8 @@ class ModelData(ABC):
         This currently means changing the order or names of fields or
         the type (cloze or regular). Changing the templates is fine and supported.
         """
+        from anki.consts import MODEL_CLOZE
+
         # Verify field names and order.
         anki_fields = ((f['ord'], f['name']) for f in anki_model['flds'])
         for (anki_ord, anki_name), (mod_ord, mod_name) in zip(anki_fields,
@@ -190,7 +200,7 @@ class TiddlyRememberQuestionAnswer(ModelData):
         """
 
     name = "TiddlyRemember Q&A v1"
-    fields = ("Question", "Answer", ID_FIELD_NAME, "Wiki", "Reference", "Permalink")
+    fields = ("Question", "Answer", ID_FIELD_NAME, WIKI_FIELD_NAME, "Reference", "Permalink")
     templates = (TiddlyRememberQuestionAnswerTemplate,)
     styling = """
         .card {
@@ -236,7 +246,7 @@ class TiddlyRememberCloze(ModelData):
         """
 
     name = "TiddlyRemember Cloze v1"
-    fields = ("Text", ID_FIELD_NAME, "Wiki", "Reference", "Permalink")
+    fields = ("Text", ID_FIELD_NAME, WIKI_FIELD_NAME, "Reference", "Permalink")
     templates = (TiddlyRememberClozeTemplate,)
     styling = """
         .card {
@@ -302,10 +312,10 @@ def ensure_note_types() -> None:
     For all note types defined in this file, add them to the collection if
     they aren't in there already.
     """
-    assert aqt.mw is not None, "Tried to use models before Anki is initialized!"
+    mw = _mw()
     for model in _itermodels():
         if not model.in_collection():
-            aqt.mw.col.models.add(model.to_model())
+            mw.col.models.add(model.to_model())
 
 
 def verify_note_types() -> None:
@@ -316,7 +326,7 @@ def verify_note_types() -> None:
     The caller should ensure that all of the TiddlyRemember note types exist in Anki
     (this is checked by name) before calling verify_note_types().
     """
+    mw = _mw()
     for model in _itermodels():
-        assert aqt.mw is not None, "Verified note types before Anki was loaded!"
-        anki_model = aqt.mw.col.models.byName(model.name)
+        anki_model = mw.col.models.byName(model.name)
         model.verify_integrity(anki_model)
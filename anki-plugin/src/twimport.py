@@ -2,42 +2,142 @@
 twimport.py - obtain and render TiddlyWikis and create TiddlyWiki note objects from them
 
 This module's public interface is find_notes(), which, given information
-about a wiki, returns a set of TwNotes that it found in this wiki.
+about a wiki, returns a set of TwNotes that it found in this wiki, and
+iter_notes(), which yields the same notes one tiddler at a time as they are
+parsed, so that callers need not hold a whole wiki's worth of notes at once.
+
+Callers that only want some of a wiki's tiddlers (see watch.py) can use the
+steps iter_notes() is made of directly: local_wiki_file() gets a file or
+URL wiki as a local file, whose tiddlers wikifile.py can read without
+TiddlyWiki; folderify() (or local_wiki_folder(), for both at once) converts
+it to a folder wiki; and iter_tiddler_notes() renders all or some of the
+tiddlers of a folder wiki and yields the notes in each.
+
+With records=True, tiddlers are rendered with RECORDS_TEMPLATE, which
+writes each note as a JSON record instead of as HTML meant for display,
+and the records are decoded rather than scraped (see
+TwNote.notes_from_records()). Notes that may show images are still written
+as HTML, since records only hold text. HTML remains the default.
+
+Either way, the deck and tag mappings are evaluated once for the whole
+wiki, in the same TiddlyWiki run, by MAPPINGS_TEMPLATE, and applied to
+the notes here rather than being rendered into every tiddler.
+
+With read_static=True, iter_notes() reads the notes of simple tiddlers
+straight from the wiki's files and only renders the rest (see
+staticnotes.py); check_static() checks that doing so gives the same notes
+as rendering everything. With candidates=True, it only renders the
+tiddlers that could contain notes at all (see prefilter.py). Both read a
+single-file wiki's store directly, so a file or URL wiki is only converted
+to a folder wiki if there are tiddlers left to render, or if it has deck or
+tag mappings, which TiddlyWiki then evaluates for the notes read this way
+(see _render_mappings()).
 """
+import html
+import json
 import os
+import re
+from collections import deque
 from pathlib import Path
 import requests
+import signal
 import subprocess
 from tempfile import TemporaryDirectory
-from typing import Callable, Optional, Set, Sequence
+import threading
+import time
+from typing import (IO, Any, Callable, Collection, Deque, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Set, Sequence, Tuple)
 import urllib
 
 from bs4 import BeautifulSoup
 
+from . import prefilter
+from . import staticnotes
+from .timing import SyncTrace
 from .twnote import TwNote
-from .util import nowin_startupinfo
+from .util import check_cancelled, maxrss_bytes, nowin_startupinfo, Twid
 
 RENDERED_FILE_EXTENSION = "html"
+TEMPLATE = "$:/plugins/sobjornstad/TiddlyRemember/templates/TiddlyRememberParseable"
+#: Renders each note as a JSON record, with the tiddler's decks and tags.
+RECORDS_TEMPLATE = ("$:/plugins/sobjornstad/TiddlyRemember/templates/"
+                    "TiddlyRememberRecords")
+#: Class of an element RECORDS_TEMPLATE always renders, showing it was used.
+RECORDS_MARKER = "tr-records"
+#: Renders like the template in the variable tr-template if the tiddler
+#: matches the filter in the variable tr-content-filter, and renders
+#: nothing otherwise.
+SUBSET_TEMPLATE = ("$:/plugins/sobjornstad/TiddlyRemember/templates/"
+                   "TiddlyRememberParseableSubset")
+#: Class of an element SUBSET_TEMPLATE always renders, showing it was used.
+SUBSET_MARKER = "tr-subset"
+#: Renders, once per wiki, the decks and tags each tiddler maps to, so the
+#: templates above needn't work them out again for every tiddler (they
+#: skip them when the variable tr-bulk-mappings is 'yes').
+MAPPINGS_TEMPLATE = "$:/plugins/sobjornstad/TiddlyRemember/templates/MappingTable"
+MAPPINGS_FILE = "tr-mappings.json"
+#: The first value in the output of MAPPINGS_TEMPLATE.
+MAPPINGS_MARKER = ["TiddlyRemember mappings", 1]
+
+#: A tiddler's deck (None if it has none) and tags, from its mappings.
+Mapping = Tuple[Optional[str], Set[str]]
+
+#: Renders every tiddler to one file, importing the global macros once for
+#: the whole render instead of once per tiddler as the templates above do.
+BUNDLE_TEMPLATE = "$:/plugins/sobjornstad/TiddlyRemember/templates/TiddlyRememberBundle"
+BUNDLE_FILE = f"tr-bundle.{RENDERED_FILE_EXTENSION}"
+#: Class of an element BUNDLE_TEMPLATE always renders, showing it was used.
+BUNDLE_MARKER = "tr-bundle"
+#: The macros RECORDS_TEMPLATE imports for rendering notes as records.
+RECORDS_MACROS = "$:/plugins/sobjornstad/TiddlyRemember/macros/records"
+#: The macros TEMPLATE imports, rendering notes with only the elements we
+#: read; the ones in the wiki also show labels and links.
+LEAN_MACROS = "$:/plugins/sobjornstad/TiddlyRemember/macros/lean"
+#: BUNDLE_TEMPLATE renders this element, holding the title, before each tiddler.
+_BUNDLE_TIDDLER_RE = re.compile(r'<div class="tr-tiddler">(.*?)</div>', re.DOTALL)
+
+#: Longest list of titles to render that will be passed on the command line
+#: (Windows limits it to 32K characters). Longer lists are loaded into the
+#: wiki as the list field of TITLES_TIDDLER, from TITLES_FILE.
+MAX_TITLE_FILTER_LENGTH = 8000
+TITLES_TIDDLER = "$:/temp/TiddlyRemember/titles"
+TITLES_FILE = "tr-titles.json"
+
+#: How often, in seconds, a running TiddlyWiki command checks whether the
+#: sync has been cancelled.
+CANCEL_POLL_SECONDS = 0.1
+
+#: Lines of a TiddlyWiki command's output kept to report if it fails; the
+#: rest is read and dropped as it comes, rather than held in memory.
+OUTPUT_TAIL_LINES = 100
+#: What node prints when V8 runs out of heap.
+OUT_OF_MEMORY_MARKER = b"JavaScript heap out of memory"
+#: The heap node is taken to have when none is set, in megabytes, to work
+#: out how much to give it after it runs out.
+DEFAULT_NODE_MEMORY_MB = 2048
+#: How many times a TiddlyWiki command that ran out of memory is run again,
+#: with twice the heap each time.
+OUT_OF_MEMORY_RETRIES = 2
+#: Tiddlers rendered per TiddlyWiki run when a wiki that runs out of memory
+#: is rendered a part at a time.
+SHARD_SIZE = 2000
+#: Seconds to wait for a URL wiki's server to accept the connection and,
+#: after that, for each part of the response.
+DOWNLOAD_TIMEOUT_SECONDS = 60
 
 
 def _download_wiki(url: str, target_location: str) -> None:
     """
     Download a wiki from a URL to the path target_location.
     """
-    r = requests.get(url)
+    r = requests.get(url, timeout=DOWNLOAD_TIMEOUT_SECONDS)
     r.raise_for_status()
     with open(target_location, 'wb') as f:
         f.write(r.text.encode('utf-8'))
 
 
-def _folderify_wiki(tw_binary: str, wiki_path: str, output_directory: str) -> None:
-    """
-    Convert a single-file wiki into a folder wiki so we can continue working with it.
-
-    :param tw_binary: Path to the TiddlyWiki node executable.
-    :param wiki_path: Path of the wiki file to convert to a folder.
-    :param output_directory: Directory to place the folder wiki in.
-    """
+def _check_wiki_file(wiki_path: str) -> None:
+    "Raise an exception if /wiki_path/ isn't a file."
     if not os.path.exists(wiki_path):
         raise Exception(f"The wiki file '{wiki_path}' does not exist. "
                         f"Please check your TiddlyRemember configuration.")
@@ -45,60 +145,345 @@ def _folderify_wiki(tw_binary: str, wiki_path: str, output_directory: str) -> No
         raise Exception(f"The wiki file '{wiki_path}' is a folder. If you meant to "
                         f"use a folder wiki, set the 'type' parameter to 'folder'.")
 
+
+def _folderify_wiki(tw_binary: str, wiki_path: str, output_directory: str,
+                    cancel: Optional[threading.Event] = None,
+                    node: Optional['NodeOptions'] = None,
+                    trace: Optional[SyncTrace] = None,
+                    wiki_name: Optional[str] = None) -> None:
+    """
+    Convert a single-file wiki into a folder wiki so we can continue working with it.
+
+    :param tw_binary: Path to the TiddlyWiki node executable.
+    :param wiki_path: Path of the wiki file to convert to a folder.
+    :param output_directory: Directory to place the folder wiki in.
+    :param cancel: Optional event that stops the conversion when set; see
+                   :func:`_invoke_tw_command`.
+    :param node: How to run node, and /trace/ and /wiki_name/ where to record
+                 the run; see :func:`_invoke_tw_command`.
+    """
+    _check_wiki_file(wiki_path)
     cmd = [tw_binary, "--load", wiki_path, "--savewikifolder", output_directory]
-    _invoke_tw_command(cmd, None, "folderify wiki")
+    _invoke_tw_command(cmd, None, "folderify wiki", cancel, node, trace, wiki_name)
 
 
-def _invoke_tw_command(cmd: Sequence[str], wiki_path: Optional[str],
-                       description: str) -> None:
+def _new_process_group() -> Dict[str, Any]:
     """
-    Call the TiddlyWiki node command with the provided arguments and handle errors.
+    Return the keyword arguments to subprocess.Popen() that start the
+    command in a process group of its own, which _kill_process_group() can
+    end as a whole: the 'tiddlywiki' command may be a shell script or batch
+    file starting node, rather than node itself.
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}  # type: ignore
+    else:
+        return {'start_new_session': True}
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    "Kill a process started with _new_process_group(), and everything it started."
+    if os.name == 'nt':
+        try:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           startupinfo=nowin_startupinfo())
+        except OSError:
+            proc.kill()
+    else:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)  # pylint: disable=no-member
+        except ProcessLookupError:
+            pass  # already gone
+    proc.wait()
+
+
+class NodeOptions(NamedTuple):
+    """
+    How to run node for one wiki: the size of its heap in megabytes (None
+    for node's default) and any other flags, from the wiki's 'nodeMemoryMB'
+    and 'nodeFlags' options. They are passed in the NODE_OPTIONS environment
+    variable, as the 'tiddlywiki' command is usually a script starting node.
+    """
+    memory_mb: Optional[int] = None
+    flags: str = ''
+
+    @classmethod
+    def from_conf(cls, wiki_conf: Dict[str, str]) -> 'NodeOptions':
+        """
+        Read the options of a wiki from its configuration.
+
+        >>> NodeOptions.from_conf({'nodeMemoryMB': ' 4096', 'nodeFlags': '--stack-size=2000'})
+        NodeOptions(memory_mb=4096, flags='--stack-size=2000')
+        >>> NodeOptions.from_conf({'nodeMemoryMB': ''})
+        NodeOptions(memory_mb=None, flags='')
+        """
+        memory = str(wiki_conf.get('nodeMemoryMB', '')).strip()
+        if memory and not memory.isdigit():
+            raise Exception(f"The Node.js memory of a wiki must be a number of megabytes, "
+                            f"not '{memory}'. Please check your TiddlyRemember "
+                            f"configuration.")
+        return cls(int(memory) if memory and int(memory) else None,
+                   str(wiki_conf.get('nodeFlags', '')).strip())
+
+    def environment(self) -> Optional[Dict[str, str]]:
+        """
+        Return the environment to run TiddlyWiki in, or None to leave it as
+        ours. Any NODE_OPTIONS already set come first, so ours win.
+        """
+        options = [f"--max-old-space-size={self.memory_mb}"] if self.memory_mb else []
+        options += [self.flags] if self.flags else []
+        if not options:
+            return None
+        env = dict(os.environ)
+        env['NODE_OPTIONS'] = ' '.join(o for o in [env.get('NODE_OPTIONS', ''), *options] if o)
+        return env
+
+    def more_memory(self) -> Optional['NodeOptions']:
+        """
+        Return these options with twice the heap, or None if that would be
+        more memory than the computer has.
+        """
+        memory = 2 * (self.memory_mb or DEFAULT_NODE_MEMORY_MB)
+        physical = _physical_memory_mb()
+        if physical is not None and memory > physical:
+            return None
+        return self._replace(memory_mb=memory)
+
+
+class NodeOutOfMemory(Exception):
+    "A TiddlyWiki command that ran out of memory."
+
+
+def _physical_memory_mb() -> Optional[int]:
+    "Return the memory of the computer in megabytes, or None if we can't tell."
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+    except (AttributeError, ValueError, OSError):  # Windows
+        return None
+
+
+class _OutputReader(threading.Thread):
+    """
+    Read the output of a command as it comes, keeping only the last
+    OUTPUT_TAIL_LINES lines and noting whether node ran out of memory, so
+    that a command writing a lot doesn't fill up memory (or the pipe, which
+    would stall it).
     """
+    def __init__(self, stream: IO[bytes]) -> None:
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.tail: Deque[bytes] = deque(maxlen=OUTPUT_TAIL_LINES)
+        self.out_of_memory = False
+
+    def run(self) -> None:
+        with self.stream:
+            for line in self.stream:
+                self.tail.append(line)
+                if OUT_OF_MEMORY_MARKER in line:
+                    self.out_of_memory = True
+
+    def text(self) -> str:
+        "The last lines of the output."
+        return b''.join(self.tail).decode(errors='replace')
+
+
+def _wait_for_exit(proc: subprocess.Popen, reader: _OutputReader,
+                   cancel: Optional[threading.Event]) -> Optional[int]:
+    """
+    Wait for /proc/ to exit, raising SyncCancelled as soon as /cancel/ is
+    set. Return the peak memory in bytes of the command and the processes it
+    started, or None if the platform can't tell.
+    """
+    while reader.is_alive():
+        reader.join(CANCEL_POLL_SECONDS if cancel is not None else None)
+        check_cancelled(cancel)
+
+    if not hasattr(os, 'wait4'):  # Windows
+        proc.wait()
+        return None
+    # Reaped here rather than by Popen, for the resource usage: which on
+    # Linux includes that of the node process a 'tiddlywiki' script starts.
+    _, status, usage = os.wait4(proc.pid, 0)  # pylint: disable=no-member
+    proc.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                       else os.WEXITSTATUS(status))
+    return maxrss_bytes(usage.ru_maxrss)
+
+
+def _run_tw_command(cmd: Sequence[str], wiki_path: Optional[str], description: str,
+                    cancel: Optional[threading.Event], node: NodeOptions,
+                    trace: Optional[SyncTrace], wiki_name: Optional[str]) -> None:
+    "Run a TiddlyWiki command once; see :func:`_invoke_tw_command`."
+    check_cancelled(cancel)
+    start = time.perf_counter()
     try:
-        proc = subprocess.run(cmd, cwd=wiki_path, stdout=subprocess.PIPE,
-                              stderr=subprocess.STDOUT, check=True,
-                              startupinfo=nowin_startupinfo())
+        proc = subprocess.Popen(cmd, cwd=wiki_path, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, env=node.environment(),
+                                startupinfo=nowin_startupinfo(), **_new_process_group())
     except FileNotFoundError:
         raise Exception(
             f"The TiddlyWiki executable at '{cmd[0]}' was not found. Please set the "
             f"'tiddlywikiBinary' option in your TiddlyRemember configuration to the "
             f"path to your 'tiddlywiki' command. If you do not have TiddlyWiki on "
             f"Node.JS installed on your computer, please install it now.")
-    except subprocess.CalledProcessError as proc:
-        stdout = proc.stdout.decode() if proc.stdout else "(no output)"
+
+    assert proc.stdout is not None, "Started TiddlyWiki without a pipe for its output!"
+    reader = _OutputReader(proc.stdout)
+    reader.start()
+    try:
+        peak_rss = _wait_for_exit(proc, reader, cancel)
+    except BaseException:
+        # Cancelled or interrupted: the command is in its own process group,
+        # so it would otherwise keep running.
+        _kill_process_group(proc)
+        raise
+    if trace is not None:
+        trace.record_process(description, wiki_name, time.perf_counter() - start, peak_rss,
+                             node_memory_mb=node.memory_mb, returncode=proc.returncode)
+
+    if proc.returncode:
+        output = reader.text() or "(no output)"
+        if reader.out_of_memory:
+            limit = f"{node.memory_mb} MB" if node.memory_mb else "the default"
+            raise NodeOutOfMemory(
+                f"TiddlyWiki ran out of memory trying to {description} (heap limit: "
+                f"{limit}). Try setting a larger Node.js memory for this wiki in "
+                f"your TiddlyRemember configuration.\n$ {' '.join(cmd)}\n\n{output}")
         raise Exception(f"Failed to {description}: return code {proc.returncode}.\n"
-                        f"$ {' '.join(proc.cmd)}\n\n{stdout}")
+                        f"$ {' '.join(cmd)}\n\n{output}")
 
 
-def _notes_from_paths(
+def _invoke_tw_command(cmd: Sequence[str], wiki_path: Optional[str],
+                       description: str,
+                       cancel: Optional[threading.Event] = None,
+                       node: Optional[NodeOptions] = None,
+                       trace: Optional[SyncTrace] = None,
+                       wiki_name: Optional[str] = None) -> None:
+    """
+    Call the TiddlyWiki node command with the provided arguments and handle errors.
+
+    If /cancel/ is given and gets set while the command runs, the command
+    and any processes it started are killed and SyncCancelled is raised.
+
+    The command is run with the /node/ options. If node runs out of memory,
+    the command is run again with twice the heap, up to OUT_OF_MEMORY_RETRIES
+    times, before NodeOutOfMemory is raised. Each run is recorded in /trace/,
+    with its wall time and peak memory, under /wiki_name/.
+    """
+    node = node if node is not None else NodeOptions()
+    retries = OUT_OF_MEMORY_RETRIES
+    while True:
+        try:
+            _run_tw_command(cmd, wiki_path, description, cancel, node, trace, wiki_name)
+            return
+        except NodeOutOfMemory:
+            bigger = node.more_memory() if retries else None
+            if bigger is None:
+                raise
+            node = bigger
+            retries -= 1
+
+
+def _iter_paths(
     paths: Sequence[Path],
     wiki_name: str,
-    callback: Optional[Callable[[int, int], None]]) -> Set[TwNote]:
+    callback: Optional[Callable[[int, int], None]],
+    trace: Optional[SyncTrace] = None,
+    seen: Optional[Set[Twid]] = None,
+    records: bool = False,
+    cancel: Optional[threading.Event] = None) -> Iterator[Tuple[str, Set[TwNote]]]:
     """
-    Given an iterable of paths, compile the notes found in all those tiddlers.
+    Given an iterable of paths, parse the tiddlers one at a time, yielding
+    the name of each tiddler and the set of notes found in it.
 
     :param paths: The paths of the tiddlers to generate notes for.
     :param wiki_name: The name/id of the wiki these notes are from.
     :param callback: Optional callable passing back progress. See :func:`find_notes`.
-    :return: A set of all the notes found in the tiddler files passed.
+    :param trace: Optional SyncTrace to record the time spent reading and parsing.
+    :param seen: Optional set of the IDs of notes already found; see
+                 :meth:`TwNote.notes_from_soup`.
+    :param records: Whether the tiddlers were rendered with RECORDS_TEMPLATE
+                    rather than TEMPLATE.
+    :param cancel: Optional event; once it is set, SyncCancelled is raised
+                   before the next tiddler is parsed.
     """
-    notes = set()
+    trace = trace if trace is not None else SyncTrace()
+    parse = TwNote.notes_from_records if records else _notes_from_tiddler
     for index, tiddler in enumerate(paths, 0):
-        with open(tiddler, 'rb') as f:
-            tid_text = f.read().decode()
+        check_cancelled(cancel)
+        with trace.stage("read files", wiki_name) as timing:
+            with open(tiddler, 'rb') as f:
+                tid_text = f.read().decode()
+            timing.count += 1
         tid_name = urllib.parse.unquote(
             tiddler.name[:tiddler.name.find(f".{RENDERED_FILE_EXTENSION}")])
-        notes.update(_notes_from_tiddler(tid_text, wiki_name, tid_name))
+        yield tid_name, parse(tid_text, wiki_name, tid_name, trace, seen)
 
         if callback is not None and not index % 50:
             callback(index+1, len(paths))
 
     if callback is not None:
         callback(len(paths), len(paths))
+
+
+def _iter_bundle(
+    path: Path,
+    wiki_name: str,
+    callback: Optional[Callable[[int, int], None]],
+    trace: Optional[SyncTrace] = None,
+    seen: Optional[Set[Twid]] = None,
+    records: bool = False,
+    cancel: Optional[threading.Event] = None) -> Iterator[Tuple[str, Set[TwNote]]]:
+    """
+    Like :func:`_iter_paths`, but for the single file BUNDLE_TEMPLATE
+    renders all the tiddlers into.
+    """
+    trace = trace if trace is not None else SyncTrace()
+    parse = TwNote.notes_from_records if records else _notes_from_tiddler
+    with trace.stage("read files", wiki_name) as timing:
+        try:
+            with open(path, 'rb') as f:
+                bundle = f.read().decode()
+        except FileNotFoundError:
+            bundle = ''
+        timing.count += 1
+    if BUNDLE_MARKER not in bundle[:200]:
+        raise Exception(f"The TiddlyRemember plugin in the wiki '{wiki_name}' is too old "
+                        f"to render all tiddlers in one pass. Please update it.")
+
+    starts = list(_BUNDLE_TIDDLER_RE.finditer(bundle))
+    for index, start in enumerate(starts):
+        check_cancelled(cancel)
+        end = starts[index+1].start() if index + 1 < len(starts) else len(bundle)
+        tid_name = html.unescape(start.group(1))
+        yield tid_name, parse(bundle[start.end():end], wiki_name, tid_name, trace, seen)
+
+        if callback is not None and not index % 50:
+            callback(index+1, len(starts))
+
+    if callback is not None:
+        callback(len(starts), len(starts))
+
+
+def _notes_from_paths(
+    paths: Sequence[Path],
+    wiki_name: str,
+    callback: Optional[Callable[[int, int], None]],
+    trace: Optional[SyncTrace] = None) -> Set[TwNote]:
+    """
+    Given an iterable of paths, compile the notes found in all those tiddlers.
+    See :func:`_iter_paths` for the parameters.
+
+    :return: A set of all the notes found in the tiddler files passed.
+    """
+    notes: Set[TwNote] = set()
+    for _, tiddler_notes in _iter_paths(paths, wiki_name, callback, trace):
+        notes.update(tiddler_notes)
     return notes
 
 
-def _notes_from_tiddler(tiddler: str, wiki_name: str, tiddler_name: str) -> Set[TwNote]:
+def _notes_from_tiddler(tiddler: str, wiki_name: str, tiddler_name: str,
+                        trace: Optional[SyncTrace] = None,
+                        seen: Optional[Set[Twid]] = None) -> Set[TwNote]:
     """
     Given the text of a tiddler, parse the contents and return a set
     containing all the TwNotes found within that tiddler.
@@ -107,14 +492,72 @@ def _notes_from_tiddler(tiddler: str, wiki_name: str, tiddler_name: str) -> Set[
     :param wiki_name:    The name of the wiki this tiddler comes from,
                          for traceability purposes.
     :param tiddler_name: The name of the tiddler itself, for traceability purposes.
+    :param trace:        Optional SyncTrace to record parsing time in.
+    :param seen:         Optional set of the IDs of notes already found, which
+                         are skipped; see :meth:`TwNote.notes_from_soup`.
     :return: A (possibly empty) set of all the notes found in this tiddler.
     """
-    soup = BeautifulSoup(tiddler, 'html.parser')
-    return TwNote.notes_from_soup(soup, wiki_name, tiddler_name)
+    trace = trace if trace is not None else SyncTrace()
+    with trace.stage("parse html", wiki_name) as timing:
+        soup = BeautifulSoup(tiddler, 'html.parser')
+        timing.count += 1
+    notes = TwNote.notes_from_soup(soup, wiki_name, tiddler_name, trace, seen)
+    # The parse tree is full of reference cycles, so without this it would
+    # linger until the garbage collector next ran. Notes only hold strings.
+    soup.decompose()
+    return notes
+
+
+def _title_list_filter(titles: Collection[str]) -> Optional[str]:
+    """
+    Return a TiddlyWiki filter listing exactly /titles/, or None if that
+    can't be written down (a title contains all the quoting characters)
+    or would make for an unreasonably long command line.
+
+    >>> print(_title_list_filter(['A', 'B]', 'C"]']))
+    [[A]] "B]" 'C"]'
+    >>> _title_list_filter(['A]"' + "'"]) is None
+    True
+    """
+    operands: List[str] = []
+    for title in titles:
+        if ']' not in title:
+            operands.append(f"[[{title}]]")
+        elif '"' not in title:
+            operands.append(f'"{title}"')
+        elif "'" not in title:
+            operands.append(f"'{title}'")
+        else:
+            return None
+    filter_ = ' '.join(operands)
+    return filter_ if len(filter_) <= MAX_TITLE_FILTER_LENGTH else None
+
+
+def _title_list_field(titles: Collection[str]) -> Optional[str]:
+    """
+    Return /titles/ written as the value of a TiddlyWiki list field, or
+    None if one of them can't be written in one.
+
+    >>> print(_title_list_field(['A', 'B C', 'D]']))
+    A [[B C]] D]
+    >>> _title_list_field(['A]] B']) is None
+    True
+    """
+    items: List[str] = []
+    for title in titles:
+        if not title or '[[' in title or ']]' in title or re.search(r'[\r\n]', title):
+            return None
+        items.append(f"[[{title}]]" if re.search(r'[^\S\xa0]', title) else title)
+    return ' '.join(items)
 
 
 def _render_wiki(tw_binary: str, wiki_path: str, output_directory: str,
-                 filter_: str) -> None:
+                 filter_: str, titles: Optional[Collection[str]] = None,
+                 template: str = TEMPLATE, bundle: bool = False,
+                 cancel: Optional[threading.Event] = None,
+                 node: Optional[NodeOptions] = None,
+                 trace: Optional[SyncTrace] = None,
+                 wiki_name: Optional[str] = None) -> None:
     """
     Request that TiddlyWiki render the specified tiddlers as html to a
     location where we can inspect them for notes.
@@ -124,6 +567,22 @@ def _render_wiki(tw_binary: str, wiki_path: str, output_directory: str,
     :param output_directory: Directory to render html files into.
     :param filter_: TiddlyWiki filter describing which tiddlers we want
                     to search for notes.
+    :param titles: If given, render only those of these tiddlers that match
+                   /filter_/. The titles must be listable in a filter or a
+                   list field (see :func:`_title_list_filter` and
+                   :func:`_title_list_field`). A file is still written for
+                   each one that doesn't match the filter, but it is empty.
+    :param template: The template to render each tiddler with.
+    :param bundle: Render all the tiddlers into BUNDLE_FILE with
+                   BUNDLE_TEMPLATE instead of each to its own file. /template/
+                   then only says whether to render notes as records.
+    :param cancel: Optional event that stops the render when set; see
+                   :func:`_invoke_tw_command`.
+    :param node: How to run node, and /trace/ and /wiki_name/ where to record
+                 the run; see :func:`_invoke_tw_command`.
+
+    The decks and tags of the tiddlers are rendered to MAPPINGS_FILE in the
+    same directory; see :func:`_read_mappings`.
     """
     if not os.path.exists(wiki_path):
         raise Exception(f"The wiki folder '{wiki_path}' does not exist. "
@@ -132,24 +591,377 @@ def _render_wiki(tw_binary: str, wiki_path: str, output_directory: str,
         raise Exception(f"The wiki folder '{wiki_path}' is a file. If you meant to "
                         f"use a single-file wiki, set the 'type' parameter to 'file'.")
 
+    title_filter = None
+    load: List[str] = []
+    if titles is not None:
+        title_filter = _title_list_filter(titles)
+        if title_filter is None:
+            field = _title_list_field(titles)
+            assert field is not None, "Tried to render titles that can't be listed!"
+            os.makedirs(output_directory, exist_ok=True)
+            titles_file = os.path.join(output_directory, TITLES_FILE)
+            with open(titles_file, 'w', encoding='utf-8') as f:
+                json.dump([{'title': TITLES_TIDDLER, 'list': field}], f)
+            load = ["--load", titles_file]
+            title_filter = f"[list[{TITLES_TIDDLER}]]"
+
+    if bundle:
+        render = [
+            f"[[{BUNDLE_TEMPLATE}]]",
+            f"[[{BUNDLE_FILE}]]",
+            "text/html",
+            BUNDLE_TEMPLATE,
+            "tr-bundle-filter", title_filter if title_filter is not None else filter_,
+            "tr-content-filter", filter_,
+            "tr-macros", RECORDS_MACROS if template == RECORDS_TEMPLATE else LEAN_MACROS,
+        ]
+    elif title_filter is not None:
+        # The content filter is applied by the template, as --render does not
+        # make variables available to the filter selecting what to render.
+        render = [
+            title_filter,
+            f"[encodeuricomponent[]addsuffix[.{RENDERED_FILE_EXTENSION}]]",
+            "text/html",
+            SUBSET_TEMPLATE,
+            "tr-content-filter", filter_,
+            "tr-template", template,
+        ]
+    else:
+        render = [
+            filter_,
+            f"[encodeuricomponent[]addsuffix[.{RENDERED_FILE_EXTENSION}]]",
+            "text/html",
+            template,
+        ]
+
+    # Both renders run in the same process, so the wiki is only loaded once.
     cmd = [
         tw_binary,
+        *load,
         "--output",
         output_directory,
         "--render",
-        filter_,
-        f"[encodeuricomponent[]addsuffix[.{RENDERED_FILE_EXTENSION}]]",
-        "text/html",
-        "$:/plugins/sobjornstad/TiddlyRemember/templates/TiddlyRememberParseable"
+        f"[[{MAPPINGS_TEMPLATE}]]",
+        f"[[{MAPPINGS_FILE}]]",
+        "text/plain",
+        MAPPINGS_TEMPLATE,
+        "tr-table-filter",
+        title_filter if title_filter is not None else filter_,
+        "--render",
+        *render,
+        "tr-bulk-mappings",
+        "yes",
     ]
-    _invoke_tw_command(cmd, wiki_path, "render wiki")
+    _invoke_tw_command(cmd, wiki_path, "render wiki", cancel, node, trace, wiki_name)
 
 
-def find_notes(
+def _parse_mappings(text: str) -> Optional[Dict[str, Mapping]]:
+    """
+    Parse the output of MAPPINGS_TEMPLATE: a series of JSON arrays, the
+    first being MAPPINGS_MARKER, and the rest ["deck" or "tag", title,
+    value], in the order of the lines of the mappings. Return the deck and
+    tags of each tiddler that has any, or None if /text/ doesn't start with
+    the marker.
+
+    >>> _parse_mappings('["TiddlyRemember mappings",1]\\n["deck","A","D1"] ["deck","A","D2"]'
+    ...                 '\\n["tag","A","t"]\\n["tag","B","u"]')
+    {'A': ('D1', {'t'}), 'B': (None, {'u'})}
+    >>> _parse_mappings('') is None
+    True
+    """
+    decoder = json.JSONDecoder()
+    mappings: Dict[str, Mapping] = {}
+    position = 0
+    first = True
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            break
+        value, position = decoder.raw_decode(text, position)
+        if first:
+            if value != MAPPINGS_MARKER:
+                return None
+            first = False
+            continue
+        kind, title, item = value
+        deck, tags = mappings.get(title, (None, set()))
+        if kind == 'deck':
+            mappings[title] = (deck if deck is not None else item, tags)
+        else:
+            tags.add(item)
+            mappings[title] = (deck, tags)
+    return None if first else mappings
+
+
+def _read_mappings(render_location: str) -> Optional[Dict[str, Mapping]]:
+    """
+    Return the decks and tags rendered by MAPPINGS_TEMPLATE alongside the
+    tiddlers in /render_location/, or None if they weren't rendered (the
+    plugin in the wiki is too old to have the template, and its tiddler
+    templates render each tiddler's mappings themselves).
+    """
+    try:
+        with open(os.path.join(render_location, MAPPINGS_FILE), encoding='utf-8') as f:
+            return _parse_mappings(f.read())
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise Exception(f"Unable to read the deck and tag mappings rendered from the "
+                        f"wiki: {e}. Please check that each line of the mappings is "
+                        f"a valid filter.")
+
+
+def _shards(wiki_folder: str, filter_: str,
+            titles: Optional[Collection[str]]) -> Optional[List[List[str]]]:
+    """
+    Split the tiddlers to render into lists of at most SHARD_SIZE titles,
+    each of which can be rendered by a TiddlyWiki run of its own. Return
+    None if that can't be done: when all the tiddlers are to be rendered,
+    their titles are read from the wiki's files, which only tells which
+    match the content filter if it is the default one.
+    """
+    if titles is None:
+        if filter_.strip() != staticnotes.DEFAULT_CONTENT_FILTER:
+            return None
+        try:
+            titles = [fields['title']
+                      for fields, _ in staticnotes.wiki_tiddlers(wiki_folder)
+                      if fields.get('title') and not fields['title'].startswith('$:/')]
+        except staticnotes.NotStatic:
+            return None
+    ordered = sorted(titles)
+    shards = [ordered[i:i + SHARD_SIZE] for i in range(0, len(ordered), SHARD_SIZE)]
+    if any(_title_list_filter(s) is None and _title_list_field(s) is None for s in shards):
+        return None
+    return shards
+
+
+def _render_or_shard(tw_binary: str, wiki_folder: str, render_location: str,
+                     filter_: str, titles: Optional[Collection[str]], template: str,
+                     bundle: bool, cancel: Optional[threading.Event],
+                     node: Optional[NodeOptions], trace: SyncTrace,
+                     wiki_name: str) -> List[str]:
+    """
+    Render a wiki as :func:`_render_wiki` does, and return the folders it
+    was rendered to: normally just /render_location/.
+
+    If TiddlyWiki runs out of memory even with more heap, the tiddlers are
+    instead rendered a SHARD_SIZE at a time, without BUNDLE_TEMPLATE, each
+    part by a TiddlyWiki run of its own into a subfolder of its own. Its
+    caches then only ever hold the renderings of one part. NodeOutOfMemory
+    is raised if this can't be done (see :func:`_shards`) or wouldn't
+    render any less at once.
+    """
+    try:
+        _render_wiki(tw_binary, wiki_folder, render_location, filter_, titles,
+                     template, bundle, cancel, node, trace, wiki_name)
+        return [render_location]
+    except NodeOutOfMemory:
+        shards = _shards(wiki_folder, filter_, titles)
+        if shards is None or (len(shards) == 1 and not bundle):
+            raise
+
+    folders: List[str] = []
+    for index, shard in enumerate(shards):
+        folder = os.path.join(render_location, f"shard-{index}")
+        os.makedirs(folder)
+        _render_wiki(tw_binary, wiki_folder, folder, filter_, shard, template, False,
+                     cancel, node, trace, wiki_name)
+        folders.append(folder)
+    return folders
+
+
+def _render_mappings(tw_binary: str, wiki_folder: str, filter_: str,
+                     cancel: Optional[threading.Event], node: Optional[NodeOptions],
+                     trace: SyncTrace, wiki_name: str) -> Optional[Dict[str, Mapping]]:
+    """
+    Render only the deck and tag mappings of the tiddlers of a folder wiki
+    matching /filter_/, for notes that were read without rendering the
+    tiddlers themselves. Return None if the wiki's plugin is too old to
+    render them on their own.
+    """
+    with TemporaryDirectory() as output_directory:
+        cmd = [
+            tw_binary,
+            "--output",
+            output_directory,
+            "--render",
+            f"[[{MAPPINGS_TEMPLATE}]]",
+            f"[[{MAPPINGS_FILE}]]",
+            "text/plain",
+            MAPPINGS_TEMPLATE,
+            "tr-table-filter",
+            filter_,
+        ]
+        _invoke_tw_command(cmd, wiki_folder, "render mappings", cancel, node, trace,
+                           wiki_name)
+        return _read_mappings(output_directory)
+
+
+def _apply_mappings(tiddler: str, notes: Iterable[TwNote],
+                    mappings: Dict[str, Mapping]) -> None:
+    "Give the notes found in /tiddler/ the deck and tags it is mapped to."
+    deck, tags = mappings.get(tiddler, (None, set()))
+    for note in notes:
+        note.target_deck = deck
+        note.target_tags = set(tags)
+
+
+def _merge_mappings(
+        parts: Sequence[Optional[Dict[str, Mapping]]]) -> Optional[Dict[str, Mapping]]:
+    """
+    Combine the mappings read from each part of a wiki rendered in parts,
+    which are of different tiddlers, or return None if any are missing.
+    """
+    if any(part is None for part in parts):
+        return None
+    merged: Dict[str, Mapping] = {}
+    for part in parts:
+        merged.update(part or {})
+    return merged
+
+
+def local_wiki_file(wiki_path: str, wiki_type: str, wiki_name: str, tmpdir: str,
+                    trace: Optional[SyncTrace] = None) -> Optional[str]:
+    """
+    Return the path of the file of a single-file wiki: the wiki itself for a
+    file wiki, or a download placed in /tmpdir/ for a URL wiki. Return None
+    for a folder wiki. See :func:`iter_notes` for the other parameters.
+    """
+    trace = trace if trace is not None else SyncTrace()
+    if wiki_type == 'file':
+        _check_wiki_file(wiki_path)
+        return wiki_path
+    elif wiki_type == 'folder':
+        return None
+    elif wiki_type == 'url':
+        downloaded_file = os.path.join(tmpdir, 'wiki.html')
+        with trace.stage("download", wiki_name):
+            _download_wiki(url=wiki_path, target_location=downloaded_file)
+        return downloaded_file
+    else:
+        raise Exception(f"Invalid wiki type '{wiki_type}' -- must be "
+                        f"'file', 'folder', or 'url'.")
+
+
+def folderify(tw_binary: str, wiki_file: str, wiki_name: str, tmpdir: str,
+              trace: Optional[SyncTrace] = None,
+              cancel: Optional[threading.Event] = None,
+              node: Optional[NodeOptions] = None) -> str:
+    """
+    Convert the single-file wiki /wiki_file/ to a folder wiki placed in
+    /tmpdir/, and return its path. See :func:`iter_notes` for the other
+    parameters.
+    """
+    trace = trace if trace is not None else SyncTrace()
+    wiki_folder = os.path.join(tmpdir, 'wikifolder')
+    with trace.stage("folderify", wiki_name):
+        _folderify_wiki(tw_binary, wiki_file, wiki_folder, cancel, node, trace, wiki_name)
+    return wiki_folder
+
+
+def local_wiki_folder(tw_binary: str, wiki_path: str, wiki_type: str, wiki_name: str,
+                      tmpdir: str, trace: Optional[SyncTrace] = None,
+                      cancel: Optional[threading.Event] = None,
+                      node: Optional[NodeOptions] = None) -> str:
+    """
+    Return the path of a folder wiki with the contents of the given wiki:
+    the wiki itself for a folder wiki, or a conversion placed in /tmpdir/
+    for a single-file or URL wiki. See :func:`iter_notes` for the other
+    parameters.
+    """
+    wiki_file = local_wiki_file(wiki_path, wiki_type, wiki_name, tmpdir, trace)
+    if wiki_file is None:
+        return wiki_path
+    return folderify(tw_binary, wiki_file, wiki_name, tmpdir, trace, cancel, node)
+
+
+def iter_tiddler_notes(
+    tw_binary: str, wiki_folder: str, wiki_name: str, filter_: str,
+    titles: Optional[Collection[str]] = None,
+    callback: Optional[Callable[[int, int], None]] = None,
+    trace: Optional[SyncTrace] = None,
+    seen: Optional[Set[Twid]] = None,
+    records: bool = False,
+    bundle: bool = False,
+    cancel: Optional[threading.Event] = None,
+    node: Optional[NodeOptions] = None) -> Iterator[Tuple[str, Set[TwNote]]]:
+    """
+    Render the tiddlers in a folder wiki and yield the title of each
+    tiddler, with the set of notes found in it. If TiddlyWiki runs out of
+    memory, they may be rendered a part at a time (see :func:`_render_or_shard`).
+
+    :param titles: If given, only render these tiddlers (or those of them
+                   matching /filter_/). Every one of them that exists is
+                   yielded, even if it has no notes or doesn't match the
+                   filter, so the caller can tell that its notes are gone.
+    :param seen: If given, notes with IDs in this set are skipped, and the
+                 IDs of the notes yielded are added to it, so that each note
+                 is only parsed and yielded once.
+
+    See :func:`iter_notes` for the other parameters.
+    """
+    trace = trace if trace is not None else SyncTrace()
+    wanted: Optional[Set[str]] = None
+    if (titles is not None and _title_list_filter(titles) is None
+            and _title_list_field(titles) is None):
+        # Titles too oddly named to list; render everything and pick out
+        # the ones asked for.
+        wanted = set(titles)
+        titles = None
+
+    with TemporaryDirectory() as render_location:
+        with trace.stage("render", wiki_name) as timing:
+            folders = _render_or_shard(tw_binary, wiki_folder, render_location, filter_,
+                                       titles, RECORDS_TEMPLATE if records else TEMPLATE,
+                                       bundle, cancel, node, trace, wiki_name)
+            sharded = folders != [render_location]
+            paths = [path for folder in folders
+                     for path in Path(folder).glob(f"*.{RENDERED_FILE_EXTENSION}")]
+            timing.count = len(paths)
+        with trace.stage("read mappings", wiki_name):
+            mappings = _merge_mappings([_read_mappings(f) for f in folders])
+
+        if bundle and not sharded:
+            rendered = _iter_bundle(Path(render_location) / BUNDLE_FILE, wiki_name,
+                                    callback, trace, seen, records, cancel)
+        else:
+            if ((titles is not None or sharded) and paths
+                    and SUBSET_MARKER not in paths[0].read_text(encoding='utf-8')):
+                # Versions of the plugin without SUBSET_TEMPLATE render nothing
+                # at all, which would look like every note had been deleted.
+                raise Exception(f"The TiddlyRemember plugin in the wiki '{wiki_name}' "
+                                f"is too old to sync only some tiddlers. Please "
+                                f"update it.")
+            if (records and titles is None and not sharded and paths
+                    and RECORDS_MARKER not in paths[0].read_text(encoding='utf-8')):
+                raise Exception(f"The TiddlyRemember plugin in the wiki '{wiki_name}' "
+                                f"is too old to render notes as records. Please "
+                                f"update it.")
+            rendered = _iter_paths(paths, wiki_name, callback, trace, seen, records,
+                                   cancel)
+
+        for tiddler, tiddler_notes in rendered:
+            if wanted is not None and tiddler not in wanted:
+                continue
+            if mappings is not None:
+                _apply_mappings(tiddler, tiddler_notes, mappings)
+            yield tiddler, tiddler_notes
+
+
+def iter_notes(
     tw_binary: str, wiki_path: str, wiki_type: str, wiki_name: str, filter_: str,
-    callback: Optional[Callable[[int, int], None]] = None) -> Set[TwNote]:
+    callback: Optional[Callable[[int, int], None]] = None,
+    trace: Optional[SyncTrace] = None,
+    read_static: bool = False,
+    records: bool = False,
+    bundle: bool = False,
+    candidates: bool = False,
+    cancel: Optional[threading.Event] = None,
+    node: Optional[NodeOptions] = None) -> Iterator[TwNote]:
     """
-    Return a set of TwNotes parsed out of a TiddlyWiki.
+    Yield the TwNotes found in a TiddlyWiki, one rendered tiddler at a time.
 
     :param tw_binary: Path to the TiddlyWiki node executable.
     :param wiki_path: Path of the wiki URL, file or folder to render.
@@ -164,31 +976,185 @@ def find_notes(
                       the number of tiddlers processed and the second the total number.
                       It will be called every 50 tiddlers. The first call is made at
                       tiddler 1, once the wiki has been rendered.
+    :param trace:     Optional SyncTrace to record the duration of each stage in.
+    :param read_static: Read the notes of tiddlers that only contain plain
+                      <<remember*>> calls from their files, and render only
+                      the other tiddlers (see staticnotes.py). Wikis where
+                      this can't be done safely are rendered in full.
+    :param records:   Render notes as JSON records rather than HTML. This
+                      needs the current version of the plugin in the wiki.
+    :param bundle:    Render all tiddlers into one file, so that the global
+                      macros are imported once rather than for every tiddler.
+                      This needs the current version of the plugin, and
+                      TiddlyWiki holds the whole rendering in memory at once.
+    :param candidates: Only render the tiddlers whose text could produce
+                      notes (see prefilter.py). This can miss notes made in
+                      ways we can't follow, so a full render should be done
+                      now and then to catch them.
+    :param cancel:    Optional event another thread can set to cancel: a
+                      TiddlyWiki command that is running is killed right
+                      away, reading and parsing stop before the next
+                      tiddler, and SyncCancelled is raised.
+    :param node:      How to run node for this wiki (see NodeOptions). If
+                      it runs out of memory, TiddlyWiki is run again with
+                      more, or renders the wiki a part at a time; each run's
+                      time and peak memory are recorded in /trace/.
 
-    Be aware that more than one TwNote can be returned for a given invocation
-    of <<remember*>> in TiddlyWiki. This is because transclusions can result
-    in the same rendered HTML appearing in multiple places.
+    Each note is yielded only once, even though transclusion can make the
+    same <<remember*>> invocation appear in several rendered tiddlers: the
+    copies found after the first are skipped as soon as their IDs are read.
+    Notes read without rendering come first, so a note transcluded
+    elsewhere is then credited to the tiddler it is written in.
+
+    Rendering happens before the first note is yielded; the rendered files
+    are removed when the generator is exhausted or closed.
     """
+    trace = trace if trace is not None else SyncTrace()
     with TemporaryDirectory() as tmpdir:
-        if wiki_type == 'file':
-            wiki_folder = os.path.join(tmpdir, 'wikifolder')
-            _folderify_wiki(tw_binary, wiki_path, wiki_folder)
-        elif wiki_type == 'folder':
-            wiki_folder = wiki_path
-        elif wiki_type == 'url':
-            downloaded_file = os.path.join(tmpdir, 'wiki.html') 
-            _download_wiki(url=wiki_path, target_location=downloaded_file)
-            wiki_folder = os.path.join(tmpdir, 'wikifolder')
-            _folderify_wiki(tw_binary, downloaded_file, wiki_folder)
-        else:
-            raise Exception(f"Invalid wiki type '{wiki_type}' -- must be "
-                            f"'file', 'folder', or 'url'.")
+        wiki_file = local_wiki_file(wiki_path, wiki_type, wiki_name, tmpdir, trace)
+        # The files read without rendering: those of a folder wiki, or the
+        # single file, which is only converted if anything is left to render.
+        source = wiki_file if wiki_file is not None else wiki_path
+        wiki_folder: Optional[str] = wiki_path if wiki_file is None else None
+        seen: Set[Twid] = set()
+        titles: Optional[List[str]] = None
+        scan: Optional[staticnotes.StaticScan] = None
+        if read_static:
+            with trace.stage("read static notes", wiki_name) as timing:
+                try:
+                    found_static = staticnotes.scan_wiki(source, wiki_name, filter_, seen,
+                                                         cancel)
+                    timing.count = len(found_static.notes)
+                    scan = found_static
+                except staticnotes.NotStatic:
+                    pass
+            if scan is not None and scan.mapped:
+                if wiki_folder is None:
+                    wiki_folder = folderify(tw_binary, source, wiki_name, tmpdir, trace,
+                                            cancel, node)
+                with trace.stage("render mappings", wiki_name):
+                    mappings = _render_mappings(tw_binary, wiki_folder, filter_, cancel,
+                                                node, trace, wiki_name)
+                if mappings is None:
+                    # The plugin can't render the mappings alone, so render
+                    # everything instead.
+                    scan = None
+                    seen.clear()
+                else:
+                    for tiddler, tiddler_notes in scan.notes:
+                        _apply_mappings(tiddler, tiddler_notes, mappings)
+            if scan is not None:
+                for _, tiddler_notes in scan.notes:
+                    yield from tiddler_notes
+                titles = scan.dynamic
+                if not titles:
+                    return
+        if candidates:
+            check_cancelled(cancel)
+            with trace.stage("find candidates", wiki_name) as timing:
+                found = prefilter.find_candidates(source)
+                timing.count = len(found) if found is not None else 0
+            if found is not None:
+                titles = sorted(found if titles is None
+                                else (t for t in titles if t in found))
+                if not titles:
+                    return
 
-        render_location = os.path.join(tmpdir, 'render')
-        _render_wiki(tw_binary, wiki_folder, render_location, filter_)
-        notes = _notes_from_paths(
-            list(Path(render_location).glob(f"*.{RENDERED_FILE_EXTENSION}")),
-            wiki_name,
-            callback)
+        if wiki_folder is None:
+            wiki_folder = folderify(tw_binary, source, wiki_name, tmpdir, trace, cancel, node)
 
-    return notes
+        for _, tiddler_notes in iter_tiddler_notes(tw_binary, wiki_folder, wiki_name,
+                                                   filter_, titles, callback=callback,
+                                                   trace=trace, seen=seen,
+                                                   records=records, bundle=bundle,
+                                                   cancel=cancel, node=node):
+            yield from tiddler_notes
+
+
+def check_static(tw_binary: str, wiki_path: str, wiki_type: str, wiki_name: str,
+                 filter_: str, trace: Optional[SyncTrace] = None,
+                 node: Optional[NodeOptions] = None) -> List[str]:
+    """
+    Compare the notes iter_notes() reads without rendering with those
+    found by rendering the whole wiki, and return a description of each
+    difference (an empty list if there are none). The parameters are as
+    for :func:`iter_notes`.
+
+    Transclusion can show a note in several tiddlers; reading it from the
+    tiddler it is written in is not counted as a difference, as rendering
+    credits it to whichever of those tiddlers happens to be parsed first.
+    """
+    trace = trace if trace is not None else SyncTrace()
+    with TemporaryDirectory() as tmpdir:
+        wiki_file = local_wiki_file(wiki_path, wiki_type, wiki_name, tmpdir, trace)
+        try:
+            with trace.stage("read static notes", wiki_name):
+                scan = staticnotes.scan_wiki(wiki_file if wiki_file is not None
+                                             else wiki_path, wiki_name, filter_)
+        except staticnotes.NotStatic as e:
+            return [f"The notes in {wiki_name} can't be read without rendering: {e}."]
+        wiki_folder = (wiki_path if wiki_file is None
+                       else folderify(tw_binary, wiki_file, wiki_name, tmpdir, trace,
+                                      node=node))
+        if scan.mapped:
+            with trace.stage("render mappings", wiki_name):
+                mappings = _render_mappings(tw_binary, wiki_folder, filter_, None, node,
+                                            trace, wiki_name)
+            if mappings is None:
+                return [f"The TiddlyRemember plugin in {wiki_name} is too old to "
+                        f"render its deck and tag mappings alone. Please update it."]
+            for tiddler, static_notes in scan.notes:
+                _apply_mappings(tiddler, static_notes, mappings)
+
+        rendered: Dict[str, Set[TwNote]] = {}
+        copies: Dict[Twid, List[TwNote]] = {}
+        for tiddler, tiddler_notes in iter_tiddler_notes(tw_binary, wiki_folder,
+                                                         wiki_name, filter_,
+                                                         trace=trace, node=node):
+            rendered[tiddler] = tiddler_notes
+            for note in tiddler_notes:
+                copies.setdefault(note.id_, []).append(note)
+
+    def record(note: TwNote) -> Dict[str, object]:
+        return {k: v for k, v in note.to_record().items() if k != 'reference'}
+
+    differences: List[str] = []
+    for tiddler, static_notes in scan.notes:
+        static_ids = set(n.id_ for n in static_notes)
+        rendered_ids = set(n.id_ for n in rendered.get(tiddler, ()))
+        for id_ in sorted(rendered_ids - static_ids):
+            differences.append(f"{tiddler}: note {id_} was only found by rendering.")
+        for id_ in sorted(static_ids - rendered_ids):
+            differences.append(f"{tiddler}: note {id_} was only found without "
+                               f"rendering.")
+        for note in static_notes:
+            if note.id_ not in rendered_ids:
+                continue
+            matches = [c for c in copies[note.id_] if record(c) == record(note)]
+            if not matches:
+                differences.append(f"{tiddler}: note {note.id_} differs: "
+                                   f"{record(note)} without rendering, "
+                                   f"{record(copies[note.id_][0])} rendered.")
+            elif note.tidref not in set(c.tidref for c in matches):
+                differences.append(f"{tiddler}: note {note.id_} has reference "
+                                   f"{note.tidref!r} without rendering.")
+    return differences
+
+
+def find_notes(
+    tw_binary: str, wiki_path: str, wiki_type: str, wiki_name: str, filter_: str,
+    callback: Optional[Callable[[int, int], None]] = None,
+    trace: Optional[SyncTrace] = None,
+    read_static: bool = False,
+    records: bool = False,
+    bundle: bool = False,
+    candidates: bool = False,
+    cancel: Optional[threading.Event] = None,
+    node: Optional[NodeOptions] = None) -> Set[TwNote]:
+    """
+    Return a set of TwNotes parsed out of a TiddlyWiki. The parameters are
+    as for :func:`iter_notes`.
+    """
+    return set(iter_notes(tw_binary, wiki_path, wiki_type, wiki_name, filter_,
+                          callback, trace, read_static, records, bundle,
+                          candidates, cancel, node))
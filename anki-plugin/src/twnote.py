@@ -2,20 +2,62 @@
 twnote.py - class definitions for TiddlyWiki notes
 
 TiddlyWiki note instances extract and store the data from the rendered HTML
-representation of a TiddlyWiki (see twimport.py).
+representation of a TiddlyWiki (see twimport.py), or from the JSON records
+the TiddlyRememberRecords template renders in place of each note.
 """
 from abc import ABCMeta, abstractmethod, abstractclassmethod
-from typing import Any, List, Optional, Set, Tuple
+import html
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, TYPE_CHECKING
 from urllib.parse import quote as urlquote
 
-from anki.notes import Note
-import aqt
 from bs4 import BeautifulSoup
 
 from .clozeparse import ankify_clozes
-from .trmodels import TiddlyRememberQuestionAnswer, TiddlyRememberCloze, ID_FIELD_NAME
+from .timing import SyncTrace
+from .trmodels import (TiddlyRememberQuestionAnswer, TiddlyRememberCloze, ID_FIELD_NAME,
+                       WIKI_FIELD_NAME)
 from .util import Twid
 
+#: A record rendered by the TiddlyRememberRecords template: a note, as
+#: JSON, or a deck or tag the tiddler maps to, as rendered text.
+_RECORD_RE = re.compile(r'<pre class="tr-(note|deck|tag)">(.*?)</pre>', re.DOTALL)
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+#: A note the records macros rendered as HTML instead, as it may show images.
+_HTML_NOTE_RE = re.compile(r'<div class="remember(?:q|cz)"')
+#: An image in a field, as _text_with_images() writes it.
+IMAGE_RE = re.compile(r'<img src="([^"]*)">')
+
+# Notes are also extracted outside Anki (see cli.py), so Anki's modules may
+# only be imported where an Anki note is actually being worked with.
+if TYPE_CHECKING:
+    from anki.notes import Note
+
+
+class NoteChanges(NamedTuple):
+    "What TwNote.update_fields() wrote to an Anki note."
+    #: The names of the fields that were changed.
+    fields: List[str]
+    #: Whether the tags were changed.
+    tags: bool
+
+    @property
+    def changed(self) -> bool:
+        "Whether anything was changed, so that the note needs to be saved."
+        return bool(self.fields) or self.tags
+
+
+def normalized_tags(tags: List[str]) -> Set[str]:
+    """
+    Return Anki tags in a form that compares equal whenever Anki would
+    consider them the same: in any order, and ignoring case.
+
+    >>> normalized_tags(['b', 'A']) == normalized_tags(['a', 'B', ' '])
+    True
+    """
+    return set(t.lower() for t in tags if t.strip())
+
 
 class TwNote(metaclass=ABCMeta):
     """
@@ -38,11 +80,12 @@ class TwNote(metaclass=ABCMeta):
     within a tiddler.
 
     In addition to the class variable and two classmethods described above,
-    each subclass must override the template instance methods _fields_equal()
-    and _update_fields(), which define when and how Anki notes are created
-    and updated from this TiddlyWiki note; see their docstrings for details.
+    each subclass must override the template instance method _record_fields(),
+    which gives the values of the fields particular to its note type; the
+    fields all note types share are handled here.
     """
     model: Any = None  #: The ModelData class for the Anki note generated by this type
+    record_type: str = ''  #: Name of this type in records produced by to_record()
 
     def __init__(self, id_: Twid, wiki_name: str, tidref: str, 
                  target_tags: Set[str], target_deck: Optional[str]) -> None:
@@ -60,20 +103,108 @@ class TwNote(metaclass=ABCMeta):
         return hash(self.id_)
 
     @classmethod
-    def notes_from_soup(cls, soup: BeautifulSoup,
-                        wiki_name: str, tiddler_name: str) -> Set['TwNote']:
+    def notes_from_soup(cls, soup: BeautifulSoup, wiki_name: str, tiddler_name: str,
+                        trace: Optional[SyncTrace] = None,
+                        seen: Optional[Set[Twid]] = None) -> Set['TwNote']:
         """
         Given soup for a tiddler and the tiddler's name, create notes by calling
         the wants_soup and parse_html methods of each candidate subclass.
+        If a SyncTrace is provided, the time each subclass takes is recorded
+        in it, along with the number of notes it found.
+
+        If a /seen/ set is provided, notes whose IDs are in it are skipped
+        without being parsed, and the IDs of the notes returned are added to
+        it. Passing the same set for every tiddler of a wiki thus gives the
+        same notes as keeping the first of each ID, without the cost of
+        parsing the copies that transclusion produces.
         """
+        trace = trace if trace is not None else SyncTrace()
         notes: Set[TwNote] = set()
         for subclass in cls.__subclasses__():
-            wanted_soup = subclass.wants_soup(soup)  # type: ignore
-            if wanted_soup:
-                notes.update(subclass.parse_html(soup, wiki_name, tiddler_name))  # type: ignore
+            with trace.stage(f"extract {subclass.__name__}", wiki_name) as timing:
+                wanted_soup = subclass.wants_soup(soup)  # type: ignore
+                if wanted_soup:
+                    found = subclass.parse_html(soup, wiki_name, tiddler_name,  # type: ignore
+                                                seen)
+                    timing.count += len(found)
+                    notes.update(found)
         return notes
 
-    def _assert_correct_model(self, anki_note: Note) -> None:
+    @classmethod
+    def notes_from_records(cls, rendered: str, wiki_name: str, tiddler_name: str,
+                           trace: Optional[SyncTrace] = None,
+                           seen: Optional[Set[Twid]] = None) -> Set['TwNote']:
+        """
+        Given a tiddler rendered with the TiddlyRememberRecords template and
+        the tiddler's name, create a note from each record in it with the
+        from_record() method of the subclass named by its type. /trace/ and
+        /seen/ are as for notes_from_soup().
+
+        >>> rendered = ('<pre class="tr-deck">Deck</pre><pre class="tr-note">{"type":'
+        ...             '"rememberq","id":"[1]","question":"Q &amp; A?","answer":"Yes",'
+        ...             '"reference":""}</pre>')
+        >>> TwNote.notes_from_records(rendered, 'wiki', 'Tiddler')
+        {QuestionNote(id_='1', tidref='Tiddler', question='Q & A?', answer='Yes', target_tags=set(), target_deck='Deck')}
+
+        Records hold only text, so notes that may show images are rendered
+        as HTML instead, and parsed as notes_from_soup() would:
+
+        >>> rendered = ('<pre class="tr-deck">Deck</pre><div class="remembercz">'
+        ...             '<span class="cloze-text">A {cat} <img src="cat.png"></span>'
+        ...             '<div class="rid">[2]</div><div class="tr-reference"></div></div>')
+        >>> TwNote.notes_from_records(rendered, 'wiki', 'Tiddler')
+        {ClozeNote(id_='2', tidref='Tiddler', text='A {{c1::cat}} <img src="cat.png">', target_tags=set(), target_deck='Deck')}
+        """
+        trace = trace if trace is not None else SyncTrace()
+        with trace.stage("parse records", wiki_name) as timing:
+            deck: Optional[str] = None
+            tags: Set[str] = set()
+            records: List[str] = []
+            for kind, content in _RECORD_RE.findall(rendered):
+                if kind == 'note':
+                    records.append(html.unescape(content))
+                    continue
+                # Mapped decks and tags are rendered as wikitext, like the
+                # list items the HTML template puts them in.
+                text = html.unescape(_HTML_TAG_RE.sub('', content))
+                if kind == 'deck':
+                    deck = text if deck is None else deck
+                else:
+                    tags.add(text)
+            timing.count += 1
+
+        notes: Set[TwNote] = set()
+        subclasses = {i.record_type: i for i in cls.__subclasses__()}
+        with trace.stage("extract records", wiki_name) as timing:
+            for content in records:
+                try:
+                    record = json.loads(content)
+                    subclass = subclasses[record['type']]
+                except (ValueError, KeyError):
+                    raise Exception(
+                        f"Unable to read a note in the tiddler '{tiddler_name}' of the "
+                        f"wiki '{wiki_name}'. Rendering notes as records needs "
+                        f"TiddlyWiki 5.1.14 or later; if the problem persists, turn "
+                        f"the option off.")
+                id_ = Twid(record['id'].strip().lstrip('[').rstrip(']'))
+                if _already_seen(id_, seen):
+                    continue
+                tidref = record.get('reference', '').strip() or tiddler_name
+                notes.add(subclass.from_record(record, id_, wiki_name, tidref,
+                                               set(tags), deck))
+                timing.count += 1
+
+        if _HTML_NOTE_RE.search(rendered):
+            with trace.stage("parse html", wiki_name) as timing:
+                soup = BeautifulSoup(rendered, 'html.parser')
+                timing.count += 1
+            for note in cls.notes_from_soup(soup, wiki_name, tiddler_name, trace, seen):
+                note.target_deck = deck
+                note.target_tags = set(tags)
+                notes.add(note)
+        return notes
+
+    def _assert_correct_model(self, anki_note: 'Note') -> None:
         """
         Raise an assertion error if the :attr:`anki_note` doesn't match
         the current class's model.
@@ -91,6 +222,7 @@ class TwNote(metaclass=ABCMeta):
         I cannot find further documentation on any issues these may cause.
         Spaces aren't, though, since tags are separated by spaces.
         """
+        import aqt
         assert aqt.mw is not None, "Anki not initialized prior to TiddlyWiki sync!"
         # Canonify seems to be returning empty strings as part of the list,
         # perhaps due to a bug. Strip them so our equality checks don't get
@@ -99,15 +231,66 @@ class TwNote(metaclass=ABCMeta):
             [t.replace(' ', '_') for t in self.target_tags])
         return [i for i in canon if i.strip()]
 
-    def fields_equal(self, anki_note: Note) -> bool:
+    def _field_values(self) -> Dict[str, str]:
+        "Return the value of each of the Anki fields of this note."
+        return {
+            **self._record_fields(),
+            ID_FIELD_NAME: self.id_,
+            WIKI_FIELD_NAME: self.wiki_name,
+            'Reference': self.tidref,
+            'Permalink': self.permalink if self.permalink is not None else "",
+        }
+
+    def _changes(self, anki_note: 'Note') -> Tuple[Dict[str, str], Optional[List[str]]]:
+        """
+        Return the fields of an Anki note that differ from this TwNote's, with
+        this TwNote's values, and this TwNote's tags if they differ from the
+        Anki note's (see :func:`normalized_tags`), or None if they don't.
+        """
+        fields = {name: value for name, value in self._field_values().items()
+                  if anki_note[name] != value}
+        tags = self.anki_tags
+        if normalized_tags(tags) == normalized_tags(anki_note.tags):
+            return fields, None
+        return fields, tags
+
+    def image_sources(self) -> List[str]:
+        """
+        Return the sources of the images in this note's fields (see
+        media.py), each once, in the order they first appear.
+        """
+        return list(dict.fromkeys(html.unescape(src)
+                                  for value in self._record_fields().values()
+                                  for src in IMAGE_RE.findall(value)))
+
+    def replace_images(self, names: Dict[str, str]) -> None:
+        """
+        Point each image whose source is a key of /names/ at the file with
+        the corresponding name in Anki's media folder instead.
+
+        >>> note = QuestionNote('1', 'w', 'T', 'Q <img src="a&amp;b.png">', 'A', set(), None)
+        >>> note.image_sources()
+        ['a&b.png']
+        >>> note.replace_images({'a&b.png': 'tr-1234.png'})
+        >>> note.question
+        'Q <img src="tr-1234.png">'
+        """
+        def replace(match):
+            name = names.get(html.unescape(match.group(1)))
+            return f'<img src="{html.escape(name)}">' if name is not None else match.group(0)
+        self._set_record_fields({name: IMAGE_RE.sub(replace, value)
+                                 for name, value in self._record_fields().items()})
+
+    def fields_equal(self, anki_note: 'Note') -> bool:
         """
         Compare the fields on this TwNote to an Anki note. Return True if all
-        are equal.
+        are equal. Tags are compared as Anki sees them, ignoring order and case.
         """
         self._assert_correct_model(anki_note)
-        return self._fields_equal(anki_note)
+        fields, tags = self._changes(anki_note)
+        return not fields and tags is None
 
-    def model_equal(self, anki_note: Note) -> bool:
+    def model_equal(self, anki_note: 'Note') -> bool:
         """
         Compare the model (note type) defined for this TwNote to that of
         an Anki note. Return True if it is the same model.
@@ -127,20 +310,59 @@ class TwNote(metaclass=ABCMeta):
             base_url += '/'
         self.permalink = base_url + "#" + urlquote(self.tidref)
 
-    def update_fields(self, anki_note: Note) -> None:
+    def to_record(self) -> Dict[str, Any]:
         """
-        Alter the Anki note to match this TiddlyWiki note.
+        Return a JSON-serializable representation of this note, with the
+        contents of its Anki fields under 'fields'.
+        """
+        return {
+            'id': self.id_,
+            'type': self.record_type,
+            'wiki': self.wiki_name,
+            'reference': self.tidref,
+            'permalink': self.permalink,
+            'deck': self.target_deck,
+            'tags': sorted(self.target_tags),
+            'fields': self._record_fields(),
+        }
+
+    def update_fields(self, anki_note: 'Note') -> NoteChanges:
+        """
+        Alter the Anki note to match this TiddlyWiki note, writing only the
+        fields and tags that differ (see :meth:`fields_equal`), and return
+        what was written. If nothing was, the note needn't be saved.
+
+        This is used both when creating new notes (just after defining a
+        blank note and its model) and when updating existing notes.
         """
         self._assert_correct_model(anki_note)
-        self._update_fields(anki_note)
+        fields, tags = self._changes(anki_note)
+        for name, value in fields.items():
+            anki_note[name] = value
+        if tags is not None:
+            anki_note.tags = tags
+        return NoteChanges(list(fields), tags is not None)
 
 
     ### Abstract methods ###
     @abstractclassmethod
-    def parse_html(cls, soup: BeautifulSoup, wiki_name: str, tiddler_name: str):
+    def parse_html(cls, soup: BeautifulSoup, wiki_name: str, tiddler_name: str,
+                   seen: Optional[Set[Twid]] = None):
         """
         Given soup and the name of the wiki and its tiddler, construct and return
         any TwNotes of this subclass's type that can be extracted from it.
+        Notes with IDs in /seen/, if given, are skipped before being parsed
+        further, and the IDs of the notes returned are added to it.
+        """
+        raise NotImplementedError
+
+    @abstractclassmethod
+    def from_record(cls, record: Dict[str, str], id_: Twid, wiki_name: str,
+                    tidref: str, target_tags: Set[str], target_deck: Optional[str]):
+        """
+        Construct a TwNote of this subclass's type from the fields of a
+        rendered record (see notes_from_records()); the other arguments have
+        already been read from the record and the tiddler it is in.
         """
         raise NotImplementedError
 
@@ -154,24 +376,23 @@ class TwNote(metaclass=ABCMeta):
         raise NotImplementedError
 
     @abstractmethod
-    def _fields_equal(self, anki_note: Note) -> bool:
-        "Check whether this TwNote's fields match those of the provided Anki note."
+    def _record_fields(self) -> Dict[str, str]:
+        """
+        Return the content-bearing Anki fields of this note, for to_record()
+        and for creating and updating Anki notes.
+        """
         raise NotImplementedError
 
     @abstractmethod
-    def _update_fields(self, anki_note: Note) -> None:
-        """
-        Update the fields of the provided Anki note to match those of this TwNote.
-
-        This function is used both when creating new notes (just after
-        defining a blank note and its model) and when updating existing notes.
-        """
+    def _set_record_fields(self, fields: Dict[str, str]) -> None:
+        "Set the content-bearing fields of this note, as _record_fields() returns them."
         raise NotImplementedError
 
 
 class QuestionNote(TwNote):
     "A question-and-answer pair, much like Anki's Basic note type."
     model = TiddlyRememberQuestionAnswer
+    record_type = 'rememberq'
 
     def __init__(self, id_: Twid, wiki_name: str, tidref: str,
                  question: str, answer: str,
@@ -186,54 +407,47 @@ class QuestionNote(TwNote):
                 f"target_tags={self.target_tags!r}, target_deck={self.target_deck!r})")
 
     @classmethod
-    def parse_html(cls, soup: BeautifulSoup, wiki_name: str,
-                   tiddler_name: str) -> Set['QuestionNote']:
+    def parse_html(cls, soup: BeautifulSoup, wiki_name: str, tiddler_name: str,
+                   seen: Optional[Set[Twid]] = None) -> Set['QuestionNote']:
         notes = set()
         deck, tags = _get_deck_and_tags(soup)
 
         pairs = soup.find_all("div", class_="rememberq")
         for pair in pairs:
-            question = pair.find("div", class_="rquestion").p.get_text()
-            answer = pair.find("div", class_="ranswer").p.get_text()
-            id_raw = pair.find("div", class_="rid").get_text()
-            id_ = id_raw.strip().lstrip('[').rstrip(']')
+            id_ = _note_id(pair)
+            if _already_seen(id_, seen):
+                continue
+            question = _text_with_images(pair.find("div", class_="rquestion").p)
+            answer = _text_with_images(pair.find("div", class_="ranswer").p)
             tidref = select_tidref(pair.find("div", class_="tr-reference"),
                                    tiddler_name)
             notes.add(cls(id_, wiki_name, tidref, question, answer, tags, deck))
 
         return notes
 
+    @classmethod
+    def from_record(cls, record: Dict[str, str], id_: Twid, wiki_name: str,
+                    tidref: str, target_tags: Set[str],
+                    target_deck: Optional[str]) -> 'QuestionNote':
+        return cls(id_, wiki_name, tidref, record.get('question', ''),
+                   record.get('answer', ''), target_tags, target_deck)
+
     @classmethod
     def wants_soup(cls, soup: BeautifulSoup) -> bool:
         return bool(soup.find("div", class_="rememberq"))
 
-    def _fields_equal(self, anki_note: Note) -> bool:
-        return (
-            self.question == anki_note['Question']
-            and self.answer == anki_note['Answer']
-            and self.id_ == anki_note[ID_FIELD_NAME]
-            and self.wiki_name == anki_note['Wiki']
-            and self.tidref == anki_note['Reference']
-            and (self.permalink or "") == anki_note['Permalink']
-            and self.anki_tags == anki_note.tags
-        )
+    def _record_fields(self) -> Dict[str, str]:
+        return {'Question': self.question, 'Answer': self.answer}
 
-    def _update_fields(self, anki_note: Note) -> None:
-        """
-        Alter the Anki note to match this TiddlyWiki note.
-        """
-        anki_note['Question'] = self.question
-        anki_note['Answer'] = self.answer
-        anki_note['Wiki'] = self.wiki_name
-        anki_note['Reference'] = self.tidref
-        anki_note['Permalink'] = self.permalink if self.permalink is not None else ""
-        anki_note[ID_FIELD_NAME] = self.id_
-        anki_note.tags = self.anki_tags
+    def _set_record_fields(self, fields: Dict[str, str]) -> None:
+        self.question = fields['Question']
+        self.answer = fields['Answer']
 
 
 class ClozeNote(TwNote):
     "A cloze deletion-based note, much like Anki's built-in Cloze note type."
     model = TiddlyRememberCloze
+    record_type = 'remembercz'
 
     def __init__(self, id_: Twid, wiki_name: str, tidref: str, text: str,
                  target_tags: Set[str], target_deck: Optional[str]) -> None:
@@ -246,16 +460,17 @@ class ClozeNote(TwNote):
                 f"target_deck={self.target_deck!r})")
 
     @classmethod
-    def parse_html(cls, soup: BeautifulSoup, wiki_name: str,
-                   tiddler_name: str) -> Set['ClozeNote']:
+    def parse_html(cls, soup: BeautifulSoup, wiki_name: str, tiddler_name: str,
+                   seen: Optional[Set[Twid]] = None) -> Set['ClozeNote']:
         notes = set()
         deck, tags = _get_deck_and_tags(soup)
 
         pairs = soup.find_all(class_="remembercz")
         for pair in pairs:
-            text = pair.find("span", class_="cloze-text").get_text()
-            id_raw = pair.find("div", class_="rid").get_text()
-            id_ = id_raw.strip().lstrip('[').rstrip(']')
+            id_ = _note_id(pair)
+            if _already_seen(id_, seen):
+                continue
+            text = _text_with_images(pair.find("span", class_="cloze-text"))
             tidref = select_tidref(pair.find("div", class_="tr-reference"),
                                    tiddler_name)
             parsed_text = ankify_clozes(text)
@@ -263,27 +478,59 @@ class ClozeNote(TwNote):
 
         return notes
 
+    @classmethod
+    def from_record(cls, record: Dict[str, str], id_: Twid, wiki_name: str,
+                    tidref: str, target_tags: Set[str],
+                    target_deck: Optional[str]) -> 'ClozeNote':
+        return cls(id_, wiki_name, tidref, ankify_clozes(record.get('text', '')),
+                   target_tags, target_deck)
+
     @classmethod
     def wants_soup(cls, soup: BeautifulSoup) -> bool:
-        return bool(soup.find("div", class_="remembercz"))
-
-    def _fields_equal(self, anki_note: Note) -> bool:
-        return (
-            self.text == anki_note['Text']
-            and self.id_ == anki_note[ID_FIELD_NAME]
-            and self.wiki_name == anki_note['Wiki']
-            and self.tidref == anki_note['Reference']
-            and (self.permalink or "") == anki_note['Permalink']
-            and self.anki_tags == anki_note.tags
-        )
-
-    def _update_fields(self, anki_note: Note) -> None:
-        anki_note['Text'] = self.text
-        anki_note[ID_FIELD_NAME] = self.id_
-        anki_note['Wiki'] = self.wiki_name
-        anki_note['Reference'] = self.tidref
-        anki_note['Permalink'] = self.permalink if self.permalink is not None else ""
-        anki_note.tags = self.anki_tags
+        # Inline clozes are rendered as spans rather than divs.
+        return bool(soup.find(class_="remembercz"))
+
+    def _record_fields(self) -> Dict[str, str]:
+        return {'Text': self.text}
+
+    def _set_record_fields(self, fields: Dict[str, str]) -> None:
+        self.text = fields['Text']
+
+
+def _note_id(note_soup: BeautifulSoup) -> Twid:
+    "Given the soup of one rendered note, return its ID."
+    id_raw = note_soup.find("div", class_="rid").get_text()
+    return Twid(id_raw.strip().lstrip('[').rstrip(']'))
+
+
+def _text_with_images(element: BeautifulSoup) -> str:
+    """
+    Return the text of a rendered field, like get_text(), but with each of
+    its images as an <img> tag with just the source, so that it can be
+    copied to Anki's media folder (see media.py). The element is changed.
+
+    >>> soup = BeautifulSoup('<p>A <img class="x" src="a.png" width="9"> B<img></p>',
+    ...                      'html.parser')
+    >>> _text_with_images(soup.p)
+    'A <img src="a.png"> B'
+    """
+    for img in element.find_all('img'):
+        src = img.get('src')
+        img.replace_with(f'<img src="{html.escape(src)}">' if src else '')
+    return element.get_text()
+
+
+def _already_seen(id_: Twid, seen: Optional[Set[Twid]]) -> bool:
+    """
+    Return True if /id_/ is in the set of IDs already parsed, or add it to
+    the set and return False. Without a set, nothing has been seen.
+    """
+    if seen is None:
+        return False
+    if id_ in seen:
+        return True
+    seen.add(id_)
+    return False
 
 
 def _get_deck_and_tags(tiddler_soup: BeautifulSoup) -> Tuple[Optional[str], Set[str]]:
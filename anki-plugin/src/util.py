@@ -3,12 +3,28 @@ util.py - general-purpose functions and definitions used by multiple modules
 """
 import os
 import subprocess
+import sys
+import threading
 from typing import NewType, Optional
 
 
 Twid = NewType('Twid', str)
 
 
+class SyncCancelled(Exception):
+    "Raised in the middle of a sync when the user has asked to cancel it."
+
+
+def check_cancelled(cancel: Optional[threading.Event]) -> None:
+    """
+    Raise SyncCancelled if /cancel/ has been set. Long-running functions
+    taking a /cancel/ event call this between units of work, so that
+    another thread can stop them by setting it.
+    """
+    if cancel is not None and cancel.is_set():
+        raise SyncCancelled("The sync was cancelled.")
+
+
 def pluralize(sg: str, n: int, pl: str = None) -> str:
     """
     Return a string in one of two forms, depending on whether /n/ is 1.
@@ -24,6 +40,58 @@ def pluralize(sg: str, n: int, pl: str = None) -> str:
         return pl
 
 
+def peak_rss() -> Optional[int]:
+    """
+    Return the peak resident set size of this process in bytes, or None
+    if it can't be determined on this platform.
+
+    On Linux this is read from /proc, so that it honors reset_peak_rss().
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def maxrss_bytes(ru_maxrss: int) -> int:
+    "Convert the ru_maxrss of a resource usage to bytes: Linux reports kilobytes, macOS bytes."
+    return ru_maxrss if sys.platform == 'darwin' else ru_maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak reported by peak_rss() to the current memory usage, so
+    that it measures only what happens from now on. This is only possible
+    on Linux; return False if the peak could not be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def user_files_path(filename: str) -> str:
+    """
+    Return the path of /filename/ within the add-on's user_files folder,
+    which Anki preserves when the add-on is upgraded. The folder is created
+    if it doesn't exist yet.
+    """
+    folder = os.path.join(os.path.dirname(__file__), 'user_files')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, filename)
+
+
 def nowin_startupinfo() -> Optional['subprocess.STARTUPINFO']:  # type: ignore
     """
     If running on Windows, return a STARTUPINFO object to be passed to
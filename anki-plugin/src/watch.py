@@ -0,0 +1,477 @@
+"""
+watch.py - sync automatically in the background when a wiki changes
+
+When the 'watchWikis' option is on, a WikiWatcher keeps an eye on every
+configured wiki: folder and file wikis through filesystem notifications
+(with polling of modification times as a fallback, since not every
+platform reports changes to files inside a watched folder), URL wikis by
+checking them every 'watchUrlMinutes' minutes. Once a wiki has stopped
+changing for 'watchDelaySeconds' seconds, the tiddlers that changed are
+found by comparing digests of the wiki's tiddler files (see tiddlers.py), or
+of the tiddlers in the store of a single-file wiki (see wikifile.py).
+Those tiddlers and the ones that depend on them (see depindex.py) are
+rendered, and only the notes they contain or used to contain are synced to
+Anki. As the index only knows what can be read from the tiddlers' text,
+every 'fullRenderEvery'th automatic sync of a wiki renders all of it, as
+does a change to the plugins or tiddlywiki.info of a folder wiki.
+
+The first time a wiki is watched, or if its saved index is out of date,
+the watcher renders it in full to build the index, without changing the
+collection; changes made before then need a regular sync from the Tools
+menu. After that, changes made while Anki was closed are synced as soon as
+the watcher starts.
+
+Rendering and parsing happen in a background thread; only the final
+changes to the collection, which are usually small, are made on the main
+thread, and never while a dialog is open.
+"""
+import os
+from tempfile import TemporaryDirectory
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# pylint: disable=import-error, no-name-in-module
+from aqt.utils import tooltip
+from PyQt5.QtCore import QFileSystemWatcher, QObject, QThread, QTimer
+from PyQt5.QtWidgets import QApplication
+
+from . import ankisync
+from .depindex import TiddlerEntry, WikiIndex, describe
+from .media import MediaImporter
+from .refresh import refresh_after_sync
+from . import tiddlers
+from .timing import SyncTrace
+from . import twimport
+from .twnote import TwNote
+from .util import Twid, user_files_path
+from . import wikifile
+
+#: How often to check local wikis for changes the filesystem didn't report.
+POLL_SECONDS = 10
+#: File in user_files describing the most recent automatic sync.
+TRACE_FILENAME = 'last-auto-sync-trace.json'
+#: How long stopping the watcher waits for work in progress to notice it
+#: has been cancelled before leaving it to finish on its own.
+STOP_WAIT_SECONDS = 5
+#: Files and folders of a folder wiki, besides its tiddlers, that can
+#: change what every tiddler renders to.
+SETUP_FILES = ('tiddlywiki.info',)
+SETUP_FOLDERS = ('plugins', 'themes', 'languages')
+#: Modification time and size of each file of a local wiki.
+Snapshot = Dict[str, Tuple[int, int]]
+
+#: Tasks still running when their watcher was stopped, kept until they
+#: finish so they aren't destroyed while their thread is running.
+_unfinished_tasks: Set['_BackgroundTask'] = set()
+
+
+def snapshot(wiki_type: str, wiki_path: str) -> Tuple[Snapshot, List[str]]:
+    """
+    Return the modification time and size of the files making up a local
+    wiki, and the folders to watch for changes to them. A URL wiki has
+    neither. For a folder wiki, these are its tiddlers and the files that
+    change how they render (see :func:`setup_files`).
+    """
+    files: Snapshot = {}
+    folders: List[str] = []
+    if wiki_type == 'file':
+        try:
+            stat = os.stat(wiki_path)
+            files[wiki_path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            pass
+    elif wiki_type == 'folder':
+        for name in SETUP_FILES:
+            try:
+                stat = os.stat(os.path.join(wiki_path, name))
+                files[os.path.join(wiki_path, name)] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        pending = [os.path.join(wiki_path, name)
+                   for name in (tiddlers.TIDDLERS_FOLDER,) + SETUP_FOLDERS]
+        while pending:
+            folder = pending.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            folders.append(folder)
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files, folders
+
+
+def setup_files(wiki_path: str, files: Snapshot) -> Snapshot:
+    """
+    The part of a folder wiki's snapshot that isn't tiddlers: its
+    tiddlywiki.info and its plugins, themes, and languages. When these
+    change, any tiddler may render differently.
+    """
+    tiddler_folder = os.path.join(wiki_path, tiddlers.TIDDLERS_FOLDER) + os.sep
+    return {path: stat for path, stat in files.items()
+            if not path.startswith(tiddler_folder)}
+
+
+class WikiState:
+    "What the watcher knows about one wiki."
+    def __init__(self, name: str, conf: Dict[str, str]) -> None:
+        self.name = name
+        self.conf = conf
+        #: Files last seen by snapshot(), or None before the first check.
+        self.files: Optional[Snapshot] = None
+        self.digest_cache: tiddlers.DigestCache = {}
+        #: The wiki as of its last sync, or None if it has not been rendered
+        #: in full yet (or its saved index was out of date).
+        self.index: Optional[WikiIndex] = None
+        self.index_loaded = False
+        #: Whether the wiki has changed since it was last synced.
+        self.dirty = True
+        #: Whether the next sync must render every tiddler: the wiki's setup
+        #: (see setup_files()) has changed, or a full render is due.
+        self.render_all = False
+        #: Syncs since every tiddler was last rendered.
+        self.partial_syncs = 0
+
+    def __repr__(self):
+        return f"WikiState(name={self.name!r}, dirty={self.dirty!r})"
+
+
+class WikiUpdate:
+    "Notes extracted in the background from the changed tiddlers of one wiki."
+    def __init__(self, state: WikiState, digests: Dict[str, str]) -> None:
+        self.state = state
+        self.digests = digests
+        #: Whether this is the first render, which builds the index rather
+        #: than syncing anything.
+        self.baseline = state.index is None
+        #: Whether every tiddler was rendered.
+        self.full = self.baseline
+        #: Index entries of the tiddlers that were rendered.
+        self.entries: Dict[str, TiddlerEntry] = {}
+        #: Tiddlers that no longer exist.
+        self.removed: Set[str] = set()
+        self.notes: Dict[Twid, TwNote] = {}
+
+
+def extract_changes(state: WikiState, tw_binary: str, trace: SyncTrace,
+                    records: bool = False, bundle: bool = False,
+                    media: Optional[MediaImporter] = None,
+                    cancel: Optional[threading.Event] = None) -> WikiUpdate:
+    """
+    Find the tiddlers of a wiki that changed since it was last synced, and
+    extract the notes in them and in the tiddlers depending on them -- or
+    in all tiddlers, if the wiki has no up-to-date index. Safe to call from
+    a background thread. /records/ and /bundle/ are as for
+    :func:`twimport.iter_notes`; /media/, if given, stages the images in
+    the notes for the collection. SyncCancelled is raised once /cancel/ is
+    set.
+    """
+    conf = state.conf
+    if not state.index_loaded:
+        with trace.stage("load index", state.name):
+            state.index = WikiIndex.load(state.name, conf)
+        state.index_loaded = True
+
+    with TemporaryDirectory() as tmpdir:
+        wiki_file = twimport.local_wiki_file(conf['path'], conf['type'], state.name,
+                                             tmpdir, trace)
+        texts: Dict[str, str] = {}
+        paths: Dict[str, str] = {}
+        with trace.stage("digest tiddlers", state.name) as timing:
+            if wiki_file is None:
+                update = WikiUpdate(state, tiddlers.tiddler_digests(conf['path'],
+                                                                    state.digest_cache,
+                                                                    cancel))
+                paths = {title: path
+                         for path, (_, titles, _) in state.digest_cache.items()
+                         for title in titles}
+            else:
+                # The store is read again in full each time; there is nothing
+                # like a file per tiddler to tell which parts have changed.
+                update = WikiUpdate(state, wikifile.tiddler_digests(wiki_file, texts,
+                                                                    cancel))
+            timing.count = len(update.digests)
+
+        titles: Optional[Set[str]] = None
+        if state.index is not None:
+            changed, update.removed = state.index.changes(update.digests)
+            titles = (None if state.render_all
+                      else state.index.affected(changed, update.removed))
+            update.full = titles is None
+            if titles is not None and not titles:
+                return update
+
+        node = twimport.NodeOptions.from_conf(conf)
+        folder = (conf['path'] if wiki_file is None
+                  else twimport.folderify(tw_binary, wiki_file, state.name, tmpdir, trace,
+                                          cancel, node))
+        for tiddler, notes in twimport.iter_tiddler_notes(
+                tw_binary, folder, state.name, conf['contentFilter'], titles,
+                trace=trace, records=records, bundle=bundle, cancel=cancel, node=node):
+            text = (tiddlers.tiddler_text(paths[tiddler], tiddler) if tiddler in paths
+                    else texts.get(tiddler, ''))
+            update.entries[tiddler] = describe((n.id_ for n in notes), text)
+            for n in notes:
+                if conf.get('permalink', ''):
+                    n.set_permalink(conf['permalink'])
+                if media is not None:
+                    media.import_images(n, conf)
+                update.notes.setdefault(n.id_, n)
+        # Tiddlers that don't match the content filter may not have been
+        # rendered at all; they have no notes.
+        for title in titles or ():
+            if title in update.digests:
+                update.entries.setdefault(title, describe((), ''))
+    return update
+
+
+class _BackgroundTask(QThread):
+    "Run a function in a background thread, keeping its result or exception."
+    def __init__(self, func: Callable[[], Any]) -> None:
+        super().__init__()
+        self.func = func
+        self.result: Any = None
+        self.exception: Optional[Exception] = None
+
+    def run(self) -> None:
+        try:
+            self.result = self.func()
+        except Exception as e:
+            self.exception = e
+
+
+class WikiWatcher(QObject):
+    """
+    Watch the configured wikis and sync the tiddlers that change, as
+    described in the module docstring.
+    """
+    def __init__(self, mw, conf: Dict[str, Any]) -> None:
+        super().__init__(mw)
+        self.mw = mw
+        self.conf = conf
+        # In the order the sync dialog processes them, for the same handling
+        # of IDs used in more than one wiki.
+        self.states = [WikiState(name, wiki_conf)
+                       for name, wiki_conf in reversed(list(conf['wikis'].items()))
+                       if wiki_conf['path'].strip()]
+
+        self.fs_watcher = QFileSystemWatcher(self)
+        self.fs_watcher.fileChanged.connect(self.check)
+        self.fs_watcher.directoryChanged.connect(self.check)
+
+        self.delay_timer = QTimer(self)
+        self.delay_timer.setSingleShot(True)
+        self.delay_timer.setInterval(int(conf['watchDelaySeconds']) * 1000)
+        self.delay_timer.timeout.connect(self.sync)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(POLL_SECONDS * 1000)
+        self.poll_timer.timeout.connect(self.check)
+
+        self.url_timer = QTimer(self)
+        self.url_timer.setInterval(int(conf['watchUrlMinutes']) * 60 * 1000)
+        self.url_timer.timeout.connect(self.url_changed)
+
+        self.check_task: Optional[_BackgroundTask] = None
+        self.sync_task: Optional[_BackgroundTask] = None
+        #: Set to abandon the sync in progress.
+        self.cancel = threading.Event()
+        self.stopped = False
+
+    def start(self) -> None:
+        "Begin watching, and extract every wiki once to know what's in it."
+        self.poll_timer.start()
+        self.url_timer.start()
+        self.check()
+        self.delay_timer.start()
+
+    def stop(self) -> None:
+        "Stop watching. A sync in progress is cancelled and not applied."
+        self.stopped = True
+        self.cancel.set()
+        for timer in (self.delay_timer, self.poll_timer, self.url_timer):
+            timer.stop()
+        for task in (self.check_task, self.sync_task):
+            if task is not None and not task.wait(STOP_WAIT_SECONDS * 1000):
+                # Its results will be thrown away when it does finish.
+                _unfinished_tasks.add(task)
+                task.finished.connect(lambda task=task: _unfinished_tasks.discard(task))
+        self.deleteLater()
+
+    def check(self, *_args) -> None:
+        "Look for changes to local wikis in the background."
+        if self.check_task is not None or self.stopped:
+            return
+        local = [(s.conf['type'], s.conf['path']) for s in self.states]
+        self.check_task = _BackgroundTask(lambda: [snapshot(*i) for i in local])
+        self.check_task.finished.connect(self._check_done)
+        self.check_task.start()
+
+    def _check_done(self) -> None:
+        task, self.check_task = self.check_task, None
+        assert task is not None, "Check finished without a task!"
+        task.wait()
+        if self.stopped or task.exception is not None:
+            return
+
+        watched = set(self.fs_watcher.files() + self.fs_watcher.directories())
+        for state, (files, folders) in zip(self.states, task.result):
+            if state.files is not None and files != state.files:
+                state.dirty = True
+                self.delay_timer.start()
+                if (state.conf['type'] == 'folder'
+                        and setup_files(state.conf['path'], files)
+                        != setup_files(state.conf['path'], state.files)):
+                    state.render_all = True
+            state.files = files
+            # Editors that save by replacing the file end the watch on it.
+            paths = folders + [p for p in files if state.conf['type'] == 'file']
+            new_paths = [p for p in paths if p not in watched]
+            if new_paths:
+                self.fs_watcher.addPaths(new_paths)
+
+    def url_changed(self) -> None:
+        "URL wikis can't be watched, so assume they have changed now and then."
+        for state in self.states:
+            if state.conf['type'] == 'url':
+                state.dirty = True
+                self.delay_timer.start()
+
+    def sync(self) -> None:
+        "Extract the changes in the background, then apply them."
+        if self.sync_task is not None or self.stopped:
+            return
+        if self._busy():
+            self.delay_timer.start()
+            return
+
+        dirty = [s for s in self.states if s.dirty]
+        if not dirty:
+            return
+        every = int(self.conf.get('fullRenderEvery', 10))
+        for state in dirty:
+            state.dirty = False
+            # The index can't follow every way a tiddler may show another,
+            # so render everything now and then, as a regular sync would.
+            if every > 0 and state.partial_syncs + 1 >= every:
+                state.render_all = True
+        trace = SyncTrace()
+        tw_binary = self.conf['tiddlywikiBinary']
+        records = self.conf.get('renderRecords', False)
+        bundle = self.conf.get('renderBundle', False)
+        media = MediaImporter(self.mw.col.media.dir())
+        self.sync_task = _BackgroundTask(
+            lambda: [extract_changes(s, tw_binary, trace, records, bundle, media,
+                                     self.cancel)
+                     for s in dirty])
+        self.sync_task.finished.connect(lambda: self._sync_done(trace, dirty, media))
+        self.sync_task.start()
+
+    def _busy(self) -> bool:
+        """
+        Whether the collection can't be changed now: it is closed, or a
+        dialog (such as the regular sync) is open and may be changing it.
+        """
+        return self.mw.col is None or QApplication.activeModalWidget() is not None
+
+    def _sync_done(self, trace: SyncTrace, dirty: List[WikiState],
+                   media: MediaImporter) -> None:
+        task, self.sync_task = self.sync_task, None
+        assert task is not None, "Sync finished without a task!"
+        task.wait()
+        if self.stopped:
+            media.discard()
+            return
+        if task.exception is not None:
+            media.discard()
+            for state in dirty:
+                state.dirty = True
+            tooltip(f"TiddlyRemember could not sync automatically: {task.exception}")
+        elif self._busy():
+            # Whatever opened in the meantime may have changed the collection,
+            # so extract the changes again once it is done.
+            media.discard()
+            for state in dirty:
+                state.dirty = True
+        else:
+            self.apply(task.result, trace)
+            media.commit()
+        if any(s.dirty for s in self.states):
+            self.delay_timer.start()
+
+    def apply(self, updates: List[WikiUpdate], trace: SyncTrace) -> None:
+        """
+        Record what the tiddlers of each wiki now contain and sync the
+        notes that were added, changed, or removed in the collection.
+        """
+        old_ids: Set[Twid] = set()
+        for update in updates:
+            state = update.state
+            if update.full:
+                state.render_all = False
+                state.partial_syncs = 0
+            else:
+                state.partial_syncs += 1
+            if state.index is None:
+                state.index = WikiIndex(state.name, state.conf)
+            index = state.index
+            if not update.baseline:
+                forgotten = (set(index.entries) if update.full
+                             else update.removed | set(update.entries))
+                for tiddler in forgotten:
+                    old_ids.update(index.forget(tiddler))
+            index.entries.update(update.entries)
+            index.digests = update.digests
+            with trace.stage("save index", state.name):
+                index.save()
+
+        # Like the sync dialog, give each ID to the first wiki it is found
+        # in; other wikis only have a say once that wiki no longer has it.
+        owner: Dict[Twid, WikiState] = {}
+        for state in self.states:
+            for entry in (state.index.entries.values() if state.index else ()):
+                for twid in entry.notes:
+                    owner.setdefault(twid, state)
+        synced = [u for u in updates if not u.baseline]
+        notes = [n for u in synced
+                 for twid, n in u.notes.items() if owner.get(twid) is u.state]
+        removed = set(i for i in old_ids if i not in owner)
+        only = set(n.id_ for n in notes) | removed
+        if not only:
+            return
+
+        result = ankisync.sync(notes, self.mw, self.conf, trace, only=only)
+        refresh_after_sync(self.mw, result, defer=True)
+        trace.finish()
+        trace.write(user_files_path(TRACE_FILENAME))
+        names = ', '.join(u.state.name for u in synced)
+        tooltip(f"Synced changes from {names}.\n{result.log()}")
+
+
+_watcher: Optional[WikiWatcher] = None
+
+
+def update_watching(mw) -> None:
+    """
+    Start or stop watching wikis to match the add-on's configuration,
+    restarting the watcher if it is already running so it sees any changes
+    to the configuration.
+    """
+    global _watcher  # pylint: disable=global-statement
+    stop_watching()
+    conf = mw.addonManager.getConfig(__name__)
+    if conf.get('watchWikis') and mw.col is not None:
+        _watcher = WikiWatcher(mw, conf)
+        _watcher.start()
+
+
+def stop_watching() -> None:
+    "Stop watching wikis, if we are."
+    global _watcher  # pylint: disable=global-statement
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
@@ -0,0 +1,233 @@
+"""
+wikifile.py - read tiddlers straight from a single-file wiki
+
+A single-file wiki keeps its tiddlers in a store inside the HTML file:
+
+* since TiddlyWiki 5.2.0, in one or more
+  <script class="tiddlywiki-tiddler-store" type="application/json">
+  elements, each holding a JSON array of tiddlers, one object per tiddler;
+* before that, in <div id="storeArea">, holding a <div> for each tiddler
+  with the fields as attributes and the text in a <pre>. Newer versions
+  still write an empty one.
+
+Reading the store ourselves is far cheaper than having TiddlyWiki convert
+the wiki to a folder, so it is used to tell which tiddlers have changed and
+to read the notes of simple tiddlers (see tiddlers.py for folder wikis).
+The file is read a chunk at a time and each tiddler is yielded as soon as
+it has been read, without parsing the rest of the document; the store of
+a large wiki, plugins included, can run to tens of megabytes.
+
+Encrypted wikis, and files that aren't TiddlyWiki 5 wikis, can't be read.
+"""
+import hashlib
+import html
+import json
+import re
+import threading
+from typing import Dict, Iterator, Match, Optional, Pattern, TextIO, Tuple
+
+from .util import check_cancelled
+
+#: Characters read from the file at a time.
+CHUNK_SIZE = 1 << 16
+
+_STORE_START_RE = re.compile(
+    r'<script\b[^>]*\bclass="tiddlywiki-tiddler-store"[^>]*>'
+    r'|<div\b[^>]*\bid="storeArea"[^>]*>'
+    r'|<pre\b[^>]*\bid="encryptedStoreArea"[^>]*>', re.IGNORECASE)
+#: Characters kept from the end of a chunk in which no store starts, so
+#: that a start tag split between two chunks is still found.
+_START_TAG_OVERLAP = 200
+_SPACE_RE = re.compile(r'\s*')
+_SEPARATOR_RE = re.compile(r'[\s,]*')
+_DIV_TIDDLER_RE = re.compile(r'\s*<div\b([^>]*)>(.*)</div>\Z', re.DOTALL)
+_PRE_RE = re.compile(r'\s*<pre>(.*)</pre>\s*\Z', re.DOTALL)
+_ATTRIBUTE_RE = re.compile(r'([^\s=/>]+)\s*=\s*"([^"]*)"')
+
+
+class StoreError(Exception):
+    "A single-file wiki whose tiddlers can't be read."
+
+
+class _Stream:
+    "A text file read a chunk at a time, with the part read but not yet used."
+    def __init__(self, f: TextIO) -> None:
+        self.f = f
+        self.text = ''
+        self.pos = 0
+
+    def read_more(self, size: int = CHUNK_SIZE) -> bool:
+        """
+        Read at least /size/ more characters (up to the end of the file),
+        returning False if there were none left.
+        """
+        chunk = self.f.read(max(size, CHUNK_SIZE))
+        if not chunk:
+            return False
+        if self.pos > CHUNK_SIZE:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        self.text += chunk
+        return True
+
+    def search(self, regex: Pattern, overlap: int) -> Optional[Match]:
+        """
+        Return the next match of /regex/, reading as far as needed, or None
+        at the end of the file. Matches must be no longer than /overlap/.
+        """
+        while True:
+            match = regex.search(self.text, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                return match
+            self.pos = max(self.pos, len(self.text) - overlap)
+            if not self.read_more():
+                return None
+
+    def until(self, end: str) -> Optional[str]:
+        """
+        Return the text up to and including the next occurrence of /end/,
+        reading as far as needed, or None if it doesn't occur again.
+        """
+        searched = 0  # characters after self.pos that don't start /end/
+        while True:
+            index = self.text.find(end, self.pos + searched)
+            if index >= 0:
+                result = self.text[self.pos:index + len(end)]
+                self.pos = index + len(end)
+                return result
+            searched = max(0, len(self.text) - self.pos - len(end) + 1)
+            if not self.read_more(len(self.text) - self.pos):
+                return None
+
+    def next_char(self, skip: Pattern) -> str:
+        """
+        Skip past what /skip/ matches and return the next character without
+        using it, or an empty string at the end of the file.
+        """
+        while True:
+            self.pos = skip.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                return ''
+
+    def decode(self, decoder: json.JSONDecoder) -> object:
+        "Decode the JSON value that comes next, reading as far as needed."
+        while True:
+            try:
+                value, self.pos = decoder.raw_decode(self.text, self.pos)
+                return value
+            except ValueError as e:
+                # Reading as much again as is pending keeps a long tiddler,
+                # such as a plugin, from being decoded over and over.
+                if not self.read_more(len(self.text) - self.pos):
+                    raise StoreError(f"the tiddler store is not valid JSON ({e})")
+
+
+def _json_tiddlers(stream: _Stream,
+                   cancel: Optional[threading.Event]) -> Iterator[Tuple[Dict[str, str], str]]:
+    "Yield the tiddlers of a JSON store, starting just after its <script> tag."
+    decoder = json.JSONDecoder()
+    if stream.next_char(_SPACE_RE) != '[':
+        raise StoreError("the tiddler store does not hold a list of tiddlers")
+    stream.pos += 1
+    while True:
+        check_cancelled(cancel)
+        char = stream.next_char(_SEPARATOR_RE)
+        if char == ']':
+            stream.pos += 1
+            return
+        elif not char:
+            raise StoreError("the tiddler store ends before its last tiddler")
+        tiddler = stream.decode(decoder)
+        if isinstance(tiddler, dict):
+            fields = {k: v if isinstance(v, str) else str(v) for k, v in tiddler.items()}
+            yield fields, fields.pop('text', '')
+
+
+def _div_tiddlers(stream: _Stream,
+                  cancel: Optional[threading.Event]) -> Iterator[Tuple[Dict[str, str], str]]:
+    """
+    Yield the tiddlers of a <div> store, starting just after its opening
+    tag. The text of a tiddler is HTML-escaped, so the first </div> after
+    the start of one ends it.
+    """
+    while True:
+        check_cancelled(cancel)
+        segment = stream.until('</div>')
+        if segment is None:
+            raise StoreError("the tiddler store ends before its last tiddler")
+        match = _DIV_TIDDLER_RE.match(segment)
+        if match is None:
+            return  # the end of the store itself
+        attributes, content = match.groups()
+        fields = {name: html.unescape(value)
+                  for name, value in _ATTRIBUTE_RE.findall(attributes)}
+        pre = _PRE_RE.match(content)
+        yield fields, html.unescape(pre.group(1) if pre is not None else content)
+
+
+def read_tiddlers(wiki_file: str, cancel: Optional[threading.Event] = None
+                  ) -> Iterator[Tuple[Dict[str, str], str]]:
+    """
+    Yield the fields and text of each tiddler in a single-file wiki, in the
+    order they are stored, as tiddlers.read_tid() returns them for a .tid
+    file. Plugins are included, as tiddlers with a plugin-type field whose
+    text holds the plugin's own tiddlers.
+
+    Raise StoreError if the wiki can't be read, and SyncCancelled once
+    /cancel/ is set.
+    """
+    found = False
+    with open(wiki_file, encoding='utf-8', errors='replace', newline='') as f:
+        stream = _Stream(f)
+        while True:
+            start = stream.search(_STORE_START_RE, _START_TAG_OVERLAP)
+            if start is None:
+                break
+            tag = start.group(0).lower()
+            if tag.startswith('<pre'):
+                raise StoreError(f"The wiki '{wiki_file}' is encrypted. TiddlyRemember "
+                                 f"can only read unencrypted wikis.")
+            found = True
+            try:
+                if tag.startswith('<script'):
+                    yield from _json_tiddlers(stream, cancel)
+                else:
+                    yield from _div_tiddlers(stream, cancel)
+            except StoreError as e:
+                raise StoreError(f"Unable to read the tiddlers in '{wiki_file}': {e}. "
+                                 f"The file may be damaged.") from None
+    if not found:
+        raise StoreError(f"No tiddlers were found in '{wiki_file}'. Please check "
+                         f"that it is a TiddlyWiki 5 file.")
+
+
+def is_plugin(fields: Dict[str, str]) -> bool:
+    """
+    Whether a tiddler is a plugin, theme or language, which TiddlyWiki keeps
+    apart from the other tiddlers of a folder wiki.
+    """
+    return bool(fields.get('plugin-type'))
+
+
+def tiddler_digests(wiki_file: str, texts: Optional[Dict[str, str]] = None,
+                    cancel: Optional[threading.Event] = None) -> Dict[str, str]:
+    """
+    Like tiddlers.tiddler_digests(), for a single-file wiki: return a digest
+    of the fields and text of each tiddler, keyed by title.
+
+    :param texts: If given, the text of every tiddler other than plugins
+                  is stored in it, keyed by title.
+    """
+    digests: Dict[str, str] = {}
+    for fields, text in read_tiddlers(wiki_file, cancel):
+        title = fields.get('title', '')
+        if not title:
+            continue
+        digests[title] = hashlib.sha1(
+            json.dumps([fields, text], sort_keys=True).encode('utf-8')).hexdigest()
+        if texts is not None and not is_plugin(fields):
+            texts[title] = text
+    return digests
@@ -0,0 +1,106 @@
+"""
+conftest.py - fixtures shared by the add-on's tests
+
+The add-on's source directory is a package with relative imports, so the
+tests load it the way the benchmarks do (see benchmarks/_support.py), under
+the name 'tiddlyremember'.
+"""
+import importlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+BENCHMARKS = Path(__file__).resolve().parents[1] / 'benchmarks'
+sys.path.insert(0, str(BENCHMARKS))
+
+# pylint: disable=wrong-import-position
+from _support import PACKAGE_NAME, load_addon, tiddlywiki_binary
+
+#: Modules under test beyond those load_addon() imports.
+MODULES = ('depindex', 'media', 'prefilter', 'staticnotes', 'tiddlers', 'wikifile')
+
+
+@pytest.fixture(scope='session')
+def addon() -> ModuleType:
+    "The add-on package, with every module the tests use imported."
+    package = load_addon()
+    for name in MODULES:
+        importlib.import_module(f'{PACKAGE_NAME}.{name}')
+    return package
+
+
+@pytest.fixture
+def tw_binary() -> str:
+    "The TiddlyWiki command to render with; tests needing it are skipped without it."
+    binary = tiddlywiki_binary()
+    if shutil.which(binary) is None:
+        pytest.skip(f"TiddlyWiki ('{binary}') is not installed; set $TIDDLYWIKI")
+    return binary
+
+
+def tid(fields: Dict[str, str], text: str) -> str:
+    "Return the contents of a .tid file with /fields/ and /text/."
+    return ''.join(f"{k}: {v}\n" for k, v in fields.items()) + '\n' + text
+
+
+@pytest.fixture
+def folder_wiki(tmp_path) -> Callable[..., Path]:
+    """
+    A function writing a folder wiki under the test's temporary folder, with
+    a .tid file for each tiddler in /texts/, keyed by title, and any extra
+    /fields/ for it, and returning the wiki's folder.
+    """
+    def write(texts: Dict[str, str],
+              fields: Optional[Dict[str, Dict[str, str]]] = None,
+              name: str = 'wiki') -> Path:
+        folder = tmp_path / name
+        tiddlers_folder = folder / 'tiddlers'
+        tiddlers_folder.mkdir(parents=True)
+        (folder / 'tiddlywiki.info').write_text('{"plugins": []}', encoding='utf-8')
+        for number, (title, text) in enumerate(texts.items()):
+            extra = (fields or {}).get(title, {})
+            (tiddlers_folder / f"{number}.tid").write_text(
+                tid({'title': title, **extra}, text), encoding='utf-8')
+        return folder
+    return write
+
+
+@pytest.fixture
+def file_wiki(tmp_path) -> Callable[..., Path]:
+    """
+    A function writing a single-file wiki under the test's temporary folder
+    with the tiddlers /tiddlers/, each a dict of fields including 'text',
+    in a JSON store as TiddlyWiki 5.2 and later write it, and returning the
+    file's path.
+    """
+    def write(tiddlers: List[Dict[str, str]], name: str = 'wiki.html') -> Path:
+        store = json.dumps(tiddlers).replace('<', '\\u003C')
+        path = tmp_path / name
+        path.write_text(
+            '<!doctype html>\n<html><head><title>Wiki</title></head><body>\n'
+            '<script class="tiddlywiki-tiddler-store" type="application/json">'
+            f'{store}</script>\n'
+            '<div id="storeArea" style="display:none;"></div>\n'
+            '</body></html>\n', encoding='utf-8')
+        return path
+    return write
+
+
+@pytest.fixture
+def user_files(addon, tmp_path, monkeypatch) -> Path:
+    "Keep what the add-on writes to its user_files folder inside a temporary folder."
+    folder = tmp_path / 'user_files'
+    folder.mkdir()
+
+    def user_files_path(filename: str) -> str:
+        return os.path.join(folder, filename)
+
+    for module in (addon.util, addon.depindex, addon.media):
+        monkeypatch.setattr(module, 'user_files_path', user_files_path)
+    return folder
@@ -0,0 +1,60 @@
+"""
+test_ankisync.py - syncing notes to a stand-in collection (see fakeanki.py)
+"""
+import pytest
+
+import fakeanki
+
+CONF = {'defaultDeck': 'Default'}
+
+
+@pytest.fixture
+def mw(addon):
+    # The add-on must be loaded before the fake aqt module is in place, or
+    # it would try to register itself with the fake main window.
+    return fakeanki.install(fakeanki.FakeMainWindow())
+
+
+def question(addon, id_='1', answer='A.', tags=('t',), deck=None):
+    return addon.twnote.QuestionNote(id_, 'w', 'Tiddler', 'Q?', answer, set(tags), deck)
+
+
+def anki_note(mw, addon, id_='1'):
+    nid, = mw.col.find_notes(f'"{addon.trmodels.ID_FIELD_NAME}:{id_}"')
+    return mw.col.getNote(nid)
+
+
+def test_update_fields_writes_only_differences(addon, mw):
+    addon.ankisync.sync([question(addon)], mw, CONF)
+    note = anki_note(mw, addon)
+
+    changes = question(addon).update_fields(note)
+    assert changes == addon.twnote.NoteChanges([], False) and not changes.changed
+    assert question(addon).fields_equal(note)
+
+    changes = question(addon, answer='B.').update_fields(note)
+    assert changes == addon.twnote.NoteChanges(['Answer'], False)
+    assert note['Answer'] == 'B.'
+
+    # Tags are compared as Anki sees them, ignoring case.
+    assert not question(addon, answer='B.', tags=('T',)).update_fields(note).changed
+    changes = question(addon, answer='B.', tags=('t', 'u')).update_fields(note)
+    assert changes == addon.twnote.NoteChanges([], True)
+    assert sorted(note.tags) == ['t', 'u']
+
+
+def test_sync_counts_fields_written(addon, mw):
+    notes = [question(addon, str(i)) for i in range(3)]
+    result = addon.ankisync.sync(notes, mw, CONF)
+    assert (result.added, result.updated, result.removed) == (3, 0, 0)
+
+    notes[1] = question(addon, '1', answer='Changed.')
+    result = addon.ankisync.sync(notes, mw, CONF)
+    assert (result.added, result.updated, result.removed) == (0, 1, 0)
+    assert result.fields_written == 1
+    assert result.fields_kept == len(anki_note(mw, addon, '1').keys()) - 1
+    assert anki_note(mw, addon, '1')['Answer'] == 'Changed.'
+
+    result = addon.ankisync.sync(notes, mw, CONF)
+    assert not result.changed
+    assert (result.updated, result.fields_written) == (0, 0)
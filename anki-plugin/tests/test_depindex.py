@@ -0,0 +1,81 @@
+"""
+test_depindex.py - what to render again after some tiddlers have changed
+"""
+import pytest
+
+CONF = {'type': 'folder', 'path': '/wiki', 'contentFilter': '[!is[system]]'}
+
+
+@pytest.mark.parametrize('text, includes, dynamic', [
+    ('{{A}}', {'A'}, False),
+    ('{{A!!field}} {{B##index}} {{C||Template}}', {'A', 'B', 'C', 'Template'}, False),
+    ('{{{ [tag[x]] }}}', set(), True),
+    ('<$transclude tiddler="D"/> <$tiddler tiddler=\'E\'>', {'D', 'E'}, False),
+    ('<$transclude tiddler={{!!target}}/>', set(), True),
+    ('<$list filter="[tag[x]]"/>', set(), True),
+    ('<<rememberq "1" "Q" "A">> <<remembercz "2" "{x}">>', set(), False),
+    ('<<toc>>', set(), True),
+    ('Plain text', set(), False),
+])
+def test_scan_text(addon, text, includes, dynamic):
+    assert addon.depindex.scan_text(text) == (includes, dynamic)
+
+
+@pytest.fixture
+def index(addon):
+    depindex = addon.depindex
+    index = depindex.WikiIndex('w', CONF)
+    texts = {
+        'Notes': '<<rememberq "1" "Q" "A">>',
+        'Summary': '{{Notes}}',
+        'Index': '{{Summary}}',
+        'Copy': '<<rememberq "1" "Q" "A">>',
+        'Lists': '<$list filter="[tag[x]]"/>',
+        'Plain': 'Nothing to see.',
+    }
+    notes = {'Notes': {'1'}, 'Summary': {'1'}, 'Index': {'1'}, 'Copy': {'1'}}
+    for title, text in texts.items():
+        index.entries[title] = depindex.describe(notes.get(title, ()), text)
+        index.digests[title] = f"digest of {title}"
+    return index
+
+
+def test_changes(index):
+    digests = dict(index.digests, Plain='new digest', New='digest',
+                   **{"Draft of 'Plain'": 'draft', '$:/StoryList': 'story'})
+    del digests['Lists']
+    assert index.changes(digests) == ({'Plain', 'New'}, {'Lists'})
+
+
+def test_affected_follows_transclusions_and_notes(index):
+    # Tiddlers transcluding Notes show its note; so does Copy, which must be
+    # rendered again in case it now credits the note to itself.
+    assert index.affected({'Notes'}, set()) == {'Notes', 'Summary', 'Index', 'Copy', 'Lists'}
+
+
+def test_affected_plain_and_removed(index):
+    assert index.affected({'Plain'}, set()) == {'Plain', 'Lists'}
+    # Summary showed note 1, which the other tiddlers showing it may now
+    # be credited with.
+    assert index.affected(set(), {'Summary'}) == {'Notes', 'Index', 'Copy', 'Lists'}
+    assert index.affected(set(), {'Plain'}) == {'Lists'}
+    assert index.affected(set(), set()) == set()
+
+
+def test_system_tiddlers_render_everything(index):
+    assert index.affected({'$:/config/TiddlyRemember/DeckMapping'}, set()) is None
+    assert index.affected(set(), {'$:/my/macros'}) is None
+
+
+def test_forget(index):
+    assert index.forget('Notes') == {'1'}
+    assert index.forget('Notes') == set()
+
+
+def test_save_and_load(addon, index, user_files):
+    index.save()
+    loaded = addon.depindex.WikiIndex.load('w', CONF)
+    assert loaded is not None
+    assert loaded.to_dict() == index.to_dict()
+    assert addon.depindex.WikiIndex.load('w', dict(CONF, path='/elsewhere')) is None
+    assert addon.depindex.WikiIndex.load('other', CONF) is None
@@ -0,0 +1,42 @@
+"""
+test_prefilter.py - which tiddlers are rendered when only candidates are
+"""
+import pytest
+
+
+def test_candidate_titles(addon):
+    found = addon.prefilter.candidate_titles({
+        'Notes': '<<rememberq "1" "Q" "A">>',
+        'Cloze': '<<remembercz "2" "{x}">>',
+        'Summary': 'See {{Notes}}.',
+        'Index': '<$transclude tiddler="Summary"/>',
+        'Plain': 'Nothing to see.',
+        'Almost': 'remembering and rememberqs',
+        '$:/my/macros': '\\define card(id) <<remembercz "$id$" "{x}">>',
+        '$:/my/more': '\\procedure deck(id) <<card "$id$">>',
+        'Cards': '<<card "3">>',
+        'Deck': '<<deck "4">>',
+        'Lists': '<$list filter="[tag[x]]"/>',
+        'Shows lists': '{{Lists}}',
+    }, unread=['Image.png'])
+    assert found == {'Notes', 'Cloze', 'Summary', 'Index', '$:/my/macros', '$:/my/more',
+                     'Cards', 'Deck', 'Lists', 'Shows lists', 'Image.png'}
+
+
+def test_find_candidates(addon, folder_wiki, file_wiki):
+    texts = {'Notes': '<<rememberq "1" "Q" "A">>', 'Summary': '{{Notes}}',
+             'Plain': 'Nothing to see.'}
+    expected = {'Notes', 'Summary'}
+    assert addon.prefilter.find_candidates(str(folder_wiki(texts))) == expected
+    wiki = file_wiki([{'title': t, 'text': text} for t, text in texts.items()])
+    assert addon.prefilter.find_candidates(str(wiki)) == expected
+
+
+@pytest.mark.parametrize('name, contents', [
+    ('tiddlywiki.files', '{"tiddlers": []}'),
+    ('notes.html', '<p>Unknown</p>'),
+])
+def test_find_candidates_gives_up(addon, folder_wiki, name, contents):
+    wiki = folder_wiki({'Plain': 'Nothing to see.'})
+    (wiki / 'tiddlers' / name).write_text(contents, encoding='utf-8')
+    assert addon.prefilter.find_candidates(str(wiki)) is None
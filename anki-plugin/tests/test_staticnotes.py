@@ -0,0 +1,223 @@
+"""
+test_staticnotes.py - notes read without rendering must match rendered ones
+
+Plain arguments are copied into the lean templates unchanged, so a tiddler
+whose notes staticnotes reads is rendered here by substituting its
+arguments into the macros of tw-plugin/macros/lean.tid, and the notes
+parsed from that HTML are compared with those read from the wikitext.
+test_check_static_against_tiddlywiki does the same with TiddlyWiki itself,
+where it is installed.
+"""
+import html
+import re
+from typing import Dict, Set, Tuple
+
+import pytest
+
+from _support import TW_PLUGIN_SOURCE
+
+_DEFINE_RE = re.compile(r'^\\define (\w+)\(.*?\)\n(.*?)\n\\end', re.MULTILINE | re.DOTALL)
+_MODE_BRANCH_RE = re.compile(
+    r'<\$list filter="\[\[\$mode\$\](!?)match\[inline\]\]">\s*(.*?)\s*</\$list>', re.DOTALL)
+_REFERENCE = '<$text text=<<__reference__>>/>'
+
+LEAN_MACROS = dict(_DEFINE_RE.findall(
+    (TW_PLUGIN_SOURCE / 'macros' / 'lean.tid').read_text(encoding='utf-8')))
+
+
+def render_lean(macro: str, **args: str) -> str:
+    """
+    Return what TiddlyWiki renders a call to a lean TiddlyRemember macro
+    with the plain-text arguments /args/ to.
+    """
+    body = LEAN_MACROS[macro]
+    if macro == 'remembercz':
+        inline = args.get('mode') == 'inline'
+        body = next(branch for negated, branch in _MODE_BRANCH_RE.findall(body)
+                    if bool(negated) != inline)
+    body = body.replace(_REFERENCE, html.escape(args.get('reference', '')))
+    return re.sub(r'\$(\w+)\$', lambda m: args.get(m.group(1), ''), body)
+
+
+def call(macro: str, **args: str) -> str:
+    "Return the wikitext calling /macro/ with the named arguments /args/."
+    return f"<<{macro} " + ' '.join(f'{k}:"{v}"' for k, v in args.items()) + '>>'
+
+
+def fields(notes: Set) -> Set[Tuple]:
+    "What a set of notes would put in Anki, for comparison."
+    return set((n.id_, n.wiki_name, n.tidref, n.target_deck, frozenset(n.target_tags),
+                tuple(sorted(n.to_record()['fields'].items()))) for n in notes)
+
+
+CALLS = [
+    ('rememberq', {'id': '1', 'question': 'What is 2 + 2?', 'answer': '4'}),
+    ('rememberq', {'id': '2', 'question': "What's the capital of France?",
+                   'answer': 'Paris', 'reference': 'Geography'}),
+    ('rememberq', {'id': '3', 'question': 'A: B | C', 'answer': 'Ratio (1/2) = 50%'}),
+    ('remembercz', {'id': '4', 'text': '{Paris} is the capital of {c2::France}'}),
+    ('remembercz', {'id': '5', 'text': 'An {inline} cloze', 'mode': 'inline'}),
+    ('remembercz', {'id': '6', 'text': 'A {cloze|with a hint}', 'reference': 'Other'}),
+]
+
+
+@pytest.mark.parametrize('macro, args', CALLS, ids=[a['id'] for _, a in CALLS])
+def test_static_notes_match_rendered(addon, macro, args):
+    text = f"Some prose.\n\n{call(macro, **args)}\n\nMore prose."
+    static = addon.staticnotes.notes_from_text(text, 'w', 'Tiddler')
+    assert static is not None
+    rendered = addon.twimport._notes_from_tiddler(
+        f"<p>Some prose.</p>{render_lean(macro, **args)}<p>More prose.</p>", 'w', 'Tiddler')
+    assert fields(static) == fields(rendered)
+    assert len(static) == 1
+
+
+def test_positional_and_named_arguments(addon):
+    text = ('<<rememberq "1" "Q?" "A.">>\n'
+            "<<rememberq id:'2' answer:[[A2]] 'Q2?'>>\n"
+            '<<remembercz """3""" "{x} and {y}" block R>>')
+    rendered = (render_lean('rememberq', id='1', question='Q?', answer='A.')
+                + render_lean('rememberq', id='2', question='Q2?', answer='A2')
+                + render_lean('remembercz', id='3', text='{x} and {y}', reference='R'))
+    assert (fields(addon.staticnotes.notes_from_text(text, 'w', 'T'))
+            == fields(addon.twimport._notes_from_tiddler(rendered, 'w', 'T')))
+
+
+@pytest.mark.parametrize('text', [
+    '<<rememberq "1" "Q?" "A \'\'bold\'\' answer">>',
+    '<<rememberq "1" "Q?" "A [[link]]">>',
+    '<<rememberq "1" "Q?" "&amp;">>',
+    '<<rememberq "1" "Q?" "* a list">>',
+    '<<rememberq "1" "Q?" "A--B">>',
+    '<<rememberq "1" "<<var>>" "A">>',
+    '<<rememberq " 1" "Q?" "A">>',
+    '<<rememberq "" "Q?" "A">>',
+    '<<rememberq "1" "Q?" "A">> {{Other}}',
+    '<<rememberq "1" "Q?" "A">> <$list filter="[tag[x]]"/>',
+    '<<rememberq "1" "Q?" "A">> <<othermacro>>',
+    '\\define x() y\n<<rememberq "1" "Q?" "A">>',
+    '<!-- <<rememberq "1" "Q?" "A">> -->',
+    '```\n<<rememberq "1" "Q?" "A">>\n```',
+    '<div class="rememberq">fake</div>',
+])
+def test_tiddlers_needing_rendering(addon, text):
+    assert addon.staticnotes.notes_from_text(text, 'w', 'T') is None
+
+
+def test_tiddler_without_notes(addon):
+    assert addon.staticnotes.notes_from_text('Just //prose//.', 'w', 'T') == set()
+
+
+def scan(addon, path, seen=None, filter_=None):
+    "Scan a wiki, returning the notes by title and the dynamic titles."
+    staticnotes = addon.staticnotes
+    result = staticnotes.scan_wiki(str(path), 'w', filter_ or staticnotes.DEFAULT_CONTENT_FILTER,
+                                   seen)
+    notes: Dict[str, Set[str]] = {title: set(n.id_ for n in found)
+                                  for title, found in result.notes}
+    return notes, set(result.dynamic), result.mapped
+
+
+WIKI = {
+    'Static': '<<rememberq "1" "Q?" "A.">> <<remembercz "2" "{c}">>',
+    'Plain': 'Nothing to see.',
+    'Transcluding': '{{Static}}',
+    'Formatted': "<<rememberq \"3\" \"Q?\" \"''A''\">>",
+    '$:/my/system': '<<rememberq "4" "Q?" "A.">>',
+}
+
+
+def test_scan_folder_wiki(addon, folder_wiki):
+    notes, dynamic, mapped = scan(addon, folder_wiki(WIKI))
+    assert notes == {'Static': {'1', '2'}, 'Plain': set()}
+    assert dynamic == {'Transcluding', 'Formatted'}
+    assert not mapped
+
+
+def test_scan_skips_seen_notes(addon, folder_wiki):
+    seen = {'1'}
+    notes, _, _ = scan(addon, folder_wiki(WIKI), seen)
+    assert notes['Static'] == {'2'}
+    assert seen == {'1', '2'}
+
+
+def test_scan_leaves_other_types_out(addon, folder_wiki):
+    wiki = folder_wiki({'Static': '<<rememberq "1" "Q?" "A.">>',
+                        'Markdown': '<<rememberq "2" "Q?" "A.">>'},
+                       {'Markdown': {'type': 'text/x-markdown'}})
+    notes, dynamic, _ = scan(addon, wiki)
+    assert notes == {'Static': {'1'}} and not dynamic
+
+
+@pytest.mark.parametrize('title, text', [
+    ('$:/config/TiddlyRemember/DeckMapping', '[tag[x]] Deck'),
+    ('$:/config/TiddlyRemember/TagMapping', '[tag[x]] tag'),
+])
+def test_scan_reports_mappings(addon, folder_wiki, title, text):
+    staticnotes = addon.staticnotes
+    wiki = folder_wiki({'Static': '<<rememberq "1" "Q?" "A.">>', title: text})
+    result = staticnotes.scan_wiki(str(wiki), 'w', staticnotes.DEFAULT_CONTENT_FILTER)
+    assert result.mapped
+    (found_in, (note,)), = result.notes
+    assert found_in == 'Static'
+    # twimport applies the mappings, which only TiddlyWiki can evaluate.
+    assert note.target_deck is None and not note.target_tags
+
+
+def test_scan_ignores_empty_mappings(addon, folder_wiki):
+    _, _, mapped = scan(addon, folder_wiki({
+        'Static': '<<rememberq "1" "Q?" "A.">>',
+        '$:/config/TiddlyRemember/DeckMapping': '\n'}))
+    assert not mapped
+
+
+def test_scan_lists_tiddlers_it_cannot_read(addon, folder_wiki):
+    wiki = folder_wiki({'Static': '<<rememberq "1" "Q?" "A.">>'})
+    (wiki / 'tiddlers' / 'Data.json').write_text(
+        '[{"title": "From JSON", "text": "<<rememberq \\"2\\" \\"Q\\" \\"A\\">>"}]',
+        encoding='utf-8')
+    notes, dynamic, _ = scan(addon, wiki)
+    assert notes == {'Static': {'1'}} and dynamic == {'From JSON'}
+
+
+def test_scan_refuses_wikis_it_cannot_follow(addon, folder_wiki):
+    staticnotes = addon.staticnotes
+    wiki = folder_wiki({'Static': '<<rememberq "1" "Q?" "A.">>'})
+    with pytest.raises(staticnotes.NotStatic):
+        scan(addon, wiki, filter_='[tag[Notes]]')
+
+    (wiki / 'tiddlers' / 'tiddlywiki.files').write_text('{"tiddlers": []}', encoding='utf-8')
+    with pytest.raises(staticnotes.NotStatic):
+        scan(addon, wiki)
+
+    redefined = folder_wiki({'$:/my/macros': '\\define rememberq(id) $id$'},
+                            {'$:/my/macros': {'tags': '$:/tags/Macro'}}, name='redefined')
+    with pytest.raises(staticnotes.NotStatic):
+        scan(addon, redefined)
+
+    including = folder_wiki({'Static': '<<rememberq "1" "Q?" "A.">>'}, name='including')
+    (including / 'tiddlywiki.info').write_text('{"includeWikis": ["../other"]}',
+                                               encoding='utf-8')
+    with pytest.raises(staticnotes.NotStatic):
+        scan(addon, including)
+
+
+def test_scan_single_file_wiki(addon, file_wiki):
+    plugin = {'title': '$:/plugins/someone/Plugin', 'plugin-type': 'plugin',
+              'type': 'application/json',
+              'text': '{"tiddlers": {"$:/plugins/someone/Plugin/readme": {"text": "x"}}}'}
+    wiki = file_wiki([{'title': title, 'text': text} for title, text in WIKI.items()]
+                     + [plugin])
+    notes, dynamic, mapped = scan(addon, wiki)
+    assert notes == {'Static': {'1', '2'}, 'Plain': set()}
+    assert dynamic == {'Transcluding', 'Formatted'}
+    assert not mapped
+
+
+def test_check_static_against_tiddlywiki(addon, tw_binary, tmp_path):
+    import wikigen
+    spec = wikigen.WikiSpec(tiddlers=40, transclusion_depth=2, deck_mappings=1)
+    wiki = wikigen.write_folder_wiki(spec, tmp_path / 'generated')
+    assert addon.twimport.check_static(
+        tw_binary, str(wiki), 'folder', 'generated',
+        addon.staticnotes.DEFAULT_CONTENT_FILTER) == []
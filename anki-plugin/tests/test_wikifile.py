@@ -0,0 +1,85 @@
+"""
+test_wikifile.py - reading tiddlers straight from a single-file wiki
+"""
+import threading
+
+import pytest
+
+TIDDLERS = [
+    {'title': 'Notes', 'tags': '[[Long tag]] x', 'text': '<<rememberq "1" "Q" "A">>'},
+    {'title': 'Markup', 'text': '<div class="x">A & B</div>\n</script>'},
+    {'title': 'No text', 'created': '20200101000000000'},
+    {'title': '$:/plugins/someone/Plugin', 'plugin-type': 'plugin',
+     'type': 'application/json', 'text': '{"tiddlers": {}}'},
+]
+
+
+def read(addon, path, **kwargs):
+    return list(addon.wikifile.read_tiddlers(str(path), **kwargs))
+
+
+def test_json_store(addon, file_wiki):
+    tiddlers = read(addon, file_wiki(TIDDLERS))
+    assert [fields['title'] for fields, _ in tiddlers] == [t['title'] for t in TIDDLERS]
+    assert [text for _, text in tiddlers] == [t.get('text', '') for t in TIDDLERS]
+    assert 'text' not in tiddlers[0][0]
+    assert tiddlers[0][0]['tags'] == '[[Long tag]] x'
+
+
+def test_json_store_read_in_chunks(addon, file_wiki, monkeypatch):
+    long_text = 'x' * 10000 + '<<rememberq "1" "Q" "A">>'
+    wiki = file_wiki(TIDDLERS + [{'title': 'Long', 'text': long_text}])
+    monkeypatch.setattr(addon.wikifile, 'CHUNK_SIZE', 7)
+    tiddlers = read(addon, wiki)
+    assert tiddlers[-1] == ({'title': 'Long'}, long_text)
+    assert len(tiddlers) == len(TIDDLERS) + 1
+
+
+def test_div_store(addon, tmp_path):
+    wiki = tmp_path / 'old.html'
+    wiki.write_text(
+        '<html><body><div id="storeArea" style="display:none;">\n'
+        '<div title="Notes" tags="x"><pre>&lt;&lt;rememberq "1" "Q" "A &amp; B"&gt;&gt;</pre></div>\n'
+        '<div created="20200101000000000" title="Empty &quot;one&quot;"><pre></pre></div>\n'
+        '</div></body></html>', encoding='utf-8')
+    assert read(addon, wiki) == [
+        ({'title': 'Notes', 'tags': 'x'}, '<<rememberq "1" "Q" "A & B">>'),
+        ({'created': '20200101000000000', 'title': 'Empty "one"'}, ''),
+    ]
+
+
+@pytest.mark.parametrize('contents', [
+    '<html><body><p>Not a wiki</p></body></html>',
+    '<pre id="encryptedStoreArea" type="text/plain">{"iv":"..."}</pre>',
+    '<script class="tiddlywiki-tiddler-store" type="application/json">[{"title": "A"',
+    '<script class="tiddlywiki-tiddler-store" type="application/json">{"title": "A"}</script>',
+])
+def test_unreadable_files(addon, tmp_path, contents):
+    wiki = tmp_path / 'bad.html'
+    wiki.write_text(contents, encoding='utf-8')
+    with pytest.raises(addon.wikifile.StoreError):
+        read(addon, wiki)
+
+
+def test_cancel(addon, file_wiki):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(addon.util.SyncCancelled):
+        read(addon, file_wiki(TIDDLERS), cancel=cancel)
+
+
+def test_is_plugin(addon):
+    assert addon.wikifile.is_plugin(TIDDLERS[-1])
+    assert not addon.wikifile.is_plugin(TIDDLERS[0])
+
+
+def test_tiddler_digests(addon, file_wiki):
+    wikifile = addon.wikifile
+    texts = {}
+    digests = wikifile.tiddler_digests(str(file_wiki(TIDDLERS)), texts)
+    assert set(digests) == set(t['title'] for t in TIDDLERS)
+    assert set(texts) == set(digests) - {'$:/plugins/someone/Plugin'}
+
+    edited = [dict(TIDDLERS[0], text='<<rememberq "1" "Q" "B">>')] + TIDDLERS[1:]
+    changed = wikifile.tiddler_digests(str(file_wiki(edited, name='edited.html')))
+    assert [t for t in digests if digests[t] != changed[t]] == ['Notes']